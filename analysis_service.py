@@ -0,0 +1,423 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from board_representation import ChessBoard
+from fen_handling import InvalidFEN, fen_to_position
+from memory_budget import DEFAULT_MEMORY, MemoryBudget
+from notation_handling import move_to_uci
+from pgn_handling import move_to_san
+from search_algorithms import SearchContext, SearchLimits
+
+DEFAULT_DEPTH = 3  # Used when a request gives no limits at all
+DEFAULT_TIMEOUT = 30.0  # Seconds a request may wait, queueing included
+MAXIMUM_REQUEST_BYTES = 65536
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    504: "Gateway Timeout",
+}
+
+
+def analyse_position(
+    context, request, stop_event
+):  # Runs in a worker process, searching one position under the request's limits
+    board = ChessBoard(request["fen"])
+
+    depth, nodes, movetime = request["depth"], request["nodes"], request["movetime"]
+    if depth is None and nodes is None and movetime is None:
+        depth = DEFAULT_DEPTH
+
+    start = time.perf_counter()
+    move, score = context.search_position(
+        board, depth, limits=SearchLimits(nodes, movetime, stop_event)
+    )
+    elapsed = time.perf_counter() - start
+
+    if move is None:
+        return {"fen": request["fen"], "bestmove": None, "score": float(score)}
+
+    return {
+        "fen": request["fen"],
+        "bestmove": move_to_uci(move, board.white_to_move),
+        "san": move_to_san(board, move),
+        "score": float(score),
+        # Only the root move is kept by the search
+        "pv": [move_to_uci(move, board.white_to_move)],
+        "depth": context.statistics.depth,
+        "nodes": context.statistics.nodes,
+        "time": elapsed,
+        "nps": context.statistics.nodes / elapsed if elapsed else 0.0,
+        "stopped": stop_event.is_set(),
+    }
+
+
+def worker_main(
+    connection, stop_event, memory=DEFAULT_MEMORY
+):  # Worker process loop, with its own search tables kept within the memory budget, answering one request at a time until sent None
+    context = SearchContext(memory_budget=MemoryBudget(memory))
+
+    while True:
+        request = connection.recv()
+
+        if request is None:
+            break
+
+        try:
+            connection.send(analyse_position(context, request, stop_event))
+        except InvalidFEN as error:
+            connection.send({"error": error.message})
+        # Any other failure is reported to the client and logged, keeping the worker and its tables alive
+        except Exception as error:
+            traceback.print_exc()
+            connection.send({"error": f"{type(error).__name__}: {error}"})
+
+
+class Worker:  # One search process, with the event which stops its current search
+    def __init__(self, context, memory=DEFAULT_MEMORY):
+        self.context = context
+        self.memory = memory
+        self.start()
+
+    def start(self):
+        self.stop_event = self.context.Event()
+        self.connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(child_connection, self.stop_event, self.memory),
+            daemon=True,
+        )
+        self.process.start()
+
+    def analyse(
+        self, request
+    ):  # Blocking, so it is run on a thread by the service, which clears the stop event before the job can be cancelled
+        try:
+            self.connection.send(request)
+            return self.connection.recv()
+        except (EOFError, OSError):  # The process died, so a fresh one takes its place
+            self.start()
+            return {"error": "worker process exited"}
+
+    def close(self):
+        self.stop_event.set()
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+
+
+class AnalysisJob:  # A search shared by every identical request made while it is queued or running
+    def __init__(self, key, request, future):
+        self.key = key
+        self.request = request
+        self.future = future
+        self.waiters = 0
+        self.state = "queued"
+        self.worker = None
+
+
+class AnalysisService:  # Serves analysis over HTTP, queueing searches for a fixed set of worker processes
+    def __init__(
+        self, workers=None, default_timeout=DEFAULT_TIMEOUT, memory=DEFAULT_MEMORY
+    ):
+        self.worker_count = workers or multiprocessing.cpu_count()
+        self.default_timeout = default_timeout
+        self.memory = memory  # Bytes each worker's search tables may use
+        self.workers = []
+        self.queue = None
+        self.in_flight = {}  # Jobs by request key, for coalescing
+        self.threads = ThreadPoolExecutor(max_workers=self.worker_count)
+
+        self.metrics = {
+            "requests": 0,
+            "coalesced": 0,
+            "completed": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "errors": 0,
+        }
+        self.queued = 0
+        self.busy = 0
+
+    async def start(self, host="127.0.0.1", port=8000):
+        context = multiprocessing.get_context("spawn")
+        self.workers = [Worker(context, self.memory) for _ in range(self.worker_count)]
+        self.queue = asyncio.Queue()
+        self.consumers = [
+            asyncio.create_task(self.run_worker(worker)) for worker in self.workers
+        ]
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+        for consumer in self.consumers:
+            consumer.cancel()
+
+        for worker in self.workers:
+            worker.close()
+        self.threads.shutdown(wait=False)
+
+    async def run_worker(self, worker):  # Feeds queued jobs to one worker process
+        loop = asyncio.get_running_loop()
+
+        while True:
+            job = await self.queue.get()
+
+            if job.state == "cancelled":  # Everyone waiting gave up before it started
+                continue
+
+            # Cleared before the job is marked running, so that a cancellation from then on is never lost
+            worker.stop_event.clear()
+            job.state, job.worker = "running", worker
+            self.queued -= 1
+            self.busy += 1
+
+            try:
+                result = await loop.run_in_executor(
+                    self.threads, worker.analyse, job.request
+                )
+            finally:
+                self.busy -= 1
+
+            job.state = "done"
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def submit(
+        self, request
+    ):  # Queues a search, or joins an identical one which is already queued or running
+        key = (
+            " ".join(request["fen"].split()[:4]),
+            request["depth"],
+            request["nodes"],
+            request["movetime"],
+        )
+        job = self.in_flight.get(key)
+
+        if job is None:
+            job = AnalysisJob(key, request, asyncio.get_running_loop().create_future())
+            self.in_flight[key] = job
+            self.queued += 1
+            self.queue.put_nowait(job)
+        else:
+            self.metrics["coalesced"] += 1
+
+        job.waiters += 1
+        return job
+
+    def release(
+        self, job
+    ):  # Drops one waiter from a job, cancelling the search once nobody is left waiting for it
+        job.waiters -= 1
+
+        if job.waiters > 0 or job.state == "done":
+            return
+
+        self.metrics["cancelled"] += 1
+        if self.in_flight.get(job.key) is job:
+            del self.in_flight[job.key]
+
+        if job.state == "queued":
+            job.state = "cancelled"
+            self.queued -= 1
+            job.future.cancel()
+        elif job.state == "running":
+            job.worker.stop_event.set()  # The search notices within a node
+
+    async def analyse(
+        self, request, reader
+    ):  # Waits for a job's result, giving up on timeout or if the client disconnects
+        job = self.submit(request)
+        coalesced = job.waiters > 1
+
+        result_wait = asyncio.ensure_future(asyncio.shield(job.future))
+        disconnect_wait = asyncio.ensure_future(reader.read(1))
+        done, _ = await asyncio.wait(
+            {result_wait, disconnect_wait},
+            timeout=request["timeout"],
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+
+        for task in (result_wait, disconnect_wait):
+            if task not in done:
+                task.cancel()
+
+        if result_wait in done and not result_wait.cancelled():
+            job.waiters -= 1
+            result = dict(result_wait.result(), coalesced=coalesced)
+            self.metrics["errors" if "error" in result else "completed"] += 1
+            return (400 if "error" in result else 200), result
+
+        self.release(job)
+
+        if disconnect_wait in done:
+            return None, None  # Nobody is left to answer
+
+        self.metrics["timeouts"] += 1
+        return 504, {"error": f"no result within {request['timeout']}s"}
+
+    def metrics_snapshot(self):
+        return dict(
+            self.metrics,
+            queue_depth=self.queued,
+            busy_workers=self.busy,
+            workers=self.worker_count,
+            in_flight=len(self.in_flight),
+        )
+
+    def parse_analysis_request(
+        self, body
+    ):  # Validates a request body, returning the request or an error message
+        try:
+            payload = json.loads(body or b"{}")
+            fen = payload["fen"]
+            fen_to_position(fen)
+        except (ValueError, KeyError, TypeError):
+            return None, 'body must be JSON with a "fen" field'
+        except InvalidFEN as error:
+            return None, error.message
+
+        request = {"fen": fen}
+        for name in ("depth", "nodes", "movetime"):
+            value = payload.get(name)
+
+            if value is not None and (not isinstance(value, int) or value <= 0):
+                return None, f"{name} must be a positive integer"
+            request[name] = value
+
+        timeout = payload.get("timeout", self.default_timeout)
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            return None, "timeout must be a positive number of seconds"
+        request["timeout"] = timeout
+
+        return request, None
+
+    async def handle_connection(
+        self, reader, writer
+    ):  # Answers one HTTP request per connection
+        try:
+            status, body = await self.handle_request(reader)
+
+            if status is not None:
+                payload = json.dumps(body).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: close\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader):
+        request_line = await reader.readline()
+        try:
+            method, path, _ = request_line.decode().split()
+        except ValueError:
+            return 400, {"error": "malformed request line"}
+
+        content_length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+
+            # Header bytes outside ASCII are kept as Latin-1 rather than failing to decode
+            name, _, value = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                value = value.strip()
+
+                if not (value.isascii() and value.isdigit()):
+                    return 400, {"error": "invalid Content-Length"}
+
+                content_length = int(value)
+
+        if content_length > MAXIMUM_REQUEST_BYTES:
+            return 413, {"error": "request body too large"}
+
+        body = await reader.readexactly(content_length) if content_length else b""
+
+        match path:
+            case "/analyse" | "/analyze":
+                if method != "POST":
+                    return 405, {"error": "use POST"}
+
+                self.metrics["requests"] += 1
+                request, error = self.parse_analysis_request(body)
+
+                if error is not None:
+                    self.metrics["errors"] += 1
+                    return 400, {"error": error}
+
+                return await self.analyse(request, reader)
+            case "/metrics":
+                return 200, self.metrics_snapshot()
+            case "/health":
+                return 200, {"status": "ok"}
+            case _:
+                return 404, {"error": f"no such endpoint {path}"}
+
+
+async def serve(host, port, workers, timeout, memory=DEFAULT_MEMORY):
+    service = AnalysisService(workers, timeout, memory)
+    server = await service.start(host, port)
+    print(f"Serving analysis on http://{host}:{port}")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve position analysis over HTTP from a pool of worker processes"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument(
+        "--memory",
+        type=int,
+        default=DEFAULT_MEMORY // 2**20,
+        help="megabytes each worker's search tables may use",
+    )
+    arguments = parser.parse_args()
+
+    try:
+        asyncio.run(
+            serve(
+                arguments.host,
+                arguments.port,
+                arguments.workers,
+                arguments.timeout,
+                arguments.memory * 2**20,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from board_representation import ChessBoard
+from fen_handling import InvalidFEN
+from notation_handling import move_to_uci
+from pgn_handling import move_to_san
+from search_algorithms import SearchContext
+from tactical_suite import InvalidEPD, parse_epd
+
+DEFAULT_DEPTH = 3  # Used when no limits are given at all
+# Positions in flight per worker, keeping every core busy without reading far ahead
+TASKS_PER_WORKER = 4
+
+
+def redirect_output():  # Sends anything the engine prints to stderr, so that it cannot corrupt records written to stdout
+    sys.stdout = sys.stderr
+
+
+def analyse_line(
+    index, line, depth=None, nodes=None, movetime=None
+):  # Worker task, searching the position on one input line
+    result = {"index": index, "id": None, "fen": None}
+
+    # A bad line still gets its record, so the job carries on and a resume skips it
+    try:
+        fen, operations = parse_epd(line)
+        result.update({"id": " ".join(operations.get("id", [])) or None, "fen": fen})
+        board = ChessBoard(fen)
+    except (InvalidEPD, InvalidFEN) as error:
+        result["error"] = error.message
+        return result
+
+    context = (
+        SearchContext()
+    )  # A fresh table per position keeps each worker's memory flat across a long job
+    start = time.perf_counter()
+    move, score = context.search_position(board, depth, nodes, movetime)
+    elapsed = time.perf_counter() - start
+
+    result.update(
+        {
+            "bestmove": (
+                move_to_uci(move, board.white_to_move) if move is not None else None
+            ),
+            "san": move_to_san(board, move) if move is not None else None,
+            "score": float(score),
+            "depth": context.statistics.depth,
+            "nodes": context.statistics.nodes,
+            "time": elapsed,
+        }
+    )
+    return result
+
+
+def completed_indices(
+    path,
+):  # Line numbers already answered in a partially written output file, dropping any final line cut off mid-write
+    done = set()
+
+    if not os.path.exists(path):
+        return done
+
+    with open(path, "rb+") as output:
+        complete_length = 0
+
+        for line in output:
+            if not line.endswith(b"\n"):
+                break
+
+            try:
+                done.add(json.loads(line)["index"])
+            except (ValueError, KeyError):
+                break
+
+            complete_length += len(line)
+
+        output.truncate(complete_length)
+
+    return done
+
+
+def read_lines(
+    path, skip=frozenset()
+):  # Yields the index and text of each position still to analyse, reading the input lazily
+    with open(path) as positions:
+        index = 0
+
+        for line in positions:
+            line = line.strip()
+
+            if not line or line.startswith("#"):
+                continue
+
+            if index not in skip:
+                yield index, line
+
+            index += 1
+
+
+def analyse_file(
+    path,
+    output,
+    depth=None,
+    nodes=None,
+    movetime=None,
+    workers=None,
+    ordered=True,
+    skip=frozenset(),
+):  # Streams positions through a process pool, writing one JSON line per result and returning how many were written
+    if depth is None and nodes is None and movetime is None:
+        depth = DEFAULT_DEPTH
+
+    workers = workers or os.cpu_count()
+    window = workers * TASKS_PER_WORKER
+    lines = read_lines(path, skip)
+
+    pending = set()
+    finished = {}  # Results waiting on an earlier line, when writing in input order
+    order = deque()  # Indices in the order they were submitted
+    written = 0
+
+    def write(result):
+        output.write(json.dumps(result) + "\n")
+        output.flush()  # Every written line survives an interruption, for resuming
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=redirect_output
+    ) as executor:
+
+        def submit(count):
+            for index, line in islice(lines, max(count, 0)):
+                pending.add(
+                    executor.submit(analyse_line, index, line, depth, nodes, movetime)
+                )
+                order.append(index)
+
+        submit(window)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            pending -= done
+
+            for task in done:
+                result = task.result()
+
+                if ordered:
+                    finished[result["index"]] = result
+                else:
+                    write(result)
+                    written += 1
+
+            if ordered:
+                # The window is measured from the oldest unwritten line, so a slow position cannot let buffered results pile up
+                while order and order[0] in finished:
+                    write(finished.pop(order.popleft()))
+                    written += 1
+
+                submit(window - len(pending) - len(finished))
+            else:
+                submit(window - len(pending))
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyse every position of an EPD or FEN file, writing JSON lines"
+    )
+    parser.add_argument("positions")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--movetime", type=int, default=None, help="milliseconds")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--output",
+        help="file to append results to, resuming from any lines it already holds",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="write results as they complete rather than in input order",
+    )
+    arguments = parser.parse_args()
+
+    skip = frozenset()
+    if arguments.output:
+        skip = completed_indices(arguments.output)
+        if skip:
+            print(f"Resuming after {len(skip)} analysed positions", file=sys.stderr)
+
+    output = open(arguments.output, "a") if arguments.output else sys.stdout
+    redirect_output()  # Records are written to the saved handle, as uci.py does
+
+    start = time.perf_counter()
+    try:
+        written = analyse_file(
+            arguments.positions,
+            output,
+            arguments.depth,
+            arguments.nodes,
+            arguments.movetime,
+            arguments.workers,
+            not arguments.unordered,
+            skip,
+        )
+    finally:
+        if arguments.output:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Analysed {written} positions in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.1f}/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from board_representation import ChessBoard
+from evaluation_functions import EvaluationFunction
+from fen_handling import fen_to_position
+from search_algorithms import SearchContext
+
+# Fixed positions covering each phase of the game, so results are comparable between runs and machines
+BENCHMARK_POSITIONS = {
+    "opening": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "middlegame": "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w KQ - 2 9",
+    "endgame": "8/5pk1/6p1/3R4/p7/P4KP1/5P2/3r4 b - - 3 41",
+    "tactical": "r1b1k2r/ppppnppp/2n2q2/2b5/3NP3/2P1B3/PP3PPP/RN1QKB1R w KQkq - 1 7",
+}
+
+DEFAULT_REPEATS = 7
+DEFAULT_WARMUP = 2
+DEFAULT_DEPTH = 3
+DEFAULT_THRESHOLD = 0.10  # Relative slowdown counted as a regression
+SAMPLE_TIME = 0.05  # Seconds each timed sample of a micro benchmark should take
+
+
+def summarise_samples(
+    samples,
+):  # Median and interquartile range, which unlike the mean are not thrown off by an occasional slow sample
+    quartiles = statistics.quantiles(samples, n=4, method="inclusive")
+
+    return {
+        "median": statistics.median(samples),
+        "q1": quartiles[0],
+        "q3": quartiles[2],
+        "iqr": quartiles[2] - quartiles[0],
+        "min": min(samples),
+        "samples": len(samples),
+    }
+
+
+def calibrate(
+    operation,
+):  # How many calls of an operation fill one sample, so that timer resolution does not matter
+    loops = 1
+
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            operation()
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= SAMPLE_TIME / 10:
+            return max(1, int(loops * SAMPLE_TIME / elapsed))
+
+        loops *= 10
+
+
+def time_operation(
+    operation, repeats, warmup, operations_per_call=1
+):  # Nanoseconds per operation over repeated samples, after untimed warmup samples
+    loops = calibrate(operation)
+    samples = []
+
+    for sample in range(warmup + repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            operation()
+        elapsed = time.perf_counter() - start
+
+        if sample >= warmup:
+            samples.append(elapsed * 1e9 / (loops * operations_per_call))
+
+    return dict(summarise_samples(samples), unit="ns/op", loops=loops)
+
+
+def micro_benchmarks(
+    fen,
+):  # Each benchmark's name, operation and how many operations one call performs
+    board = ChessBoard(fen)
+    moves = [str(move) for move in board.generate_legal_moves()]
+    evaluator = EvaluationFunction()
+    context = SearchContext()
+
+    def make_and_undo():
+        for move in moves:
+            board.make_move(move)
+            board.undo_move()
+
+    return [
+        ("movegen", board.generate_legal_moves, 1),
+        ("make_undo", make_and_undo, max(len(moves), 1)),
+        ("evaluate", lambda: evaluator.evaluate(board), 1),
+        ("hash", lambda: context.hash.generate_key(board.all_bitboards), 1),
+        ("fen_parse", lambda: fen_to_position(fen), 1),
+        ("fen_format", board.to_fen, 1),
+    ]
+
+
+def time_search(
+    fen, depth, repeats, warmup
+):  # Nodes per second of a fixed-depth search, each run with fresh tables so every run does the same work
+    samples = []
+    nodes = 0
+
+    for sample in range(warmup + repeats):
+        board = ChessBoard(fen)
+        context = SearchContext()
+
+        start = time.perf_counter()
+        context.search_position(board, depth)
+        elapsed = time.perf_counter() - start
+
+        nodes = context.statistics.nodes
+        if sample >= warmup:
+            samples.append(nodes / elapsed)
+
+    return dict(summarise_samples(samples), unit="nodes/s", nodes=nodes, depth=depth)
+
+
+def run_benchmarks(
+    repeats=DEFAULT_REPEATS, warmup=DEFAULT_WARMUP, depth=DEFAULT_DEPTH, pattern=None
+):  # Runs every benchmark whose name contains the pattern, returning the report
+    results = {}
+
+    for position_name, fen in BENCHMARK_POSITIONS.items():
+        for name, operation, operations_per_call in micro_benchmarks(fen):
+            benchmark = f"{name}/{position_name}"
+
+            if pattern is None or pattern in benchmark:
+                results[benchmark] = time_operation(
+                    operation, repeats, warmup, operations_per_call
+                )
+                print(format_result(benchmark, results[benchmark]), file=sys.stderr)
+
+        benchmark = f"search/{position_name}"
+        if pattern is None or pattern in benchmark:
+            results[benchmark] = time_search(fen, depth, repeats, warmup)
+            print(format_result(benchmark, results[benchmark]), file=sys.stderr)
+
+    return {
+        "metadata": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeats": repeats,
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+
+
+def format_result(name, result):
+    return (
+        f"{name:<24} {result['median']:>14,.1f} {result['unit']:<8} "
+        f"IQR {result['iqr'] / result['median']:>6.1%}"
+    )
+
+
+def compare_reports(
+    baseline, report, threshold=DEFAULT_THRESHOLD
+):  # Relative change of every benchmark in both reports, positive when slower, flagging those beyond the threshold
+    comparison = {}
+
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        before, after = baseline["results"][name]["median"], result["median"]
+
+        # Times are better lower and rates higher, so both are turned into a slowdown
+        if result["unit"] == "nodes/s":
+            slowdown = before / after - 1
+        else:
+            slowdown = after / before - 1
+
+        comparison[name] = {
+            "baseline": before,
+            "current": after,
+            "slowdown": slowdown,
+            "regression": slowdown > threshold,
+        }
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time move generation, evaluation, hashing, FEN handling and search on fixed positions"
+    )
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=DEFAULT_DEPTH,
+        help="depth of the search benchmarks",
+    )
+    parser.add_argument(
+        "--filter", help="only run benchmarks whose name contains this text"
+    )
+    parser.add_argument("--output", help="file to write the JSON report to")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="relative slowdown counted as a regression",
+    )
+    arguments = parser.parse_args()
+
+    if arguments.repeats < 2:
+        parser.error("--repeats must be at least 2 to measure spread")
+
+    report = run_benchmarks(
+        arguments.repeats, arguments.warmup, arguments.depth, arguments.filter
+    )
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            comparison = compare_reports(
+                json.load(baseline), report, arguments.threshold
+            )
+
+        for name, change in comparison.items():
+            flag = "REGRESSION" if change["regression"] else ""
+            print(f"{name:<24} {change['slowdown']:>+8.1%} {flag}")
+
+        regressions = [
+            name for name, change in comparison.items() if change["regression"]
+        ]
+        print(
+            f"{len(regressions)} of {len(comparison)} benchmarks regressed by more than {arguments.threshold:.0%}"
+        )
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import numpy as np
+
+# Every operation here only uses shifts, masks and arithmetic, so it works on plain integers for a single
+# position and on NumPy uint64 arrays for a batch of positions alike
+
+FULL_BOARD = 0xFFFFFFFFFFFFFFFF
+FILE_A = 0x0101010101010101
+FILE_H = 0x8080808080808080
+NOT_FILE_A = FULL_BOARD ^ FILE_A
+NOT_FILE_H = FULL_BOARD ^ FILE_H
+NOT_FILE_AB = NOT_FILE_A & (NOT_FILE_A << 1)
+NOT_FILE_GH = NOT_FILE_H & (NOT_FILE_H >> 1)
+
+FILE_MASKS = [FILE_A << file for file in range(8)]
+RANK_MASKS = [0xFF << (8 * rank) for rank in range(8)]
+
+# Each direction is a shift amount, positive towards h8, and the mask which removes squares wrapped around the board edge
+NORTH = (8, FULL_BOARD)
+SOUTH = (-8, FULL_BOARD)
+EAST = (1, NOT_FILE_A)
+WEST = (-1, NOT_FILE_H)
+NORTH_EAST = (9, NOT_FILE_A)
+NORTH_WEST = (7, NOT_FILE_H)
+SOUTH_EAST = (-7, NOT_FILE_A)
+SOUTH_WEST = (-9, NOT_FILE_H)
+
+ORTHOGONAL_DIRECTIONS = [NORTH, SOUTH, EAST, WEST]
+DIAGONAL_DIRECTIONS = [NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST]
+ALL_DIRECTIONS = ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS
+
+KNIGHT_JUMPS = [
+    (17, NOT_FILE_A),
+    (15, NOT_FILE_H),
+    (10, NOT_FILE_AB),
+    (6, NOT_FILE_GH),
+    (-6, NOT_FILE_AB),
+    (-10, NOT_FILE_GH),
+    (-15, NOT_FILE_A),
+    (-17, NOT_FILE_H),
+]
+
+
+def shift(
+    bitboard, amount
+):  # Shifts towards h8 for positive amounts, and towards a1 otherwise
+    if amount > 0:
+        return (bitboard << amount) & FULL_BOARD
+    return bitboard >> -amount
+
+
+def shift_direction(bitboard, direction):  # Moves every set bit one step in a direction
+    amount, mask = direction
+    return shift(bitboard, amount) & mask
+
+
+def occluded_fill(
+    generators, empty, direction
+):  # Kogge-Stone fill of the generators through empty squares, stopping before any blocker
+    amount, mask = direction
+    empty = empty & mask  # Stops the fill wrapping around the edge of the board
+
+    # Not updated in place, as NumPy arrays passed in would be modified for the caller
+    generators = generators | (empty & shift(generators, amount))
+    empty = empty & shift(empty, amount)
+    generators = generators | (empty & shift(generators, 2 * amount))
+    empty = empty & shift(empty, 2 * amount)
+    generators = generators | (empty & shift(generators, 4 * amount))
+
+    return generators
+
+
+def sliding_attacks(
+    sliders, empty, direction
+):  # Squares attacked in one direction by every slider in the set, including the first blocker hit
+    return shift_direction(occluded_fill(sliders, empty, direction), direction)
+
+
+def fill(
+    bitboard, direction
+):  # Smears every set bit to the edge of the board in a direction, keeping the original bits
+    return occluded_fill(bitboard, FULL_BOARD, direction)
+
+
+def file_fill(bitboard):  # Every file which contains at least one set bit
+    return fill(bitboard, NORTH) | fill(bitboard, SOUTH)
+
+
+def pawn_attacks(
+    pawns, forward
+):  # Squares attacked by a set of pawns advancing in the forward direction
+    advanced = shift_direction(pawns, forward)
+    return shift_direction(advanced, EAST) | shift_direction(advanced, WEST)
+
+
+def rotate_bitboard(
+    bitboard,
+):  # Reverses the bits of a bitboard, turning the board round to be seen from the other side
+    bitboard = ((bitboard >> 1) & 0x5555555555555555) | (
+        (bitboard & 0x5555555555555555) << 1
+    )
+    bitboard = ((bitboard >> 2) & 0x3333333333333333) | (
+        (bitboard & 0x3333333333333333) << 2
+    )
+    bitboard = ((bitboard >> 4) & 0x0F0F0F0F0F0F0F0F) | (
+        (bitboard & 0x0F0F0F0F0F0F0F0F) << 4
+    )
+    bitboard = ((bitboard >> 8) & 0x00FF00FF00FF00FF) | (
+        (bitboard & 0x00FF00FF00FF00FF) << 8
+    )
+    bitboard = ((bitboard >> 16) & 0x0000FFFF0000FFFF) | (
+        (bitboard & 0x0000FFFF0000FFFF) << 16
+    )
+    return ((bitboard >> 32) | (bitboard << 32)) & FULL_BOARD
+
+
+def popcount(
+    bitboard,
+):  # Counts the set bits of a bitboard, or of each bitboard in an array
+    if isinstance(bitboard, int):
+        return bitboard.bit_count()
+
+    bitboard = bitboard - ((bitboard >> 1) & 0x5555555555555555)
+    bitboard = (bitboard & 0x3333333333333333) + ((bitboard >> 2) & 0x3333333333333333)
+    bitboard = (bitboard + (bitboard >> 4)) & 0x0F0F0F0F0F0F0F0F
+
+    return (((bitboard * 0x0101010101010101) & FULL_BOARD) >> 56).astype(np.int64)
+
+
+def to_integers(
+    bitboards,
+):  # Converts a position's NumPy bitboards to plain integers, which are much faster to operate on one at a time
+    return [int(bitboard) for bitboard in bitboards]
+
+
+def bitboard_columns(
+    positions,
+):  # Splits an (N, 13) array of positions into one uint64 array per bitboard
+    positions = np.asarray(positions, dtype=np.uint64)
+    return [positions[:, index] for index in range(positions.shape[1])]
+
+
+def attacked_squares(
+    bitboards, side
+):  # Every square attacked by the side to move (side 0) or by the opponent (side 1)
+    pawns, knights, bishops, rooks, queens, kings, friendly, opponent = bitboards[:8]
+    pieces = (friendly, opponent)[side]
+    empty = FULL_BOARD ^ (friendly | opponent)
+
+    # The side to move's pawns advance up the board and the opponent's down it
+    attacks = pawn_attacks(pawns & pieces, NORTH if side == 0 else SOUTH)
+
+    for jump in KNIGHT_JUMPS:
+        attacks |= shift_direction(knights & pieces, jump)
+
+    for direction in ALL_DIRECTIONS:
+        attacks |= shift_direction(kings & pieces, direction)
+
+    for direction in DIAGONAL_DIRECTIONS:
+        attacks |= sliding_attacks((bishops | queens) & pieces, empty, direction)
+
+    for direction in ORTHOGONAL_DIRECTIONS:
+        attacks |= sliding_attacks((rooks | queens) & pieces, empty, direction)
+
+    return attacks
@@ -1,16 +1,30 @@
 import numpy as np
 from enum import Enum
 
+from bitboard_operations import attacked_squares, rotate_bitboard, to_integers
+from evaluation_functions import (
+    calculate_material_scores,
+    calculate_pawn_keys,
+    pawn_zobrist_keys,
+    table_array,
+)
 from fen_handling import (
-    fen_to_bitboards,
-    bitboards_to_fen,
-    display_chess_position,
+    fen_to_position,
+    position_to_fen,
+    position_to_mailbox,
+    render_mailbox,
 )
 from notation_handling import (
     decompose_notation,
     encode_square,
     isOnBoard,
 )
+from precomputed_tables import get_table
+from timer import profiler
+
+# Squares a knight or king on each square attacks, as plain integers for speed
+knight_attacks = [int(attacks) for attacks in get_table("knight_attacks")]
+king_attacks = [int(attacks) for attacks in get_table("king_attacks")]
 
 
 class PieceType(Enum):
@@ -22,6 +36,17 @@ class PieceType(Enum):
     K = 5
 
 
+# Castling rights, as white sees them, lost when a piece moves from or to each king and rook starting square
+castling_rights_squares = {
+    4: 0b1100,  # e1
+    7: 0b1000,  # h1
+    0: 0b0100,  # a1
+    60: 0b0011,  # e8
+    63: 0b0010,  # h8
+    56: 0b0001,  # a8
+}
+
+
 class GameOver(Exception):
     def __init__(self, player):
         print("Engine won" if player else "Player won")
@@ -29,36 +54,34 @@ class GameOver(Exception):
 
 class ChessBoard:
     def __init__(self, fen) -> None:
-        self.white_to_move = True
-        self.legal_moves = None
-        # Convert the inputted fen to an array of binary integers
-        temporary_bitboards = fen_to_bitboards(fen)
-
-        # Collect all bitboards into a NumPy array
-        self.all_bitboards = np.array(
-            [
-                # Initialise bitboards for each piece type using NumPy's unsigned integers for better performance
-                temporary_bitboards[0],  # Pawns, 0
-                temporary_bitboards[1],  # Knights, 1
-                temporary_bitboards[2],  # Bishops, 2
-                temporary_bitboards[3],  # Rooks, 3
-                temporary_bitboards[4],  # Queens, 4
-                temporary_bitboards[5],  # Kings, 5
-                # Initialise general bitboards for each side and the board overall
-                temporary_bitboards[6],  # White, 6
-                temporary_bitboards[7],  # Black, 7
-                # Initialise miscellaneous bitboards for special moves and nuanced evaluation
-                temporary_bitboards[8],  # Castling, 8
-                temporary_bitboards[9],  # En passant, 9
-                temporary_bitboards[6] | temporary_bitboards[7],  # Occupancy mask, 10
-                0,  # Attacked squares, 11 # TODO
-                0,  # Pawn structure, 12 # TODO
-            ],
-            dtype=np.uint64,
-        )
+        # Convert the inputted fen to an array of binary integers, seen from the side to move
+        self.set_position(*fen_to_position(fen))
+
+    def set_position(
+        self, position, white_to_move, halfmove_clock=0, fullmove_number=1
+    ):  # Replaces the whole game state with a parsed or decoded position, clearing the move history
+        self.white_to_move = white_to_move
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+        # Collect all bitboards into a NumPy array, laid out as: pawns, knights, bishops, rooks, queens, kings,
+        # side to move, opponent, castling, en passant, occupancy mask, attacked squares (TODO), pawn structure (TODO)
+        self.all_bitboards = np.array(position, dtype=np.uint64)
 
         self.previous_positions = [self.all_bitboards.copy()]  # TODO: make better
 
+        # Running piece-square material of the side to move and of the opponent, updated on every move
+        self.material_scores = calculate_material_scores(self.all_bitboards)
+
+        # Pawn-only Zobrist keys of the side to move and of the opponent, for the pawn hash table
+        self.pawn_keys = calculate_pawn_keys(self.all_bitboards)
+
+        # Everything besides the bitboards which make_move changes, so that undo_move can restore it
+        self.previous_states = []
+
+        # Optional first layer accumulators of a network evaluator, updated alongside the bitboards
+        self.accumulator = None
+
         self.legal_moves = self.generate_legal_moves()
 
     def is_game_over(self):
@@ -67,13 +90,13 @@ class ChessBoard:
 
         if (
             not self.all_bitboards[5] & self.all_bitboards[6]
-        ):  # White king has been captured
-            return True, 99999
+        ):  # The king of the side to move has been captured, so it has lost
+            return True, -99999
 
         if (
             not self.all_bitboards[5] & self.all_bitboards[7]
-        ):  # Black king has been captured
-            return True, -99999
+        ):  # The opponent's king has been captured, so the side to move has won
+            return True, 99999
         return False, 0
 
     def knight_moved_over_edge(self, start_square, dest_square):
@@ -90,6 +113,7 @@ class ChessBoard:
             or abs(dest_rank - start_rank) > 2  # Check rank difference
         )
 
+    @profiler.profile("make_move")
     def make_move(self, long_algebraic_notation):  # TODO: Update misc bitboards
         if (
             long_algebraic_notation == None
@@ -99,6 +123,15 @@ class ChessBoard:
         self.previous_positions.append(
             self.all_bitboards.copy()
         )  # Store the current position so that the move can later be undone TODO: only store the bitboards which have actually changed to save memory
+        self.previous_states.append(
+            (
+                self.material_scores.copy(),
+                self.pawn_keys.copy(),
+                self.white_to_move,
+                self.halfmove_clock,
+                self.fullmove_number,
+            )
+        )
 
         start_square, end_square, promotion_piece = decompose_notation(
             long_algebraic_notation
@@ -113,6 +146,57 @@ class ChessBoard:
         ):  # Should never be triggered, given only legal moves are being made
             return
 
+        captured_piece = self.determine_piece_on_square(
+            end_square
+        )  # Determine the piece which is being captured, if any
+        captured_square = end_square
+
+        if (
+            piece.upper() == "P"
+            and start_square % 8 != end_square % 8
+            and np.uint64(1 << end_square) & self.all_bitboards[9]
+        ):  # En passant, where the captured pawn is behind the end square
+            captured_square = end_square - 8
+            captured_piece = self.determine_piece_on_square(captured_square)
+            self.all_bitboards[0] &= np.uint64(~(1 << captured_square) % (1 << 64))
+            self.all_bitboards[7] &= np.uint64(~(1 << captured_square) % (1 << 64))
+
+        self.update_material_scores(
+            piece,
+            start_square,
+            end_square,
+            captured_piece,
+            captured_square,
+            promotion_piece,
+        )
+        self.update_pawn_keys(
+            piece,
+            start_square,
+            end_square,
+            captured_piece,
+            captured_square,
+            promotion_piece,
+        )
+
+        if self.accumulator is not None:
+            self.update_accumulator(
+                piece,
+                start_square,
+                end_square,
+                captured_piece,
+                captured_square,
+                promotion_piece,
+            )
+
+        # The halfmove clock counts moves since the last capture or pawn move, the fullmove number black's moves
+        if piece.upper() == "P" or captured_piece is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        if not self.white_to_move:
+            self.fullmove_number += 1
+
         # Creates masks to turn off a specified bit
         try:
             start_mask = np.uint64(
@@ -159,20 +243,159 @@ class ChessBoard:
             self.all_bitboards[7] &= start_mask
             self.all_bitboards[7] |= np.uint64(1 << end_square)
 
+        if (
+            piece.upper() == "K" and abs(end_square - start_square) == 2
+        ):  # Castling, so the rook jumps over to the square the king passed
+            self.move_castling_rook(start_square, end_square)
+
+        self.update_castling_rights(start_square, end_square)
+
         # Update misc bitboards
         self.all_bitboards[9] = 0
         self.update_occupancy_mask()
 
         if piece.upper() == "P" and abs(end_square // 8 - start_square // 8) == 2:
-            self.all_bitboards[9] = end_square
+            self.all_bitboards[9] = np.uint64(
+                1 << (start_square + 8)
+            )  # The square the pawn skipped over can be captured en passant
 
         # Make it the other colour's move to make
         self.flip_board()
         self.white_to_move = not self.white_to_move
 
+    def move_castling_rook(
+        self, start_square, end_square
+    ):  # Moves the rook on the side the king castled towards, always on the side to move's first rank
+        rook_start = 7 if end_square > start_square else 0
+        rook_end = (start_square + end_square) // 2
+
+        for index in (3, 6):
+            self.all_bitboards[index] &= np.uint64(~(1 << rook_start) % (1 << 64))
+            self.all_bitboards[index] |= np.uint64(1 << rook_end)
+
+        self.update_material_scores("R", rook_start, rook_end, None, None, None)
+
+        # Added to the frame the king's move already pushed, as undo_move pops only one
+        if self.accumulator is not None:
+            self.accumulator.update_piece(3, rook_start, True, -1)
+            self.accumulator.update_piece(3, rook_end, True, 1)
+
+    def update_castling_rights(
+        self, start_square, end_square
+    ):  # Removes the rights of any king or rook moving, or rook being captured
+        for square in (start_square, end_square):
+            real_square = square if self.white_to_move else 63 - square
+            lost_rights = castling_rights_squares.get(real_square)
+
+            if lost_rights is not None:
+                if not self.white_to_move:  # Castling rights are flipped with the board
+                    lost_rights = rotate_bitboard(lost_rights)
+
+                self.all_bitboards[8] &= np.uint64(~lost_rights % (1 << 64))
+
+    def is_in_check(
+        self, side=0
+    ):  # Whether the king of the side to move (side 0), or of the opponent (side 1), is attacked
+        bitboards = to_integers(self.all_bitboards[:8])
+        king = bitboards[5] & bitboards[6 + side]
+
+        return bool(king & attacked_squares(bitboards, 1 - side))
+
+    @profiler.profile("undo_move")
     def undo_move(self):  # Returns the board to its previous position TODO: Make better
         self.all_bitboards = self.previous_positions[-1]
         self.previous_positions.pop()
+        (
+            self.material_scores,
+            self.pawn_keys,
+            self.white_to_move,
+            self.halfmove_clock,
+            self.fullmove_number,
+        ) = self.previous_states.pop()
+
+        if self.accumulator is not None:
+            if len(self.accumulator.stack) > 1:
+                self.accumulator.pop()
+            else:  # Attached part way through a search, so there is no earlier entry to return to
+                self.accumulator.refresh(self.all_bitboards)
+
+    def attach_accumulator(
+        self, accumulator
+    ):  # Starts keeping a network's accumulators up to date with this board
+        accumulator.refresh(self.all_bitboards)
+        self.accumulator = accumulator
+
+    def update_material_scores(
+        self,
+        piece,
+        start_square,
+        end_square,
+        captured_piece,
+        captured_square,
+        promotion_piece,
+    ):  # Applies the piece-square deltas of a move rather than recounting the whole board
+        moved_index = PieceType[piece.upper()].value
+        placed_index = (
+            moved_index
+            if promotion_piece is None
+            else PieceType[promotion_piece.upper()].value
+        )  # A promoting pawn is replaced by the promotion piece on the end square
+
+        # The moving side is always the one stored in bitboard 6
+        self.material_scores[0] += int(
+            table_array[placed_index][end_square]
+            - table_array[moved_index][start_square]
+        )
+
+        if captured_piece is not None:  # Remove the captured piece from the opponent
+            self.material_scores[1] -= int(
+                table_array[PieceType[captured_piece.upper()].value][
+                    63 - captured_square
+                ]
+            )
+
+    def update_pawn_keys(
+        self,
+        piece,
+        start_square,
+        end_square,
+        captured_piece,
+        captured_square,
+        promotion_piece,
+    ):  # Toggles the keys of any pawns moved, promoted or captured
+        if piece.upper() == "P":
+            self.pawn_keys[0] ^= pawn_zobrist_keys[start_square]
+
+            if promotion_piece is None:  # A promoted pawn leaves the pawn structure
+                self.pawn_keys[0] ^= pawn_zobrist_keys[end_square]
+
+        if captured_piece is not None and captured_piece.upper() == "P":
+            self.pawn_keys[1] ^= pawn_zobrist_keys[63 - captured_square]
+
+    def update_accumulator(
+        self,
+        piece,
+        start_square,
+        end_square,
+        captured_piece,
+        captured_square,
+        promotion_piece,
+    ):  # Applies the same piece deltas as the material scores to the network accumulators
+        moved_index = PieceType[piece.upper()].value
+        placed_index = (
+            moved_index
+            if promotion_piece is None
+            else PieceType[promotion_piece.upper()].value
+        )
+
+        self.accumulator.push()
+        self.accumulator.update_piece(moved_index, start_square, True, -1)
+        self.accumulator.update_piece(placed_index, end_square, True, 1)
+
+        if captured_piece is not None:
+            self.accumulator.update_piece(
+                PieceType[captured_piece.upper()].value, captured_square, False, -1
+            )
 
     def determine_piece_on_square(self, square):
         if self.all_bitboards[10] & np.uint64(1 << square):
@@ -245,42 +468,25 @@ class ChessBoard:
         return move_list
 
     def generate_knight_moves(self, square):
+        targets = knight_attacks[square] & ~int(self.all_bitboards[6])
         move_list = []
 
-        # Unroll the a for loop for all possible knight moves for no loop overhead
-        new_squares = [
-            square - 17,
-            square - 15,
-            square - 10,
-            square - 6,
-            square + 6,
-            square + 10,
-            square + 15,
-            square + 17,
-        ]
-
-        for new_square in new_squares:
-            if (
-                isOnBoard(new_square)
-                and not np.uint64(1 << new_square) & self.all_bitboards[6]
-            ):
-                if not self.knight_moved_over_edge(square, new_square):
-                    move_list.append(
-                        f"{encode_square(square)}{encode_square(new_square)}"
-                    )
+        while targets:  # Lowest square first, the order the jumps were once tried in
+            new_square = (targets & -targets).bit_length() - 1
+            move_list.append(f"{encode_square(square)}{encode_square(new_square)}")
+            targets &= targets - 1
 
         return move_list
 
     def generate_king_moves(self, square):
         offsets = [1, -1, -8, 8, 9, -9, 7, -7]
+        targets = king_attacks[square] & ~int(self.all_bitboards[6])
 
+        # The table already excludes steps off the board or around its edge
         return [
             f"{encode_square(square)}{encode_square(square + offset)}"
             for offset in offsets
-            if (
-                isOnBoard(square + offset)
-                and not np.uint64(1 << (square + offset)) & self.all_bitboards[6]
-            )
+            if 0 <= square + offset < 64 and targets >> (square + offset) & 1
         ]
 
     def generate_pawn_moves(self, square):
@@ -351,19 +557,22 @@ class ChessBoard:
         except OverflowError:
             print("Probably fix this")
 
-        # Handle en passant
-        if square // 8 == self.all_bitboards[
-            9
-        ] // 8 and (  # TODO: En passant not added to list of legal moves
-            np.uint64(1 << square - 1) & (np.uint64(1) << self.all_bitboards[9])
-            or np.uint64(1 << square + 1) & (np.uint64(1) << self.all_bitboards[9])
-        ):
-            move_list.insert(
-                0, f"{encode_square(square)}{encode_square(self.all_bitboards[9] + 8)}"
-            )
+        # Handle en passant, the target square being set in bitboard 9
+        en_passant = int(self.all_bitboards[9])
+        if en_passant:
+            target_square = en_passant.bit_length() - 1
+
+            if (
+                target_square in (square + 7, square + 9)
+                and abs(target_square % 8 - square % 8) == 1
+            ):
+                move_list.insert(
+                    0, f"{encode_square(square)}{encode_square(target_square)}"
+                )
 
         return move_list
 
+    @profiler.profile("movegen")
     def generate_legal_moves(self):
         move_list = []
 
@@ -385,7 +594,7 @@ class ChessBoard:
                         move_list.extend(self.generate_knight_moves(square))
                     case "P":
                         move_list.extend(self.generate_pawn_moves(square))
-                        
+
         self.legal_moves = np.array(move_list).flatten()
 
         return self.legal_moves
@@ -418,14 +627,28 @@ class ChessBoard:
         self.all_bitboards[6] = self.all_bitboards[7].copy()
         self.all_bitboards[7] = white.copy()
 
+        # Piece-square scores are unchanged by the flip, only which side they belong to swaps
+        self.material_scores.reverse()
+        self.pawn_keys.reverse()
+
+        if self.accumulator is not None:
+            self.accumulator.swap()
+
+    def to_fen(self):  # The FEN of the current position, from white's side of the board
+        return position_to_fen(
+            self.all_bitboards,
+            self.white_to_move,
+            self.halfmove_clock,
+            self.fullmove_number,
+        )
+
     def display_board(self):
-        fen = bitboards_to_fen(self.all_bitboards[:10])
-        print(display_chess_position(fen))
+        print(self)
 
     def __repr__(self) -> str:
-        fen = bitboards_to_fen(self.all_bitboards[:10])
-        return display_chess_position(fen)
+        return render_mailbox(
+            position_to_mailbox(self.all_bitboards, self.white_to_move)
+        )
 
     def __str__(self) -> str:
-        fen = bitboards_to_fen(self.all_bitboards[:10])
-        return display_chess_position(fen)
+        return self.__repr__()
@@ -1,6 +1,29 @@
 import numpy as np
 from enum import Enum
 
+from bitboard_operations import (
+    ALL_DIRECTIONS,
+    DIAGONAL_DIRECTIONS,
+    EAST,
+    FULL_BOARD,
+    KNIGHT_JUMPS,
+    NORTH,
+    ORTHOGONAL_DIRECTIONS,
+    RANK_MASKS,
+    SOUTH,
+    WEST,
+    bitboard_columns,
+    fill,
+    file_fill,
+    pawn_attacks,
+    popcount,
+    shift_direction,
+    sliding_attacks,
+    to_integers,
+)
+from precomputed_tables import get_table
+from timer import profiler
+
 piece_to_index = {"P": 0, "N": 1, "B": 2, "R": 3, "Q": 4, "K": 5}
 
 # Defines the relative piece value for each piece type for each square on the chess board
@@ -447,8 +470,391 @@ table_array = [
 ]
 
 
+# Stacks the tables as [colour][piece][square], with the opponent's tables mirrored so they can be indexed by board square
+stacked_table_array = np.array(
+    [
+        table_array,
+        [table[::-1] for table in table_array],
+    ],
+    dtype=np.int64,
+)
+
+
+def unpack_piece_bitboards(
+    bitboards,
+):  # Expands the piece bitboards into a [colour][piece][square] array of 0s and 1s, for one position or a stack of them
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+
+    pieces = (
+        bitboards[..., np.newaxis, :6] & bitboards[..., 6:8, np.newaxis]
+    )  # Splits each piece type by colour, with the side to move first
+
+    occupancy = np.unpackbits(
+        np.ascontiguousarray(pieces, dtype="<u8").view(np.uint8),
+        axis=-1,
+        bitorder="little",
+    )  # Little-endian bytes and bits put square 0 first
+
+    return occupancy.reshape(pieces.shape[:-1] + (6, 64))
+
+
+def piece_square_scores(
+    bitboards,
+):  # Piece-square material of the side to move and the opponent, for one position or a stack of them
+    occupancy = unpack_piece_bitboards(bitboards)
+
+    return np.einsum(
+        "...cps,cps->...c", occupancy, stacked_table_array
+    )  # Dot product of each side's occupancy with its tables
+
+
+def calculate_material_scores(
+    bitboards,
+):  # Counts the piece-square material of both sides from scratch, used to seed the incremental scores of a board
+    scores = piece_square_scores(bitboards)
+
+    return [int(scores[0]), int(scores[1])]
+
+
+def calculate_attack_terms(
+    bitboards,
+):  # Mobility and king safety of the side to move relative to the opponent, from attack bitboards in a single pass
+    pawns, knights, bishops, rooks, queens, kings, friendly, opponent = bitboards[:8]
+    empty = FULL_BOARD ^ (friendly | opponent)
+
+    mobility = [0, 0]
+    open_lines = [0, 0]
+
+    for side, pieces in enumerate((friendly, opponent)):
+        targets = (
+            FULL_BOARD ^ pieces
+        )  # Pieces can move to any square not occupied by their own side
+        diagonal_sliders = (bishops | queens) & pieces
+        orthogonal_sliders = (rooks | queens) & pieces
+        king = kings & pieces
+
+        # Each direction is counted separately, so the popcounts add up to the total over every piece
+        for jump in KNIGHT_JUMPS:
+            mobility[side] += popcount(
+                shift_direction(knights & pieces, jump) & targets
+            )
+
+        for direction in ALL_DIRECTIONS:
+            mobility[side] += popcount(shift_direction(king, direction) & targets)
+
+            # Lines radiating from the king which an enemy slider could use to reach it
+            open_lines[side] += popcount(
+                sliding_attacks(king, empty, direction) & targets
+            )
+
+        for direction in DIAGONAL_DIRECTIONS:
+            mobility[side] += popcount(
+                sliding_attacks(diagonal_sliders, empty, direction) & targets
+            )
+
+        for direction in ORTHOGONAL_DIRECTIONS:
+            mobility[side] += popcount(
+                sliding_attacks(orthogonal_sliders, empty, direction) & targets
+            )
+
+        # Pawns move differently from how they attack, so their pushes and captures are counted apart
+        own_pawns = pawns & pieces
+        enemy = (opponent, friendly)[side]
+        forward = NORTH if side == 0 else SOUTH
+        single_pushes = shift_direction(own_pawns, forward) & empty
+        # Only pawns which can still make their first move land on their third rank with a single push
+        third_rank = RANK_MASKS[2 if side == 0 else 5]
+        double_pushes = shift_direction(single_pushes & third_rank, forward) & empty
+        mobility[side] += popcount(single_pushes) + popcount(double_pushes)
+
+        advanced = shift_direction(own_pawns, forward)
+        for sideways in (EAST, WEST):
+            mobility[side] += popcount(shift_direction(advanced, sideways) & enemy)
+
+    return (
+        mobility[0] - mobility[1],
+        open_lines[1] - open_lines[0],
+    )  # Fewer open lines around a king is safer, so the opponent's are a bonus
+
+
+# Pawn structure penalties and bonuses in centipawns, passed pawns being rewarded more the further they have advanced
+doubled_pawn_penalty = 15
+isolated_pawn_penalty = 15
+backward_pawn_penalty = 10
+passed_pawn_bonus = [0, 5, 10, 20, 35, 60, 100, 0]
+pawn_shield_bonus = 10
+
+# Scaling of the attack-based terms, both counted in squares
+king_safety_weight = 10
+mobility_weight = 10
+
+# Seeded keys for a pawn on each square, seen from its own side of the board, used to hash the pawn structure alone
+pawn_zobrist_keys = [int(key) for key in get_table("pawn_keys")]
+
+
+def calculate_pawn_keys(
+    bitboards,
+):  # Pawn-only Zobrist keys of the side to move and of the opponent, used to seed the incremental keys of a board
+    keys = [0, 0]
+
+    for side in range(2):
+        pawns = int(bitboards[0] & bitboards[6 + side])
+
+        while pawns:  # Loop through each pawn
+            square = (pawns & -pawns).bit_length() - 1
+            keys[side] ^= pawn_zobrist_keys[square if side == 0 else 63 - square]
+            pawns &= pawns - 1
+
+    return keys
+
+
+def combine_pawn_keys(
+    pawn_keys,
+):  # Merges both sides' keys, rotating the opponent's so that swapping the sides changes the key
+    opponent_key = pawn_keys[1]
+
+    return pawn_keys[0] ^ (((opponent_key << 32) | (opponent_key >> 32)) & FULL_BOARD)
+
+
+def side_pawn_features(
+    pawns, enemy_pawns, forward, backward
+):  # Counts one side's doubled, isolated, backward and passed pawns, with forward being the direction they advance in
+    files = file_fill(pawns)
+
+    # Pawns with another pawn of their own side behind them on the same file
+    doubled = pawns & shift_direction(fill(pawns, forward), forward)
+
+    # Pawns with no pawns of their own side on either neighbouring file
+    isolated = pawns & (
+        FULL_BOARD ^ (shift_direction(files, EAST) | shift_direction(files, WEST))
+    )
+
+    # Pawns with no enemy pawns in front of them on their own or a neighbouring file
+    enemy_front_spans = fill(shift_direction(enemy_pawns, backward), backward)
+    passed = pawns & (
+        FULL_BOARD
+        ^ (
+            enemy_front_spans
+            | shift_direction(enemy_front_spans, EAST)
+            | shift_direction(enemy_front_spans, WEST)
+        )
+    )
+
+    # Pawns whose stop square is attacked by an enemy pawn and can never be defended by a pawn of their own
+    enemy_pawn_attacks = pawn_attacks(enemy_pawns, backward)
+    attack_front_spans = fill(pawn_attacks(pawns, forward), forward)
+    backward_pawns = shift_direction(
+        shift_direction(pawns, forward)
+        & enemy_pawn_attacks
+        & (FULL_BOARD ^ attack_front_spans),
+        backward,
+    )
+
+    passed_by_rank = [
+        popcount(passed & RANK_MASKS[rank if forward == NORTH else 7 - rank])
+        for rank in range(1, 7)
+    ]  # Passed pawns can only stand on the middle six ranks, counted by how far they have advanced
+
+    return [
+        popcount(doubled),
+        popcount(isolated),
+        popcount(backward_pawns),
+    ] + passed_by_rank
+
+
+def side_pawn_structure(
+    pawns, enemy_pawns, forward, backward
+):  # Scores one side's pawns, with forward being the direction they advance in
+    doubled, isolated, backward_pawns, *passed_by_rank = side_pawn_features(
+        pawns, enemy_pawns, forward, backward
+    )
+
+    score = (
+        -doubled_pawn_penalty * doubled
+        - isolated_pawn_penalty * isolated
+        - backward_pawn_penalty * backward_pawns
+    )
+
+    for relative_rank, passed in enumerate(passed_by_rank, start=1):
+        score += passed_pawn_bonus[relative_rank] * passed
+
+    return score
+
+
+def calculate_pawn_structure(
+    bitboards,
+):  # Pawn-only structure of the side to move relative to the opponent, which depends on nothing but the pawns
+    pawns, friendly, opponent = bitboards[0], bitboards[6], bitboards[7]
+    friendly_pawns = pawns & friendly
+    enemy_pawns = pawns & opponent
+
+    # The side to move always advances up the board, as the board is flipped after every move
+    return side_pawn_structure(
+        friendly_pawns, enemy_pawns, NORTH, SOUTH
+    ) - side_pawn_structure(enemy_pawns, friendly_pawns, SOUTH, NORTH)
+
+
+def calculate_pawn_features(
+    bitboards,
+):  # Differences in each kind of pawn feature between the side to move and the opponent, for tuning
+    pawns, friendly, opponent = bitboards[0], bitboards[6], bitboards[7]
+    friendly_pawns = pawns & friendly
+    enemy_pawns = pawns & opponent
+
+    return [
+        friendly_count - enemy_count
+        for friendly_count, enemy_count in zip(
+            side_pawn_features(friendly_pawns, enemy_pawns, NORTH, SOUTH),
+            side_pawn_features(enemy_pawns, friendly_pawns, SOUTH, NORTH),
+        )
+    ]
+
+
+def calculate_pawn_shield_counts(
+    bitboards,
+):  # Pawns on the two ranks in front of each king, on its own and the neighbouring files
+    pawns, kings, friendly, opponent = (
+        bitboards[0],
+        bitboards[5],
+        bitboards[6],
+        bitboards[7],
+    )
+    shields = [0, 0]
+
+    for side, (pieces, forward) in enumerate(((friendly, NORTH), (opponent, SOUTH))):
+        king = kings & pieces
+        king_files = king | shift_direction(king, EAST) | shift_direction(king, WEST)
+        first_rank = shift_direction(king_files, forward)
+        shield_zone = first_rank | shift_direction(first_rank, forward)
+
+        shields[side] = popcount(pawns & pieces & shield_zone)
+
+    return shields[0] - shields[1]
+
+
+def calculate_pawn_shields(bitboards):  # Bonus for the side with the better pawn shield
+    return pawn_shield_bonus * calculate_pawn_shield_counts(bitboards)
+
+
+def save_evaluation_parameters(
+    path,
+):  # Writes the current tables and weights to a file which load_evaluation_parameters can read back
+    np.savez(
+        path,
+        tables=np.array(table_array, dtype=np.int64),
+        doubled_pawn_penalty=doubled_pawn_penalty,
+        isolated_pawn_penalty=isolated_pawn_penalty,
+        backward_pawn_penalty=backward_pawn_penalty,
+        passed_pawn_bonus=np.array(passed_pawn_bonus, dtype=np.int64),
+        pawn_shield_bonus=pawn_shield_bonus,
+        king_safety_weight=king_safety_weight,
+        mobility_weight=mobility_weight,
+    )
+
+
+def load_evaluation_parameters(
+    path,
+):  # Replaces the tables and weights with tuned ones, boards created beforehand keep their old material scores
+    global doubled_pawn_penalty, isolated_pawn_penalty, backward_pawn_penalty
+    global pawn_shield_bonus, king_safety_weight, mobility_weight
+
+    with np.load(path) as parameters:
+        for table, tuned_table in zip(table_array, parameters["tables"]):
+            table[:] = (
+                tuned_table  # Updated in place, as the board holds references to the tables
+            )
+
+        doubled_pawn_penalty = int(parameters["doubled_pawn_penalty"])
+        isolated_pawn_penalty = int(parameters["isolated_pawn_penalty"])
+        backward_pawn_penalty = int(parameters["backward_pawn_penalty"])
+        passed_pawn_bonus[:] = [int(bonus) for bonus in parameters["passed_pawn_bonus"]]
+        pawn_shield_bonus = int(parameters["pawn_shield_bonus"])
+        king_safety_weight = float(parameters["king_safety_weight"])
+        mobility_weight = float(parameters["mobility_weight"])
+
+    refresh_stacked_tables()
+
+
+# Bumped whenever the tables or weights change, so that caches drop scores computed with the old ones
+parameters_version = 0
+
+
+def refresh_stacked_tables():  # Copies changed piece-square tables into the stacked copy used for vectorised evaluation, invalidating every cached score
+    global parameters_version
+    parameters_version += 1
+
+    stacked_table_array[0] = table_array
+    stacked_table_array[1] = [table[::-1] for table in table_array]
+
+
+class EvaluationCache:  # Fixed-size, direct-mapped store of leaf evaluations keyed by the position hash
+    def __init__(self, index_bits=16):
+        self.index_bits = index_bits
+        self.size = 1 << index_bits
+        self.index_shift = (
+            64 - index_bits
+        )  # The multiplicative position hash mixes best into its upper bits, so those pick the slot
+
+        # Each slot keeps the full key to verify a hit, and whether it has been filled
+        self.verification = np.zeros(self.size, dtype=np.uint64)
+        self.scores = np.zeros(self.size, dtype=np.float64)
+        self.occupied = np.zeros(self.size, dtype=np.bool_)
+
+        self.hits = 0
+        self.misses = 0
+        self.parameters_version = parameters_version
+
+    def probe(
+        self, key
+    ):  # Returns the cached evaluation for the position, or None if it is not stored
+        if self.parameters_version != parameters_version:  # Loaded or tuned since
+            self.clear()
+            self.parameters_version = parameters_version
+
+        key = int(key)
+        index = key >> self.index_shift
+
+        if self.occupied[index] and self.verification[index] == key:
+            self.hits += 1
+            return self.scores[index]
+
+        self.misses += 1
+        return None
+
+    def store(
+        self, key, score
+    ):  # Stores an evaluation, always replacing whatever was in the slot
+        key = int(key)
+        index = key >> self.index_shift
+
+        self.verification[index] = key
+        self.scores[index] = score
+        self.occupied[index] = True
+
+    def clear(self):  # Empties the cache, needed whenever the evaluation weights change
+        self.occupied[:] = False
+        self.hits = 0
+        self.misses = 0
+
+    def memory_usage(self):  # Bytes held by the slots, which are allocated up front
+        return self.verification.nbytes + self.scores.nbytes + self.occupied.nbytes
+
+    def hit_rate(self) -> float:
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+
+class PawnHashTable(
+    EvaluationCache
+):  # Pawn structure scores keyed by the pawn-only key, which changes far less often than the position
+    def __init__(self, index_bits=14):
+        super().__init__(index_bits)
+
+
 class EvaluationFunction:
     def __init__(self) -> None:
+        self.pawn_hash_table = PawnHashTable()
+
         # Piece values
         self.piece_values = {
             "P": 100,
@@ -459,29 +865,40 @@ class EvaluationFunction:
             "K": 99999,
         }
 
+    @profiler.profile("evaluate")
     def evaluate(self, board) -> float:
         eval = 0
 
-        # Material evaluation
-        eval += 1.0 * self.evaluate_material(board)
+        # Material evaluation, kept up to date by the board as moves are made
+        eval += 1.0 * self.evaluate_incremental_material(board)
+
+        # Mobility and king safety share one pass over the attack bitboards
+        mobility, king_safety = calculate_attack_terms(
+            to_integers(board.all_bitboards[:8])
+        )
 
-        '''# Pawn structure evaluation
-        eval += 0.3 * self.evaluate_pawn_structure(board)
+        # Pawn structure evaluation, already in centipawns
+        eval += 1.0 * self.evaluate_pawn_structure(board)
 
         # King safety evaluation
-        eval += 10 * self.evaluate_king_safety(board)
+        eval += king_safety_weight * king_safety
+
+        """# Piece development evaluation
+        eval += 0.3 * self.evaluate_piece_development(board)"""
 
-        # Piece development evaluation
-        eval += 0.3 * self.evaluate_piece_development(board)
-        
         # Mobility evaluation
-        eval += 10 * self.evaluate_mobility(board)'''
+        eval += mobility_weight * mobility
 
         return eval
 
+    def evaluate_incremental_material(
+        self, board
+    ) -> float:  # Reads the running material scores maintained by make_move and undo_move
+        return board.material_scores[0] - board.material_scores[1]
+
     def evaluate_material(
         self, board
-    ) -> float:  # Evaluate how much material each side has
+    ) -> float:  # Evaluate how much material each side has, recounting every square
         eval = 0.0
 
         for square in range(64):  # Loop through each square on the chess board
@@ -504,58 +921,84 @@ class EvaluationFunction:
 
         return eval
 
-    def evaluate_mobility(self, board) -> float:  # Evaluate how mobile each side is
-        white_mobility = len(
-            board.legal_moves
-        )  # Determines how many legal moves white has
+    def evaluate_material_vectorised(
+        self, board
+    ) -> float:  # Full material evaluation in a handful of NumPy calls rather than a loop over squares
+        scores = calculate_material_scores(board.all_bitboards)
 
-        board.flip_board()  # Makes it blacks turn so that black's moves can be generated
-        black_mobility = len(
-            board.legal_moves
-        )  # Determines how many legal moves black has
-        
+        return scores[0] - scores[1]
 
-        return white_mobility - black_mobility  # Returns the difference between them
+    def evaluate_batch(
+        self, positions, batch_size=4096
+    ) -> np.ndarray:  # Scores an (N, 13) array of positions in the all_bitboards layout, from each side to move's perspective
+        positions = np.asarray(positions, dtype=np.uint64)
 
-    def evaluate_pawn_structure(self, board) -> float:
-        # Evaluate pawn structure (e.g., isolated pawns, doubled pawns, passed pawns)
-        eval = 0
+        if positions.ndim != 2 or positions.shape[1] != 13:
+            raise ValueError(
+                f"Expected an (N, 13) array of positions, got shape {positions.shape}"
+            )
+
+        evals = np.empty(len(positions), dtype=np.float64)
+
+        for start in range(
+            0, len(positions), batch_size
+        ):  # Works through the positions in chunks so the unpacked occupancy stays small
+            chunk = positions[start : start + batch_size]
+
+            evals[start : start + len(chunk)] = self.evaluate_batch_chunk(chunk)
+
+        return evals
+
+    def evaluate_batch_chunk(
+        self, positions
+    ) -> np.ndarray:  # Mirrors evaluate, with every term computed across the whole chunk at once
+        eval = np.zeros(len(positions), dtype=np.float64)
+
+        # Material evaluation
+        material = piece_square_scores(positions)
+        eval += 1.0 * (material[:, 0] - material[:, 1])
+
+        columns = bitboard_columns(positions)
+
+        # Pawn structure evaluation
+        eval += 1.0 * (
+            calculate_pawn_structure(columns) + calculate_pawn_shields(columns)
+        )
+
+        mobility, king_safety = calculate_attack_terms(columns)
+
+        # King safety evaluation
+        eval += king_safety_weight * king_safety
+
+        # Mobility evaluation
+        eval += mobility_weight * mobility
 
         return eval
 
+    def evaluate_mobility(
+        self, board
+    ) -> float:  # Evaluate how mobile each side is, from the squares their pieces attack
+        return calculate_attack_terms(to_integers(board.all_bitboards[:8]))[0]
+
+    def evaluate_pawn_structure(
+        self, board
+    ) -> float:  # Evaluate pawn structure (isolated, doubled, passed and backward pawns, and pawn shields)
+        key = combine_pawn_keys(board.pawn_keys)
+        eval = self.pawn_hash_table.probe(key)
+
+        if (
+            eval is None
+        ):  # Only work out the structure of pawns which have not been seen before
+            eval = calculate_pawn_structure(to_integers(board.all_bitboards[:8]))
+            self.pawn_hash_table.store(key, eval)
+
+        # Shields depend on where the kings are, so are added outside of the pawn hash table
+        return eval + calculate_pawn_shields(to_integers(board.all_bitboards[:8]))
+
     def evaluate_king_safety(
         self, board
-    ) -> float:  # Evaluate king safety (e.g., pawn shelter, open lines near the king)
-        white_open_lines = []
-        black_open_lines = []
-
-        white_king_square = (
-            board.all_bitboards[5] & board.all_bitboards[6]
-        ).item().bit_length() - 1  # Finds the square that the white king is on
-
-        white_open_lines.extend(
-            board.generate_orthogonal_moves(white_king_square)
-        )  # Add the horizontal and vertical lines open near the king
-        white_open_lines.extend(
-            board.generate_diagonal_moves(white_king_square)
-        )  # Add the diagonal lines near the king
-
-        board.flip_board()  # Flip the board to the other colour
-
-        black_king_square = (
-            board.all_bitboards[5] & board.all_bitboards[6]
-        ).item().bit_length() - 1  # Find the black king
-
-        black_open_lines.extend(
-            board.generate_orthogonal_moves(black_king_square)
-        )  # Add the horizontal and vertical lines open near the king
-        black_open_lines.extend(
-            board.generate_diagonal_moves(black_king_square)
-        )  # Add the diagonal lines near the king
-
-        return len(white_open_lines) - len(
-            black_open_lines
-        )  # Return the difference in king safety, not negated due to earlier board flips
+    ) -> float:  # Evaluate king safety from the open lines radiating from each king
+        return calculate_attack_terms(to_integers(board.all_bitboards[:8]))[1]
 
     def evaluate_piece_development(self, board) -> float:
         # Evaluate piece development (e.g., pieces developed vs. undeveloped)
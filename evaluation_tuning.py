@@ -0,0 +1,321 @@
+import argparse
+import re
+
+import numpy as np
+
+import evaluation_functions
+from bitboard_operations import bitboard_columns
+from evaluation_functions import (
+    calculate_attack_terms,
+    calculate_pawn_features,
+    calculate_pawn_shield_counts,
+    load_evaluation_parameters,
+    refresh_stacked_tables,
+    save_evaluation_parameters,
+    table_array,
+    unpack_piece_bitboards,
+)
+from fen_handling import InvalidFEN, fen_to_position
+from self_play import read_training_shard
+
+# One feature per piece-square table entry, followed by one per scalar weight
+PIECE_SQUARE_FEATURES = 6 * 64
+PARAMETER_NAMES = [
+    "king_safety_weight",
+    "mobility_weight",
+    "doubled_pawn_penalty",
+    "isolated_pawn_penalty",
+    "backward_pawn_penalty",
+    "passed_pawn_bonus_1",
+    "passed_pawn_bonus_2",
+    "passed_pawn_bonus_3",
+    "passed_pawn_bonus_4",
+    "passed_pawn_bonus_5",
+    "passed_pawn_bonus_6",
+    "pawn_shield_bonus",
+]
+FEATURE_COUNT = PIECE_SQUARE_FEATURES + len(PARAMETER_NAMES)
+
+# Game results as they appear in EPD opcodes (c9 "1-0";) or bracketed after a FEN ([1.0])
+result_pattern = re.compile(r"1/2-1/2|1-0|0-1|\[(?:1\.0|0\.5|0\.0|1|0)\]")
+result_values = {
+    "1-0": 1.0,
+    "0-1": 0.0,
+    "1/2-1/2": 0.5,
+    "[1.0]": 1.0,
+    "[1]": 1.0,
+    "[0.5]": 0.5,
+    "[0.0]": 0.0,
+    "[0]": 0.0,
+}
+
+
+def read_labelled_positions(
+    path,
+):  # Yields the FEN and result, from white's perspective, of every labelled line in a dataset
+    with open(path) as dataset:
+        for line in dataset:
+            results = result_pattern.findall(line)
+
+            if not results:  # Skips blank lines and positions without a result
+                continue
+
+            fields = line.split()
+            fen = " ".join(fields[:4]) + " 0 1"  # EPD lines carry no move clocks
+
+            yield fen, result_values[results[-1]]
+
+
+def load_dataset(
+    path,
+):  # Reads a labelled dataset once into an (N, 13) position array and results from each side to move's perspective
+    if path.endswith(".bin"):  # Self-play shards are already in bitboard form
+        return load_training_shard(path)
+
+    positions = []
+    results = []
+
+    for fen, result in read_labelled_positions(path):
+        try:
+            bitboards, white_to_move, _, _ = fen_to_position(fen)
+        except InvalidFEN:
+            continue  # Skips malformed lines rather than abandoning a large dataset
+
+        positions.append(bitboards)
+        results.append(result if white_to_move else 1.0 - result)
+
+    return np.array(positions, dtype=np.uint64), np.array(results, dtype=np.float32)
+
+
+def load_training_shard(
+    path,
+):  # Converts a self-play shard into the same position array and results as load_dataset
+    records = read_training_shard(path)
+
+    positions = np.zeros((len(records), 13), dtype=np.uint64)
+    positions[:, :8] = records["bitboards"]
+    positions[:, 10] = positions[:, 6] | positions[:, 7]  # Occupancy mask
+
+    return positions, (records["result"].astype(np.float32) + 1) / 2
+
+
+def build_feature_matrix(
+    positions, batch_size=4096
+) -> (
+    np.ndarray
+):  # Expands positions into features whose dot product with the parameters is the evaluation
+    features = np.empty((len(positions), FEATURE_COUNT), dtype=np.int16)
+
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start : start + batch_size]
+        rows = slice(start, start + len(chunk))
+
+        # Each table entry is used by the side to move's pieces and by the opponent's pieces on the mirrored square
+        occupancy = unpack_piece_bitboards(chunk).astype(np.int16)
+        piece_squares = occupancy[:, 0] - occupancy[:, 1, :, ::-1]
+        features[rows, :PIECE_SQUARE_FEATURES] = piece_squares.reshape(len(chunk), -1)
+
+        columns = bitboard_columns(chunk)
+        mobility, king_safety = calculate_attack_terms(columns)
+        doubled, isolated, backward, *passed_by_rank = calculate_pawn_features(columns)
+
+        features[rows, PIECE_SQUARE_FEATURES:] = np.stack(
+            [
+                king_safety,
+                mobility,
+                -doubled,  # Penalties are stored as positive numbers
+                -isolated,
+                -backward,
+                *passed_by_rank,
+                calculate_pawn_shield_counts(columns),
+            ],
+            axis=1,
+        )
+
+    return features
+
+
+def current_parameters() -> (
+    np.ndarray
+):  # Gathers the evaluation's tables and weights into one vector
+    return np.concatenate(
+        [
+            np.array(table_array, dtype=np.float64).reshape(-1),
+            [
+                evaluation_functions.king_safety_weight,
+                evaluation_functions.mobility_weight,
+                evaluation_functions.doubled_pawn_penalty,
+                evaluation_functions.isolated_pawn_penalty,
+                evaluation_functions.backward_pawn_penalty,
+                *evaluation_functions.passed_pawn_bonus[1:7],
+                evaluation_functions.pawn_shield_bonus,
+            ],
+        ]
+    )
+
+
+def apply_parameters(
+    parameters,
+):  # Writes a parameter vector back into the evaluation, rounding everything but the term weights to centipawns
+    for table, tuned_table in zip(
+        table_array, parameters[:PIECE_SQUARE_FEATURES].reshape(6, 64)
+    ):
+        table[:] = np.round(tuned_table)
+
+    (
+        king_safety_weight,
+        mobility_weight,
+        doubled_pawn_penalty,
+        isolated_pawn_penalty,
+        backward_pawn_penalty,
+        *passed_pawn_bonus,
+        pawn_shield_bonus,
+    ) = parameters[PIECE_SQUARE_FEATURES:]
+
+    evaluation_functions.king_safety_weight = float(king_safety_weight)
+    evaluation_functions.mobility_weight = float(mobility_weight)
+    evaluation_functions.doubled_pawn_penalty = round(doubled_pawn_penalty)
+    evaluation_functions.isolated_pawn_penalty = round(isolated_pawn_penalty)
+    evaluation_functions.backward_pawn_penalty = round(backward_pawn_penalty)
+    evaluation_functions.passed_pawn_bonus[1:7] = [
+        round(bonus) for bonus in passed_pawn_bonus
+    ]
+    evaluation_functions.pawn_shield_bonus = round(pawn_shield_bonus)
+
+    refresh_stacked_tables()
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def mean_squared_error(
+    features, results, parameters, scaling, batch_size=65536
+) -> (
+    float
+):  # Texel loss between the predicted and actual results over the whole dataset
+    total = 0.0
+
+    for start in range(0, len(features), batch_size):
+        evals = features[start : start + batch_size].astype(np.float32) @ parameters
+        errors = sigmoid(scaling * evals) - results[start : start + batch_size]
+        total += float(np.dot(errors, errors))
+
+    return total / len(features)
+
+
+def find_scaling_constant(
+    features, results, parameters, iterations=30
+) -> (
+    float
+):  # Finds the scale which best maps centipawns to results, by ternary search over its logarithm
+    low, high = np.log(1e-4), np.log(1e-1)
+
+    for _ in range(iterations):
+        first = low + (high - low) / 3
+        second = high - (high - low) / 3
+
+        if mean_squared_error(
+            features, results, parameters, np.exp(first)
+        ) < mean_squared_error(features, results, parameters, np.exp(second)):
+            high = second
+        else:
+            low = first
+
+    return float(np.exp((low + high) / 2))
+
+
+def tune(
+    features,
+    results,
+    parameters,
+    scaling,
+    epochs=10,
+    learning_rate=1.0,
+    batch_size=16384,
+    seed=0,
+) -> (
+    np.ndarray
+):  # Minimises the Texel loss with Adam, one NumPy matrix product per mini-batch
+    generator = np.random.default_rng(seed)
+    parameters = parameters.astype(np.float32)
+    first_moment = np.zeros_like(parameters)
+    second_moment = np.zeros_like(parameters)
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    step = 0
+
+    for epoch in range(epochs):
+        order = generator.permutation(len(features))
+
+        for start in range(0, len(features), batch_size):
+            batch = order[start : start + batch_size]
+            batch_features = features[batch].astype(np.float32)
+
+            predictions = sigmoid(scaling * (batch_features @ parameters))
+            errors = predictions - results[batch]
+
+            # Gradient of the mean squared error through the sigmoid
+            gradient = (
+                batch_features.T
+                @ (errors * predictions * (1.0 - predictions))
+                * (2.0 * scaling / len(batch))
+            )
+
+            step += 1
+            first_moment = beta1 * first_moment + (1 - beta1) * gradient
+            second_moment = beta2 * second_moment + (1 - beta2) * gradient**2
+            parameters -= (
+                learning_rate
+                * (first_moment / (1 - beta1**step))
+                / (np.sqrt(second_moment / (1 - beta2**step)) + epsilon)
+            )
+
+        print(
+            f"Epoch {epoch + 1}: loss {mean_squared_error(features, results, parameters, scaling):.6f}"
+        )
+
+    return parameters.astype(np.float64)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tune the evaluation tables and weights on a labelled EPD/FEN dataset or self-play shard"
+    )
+    parser.add_argument("dataset", help="file of positions labelled with results")
+    parser.add_argument("--output", default="tuned_parameters.npz")
+    parser.add_argument("--parameters", help="parameter file to start from")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--learning-rate", type=float, default=1.0)
+    parser.add_argument("--batch-size", type=int, default=16384)
+    arguments = parser.parse_args()
+
+    if arguments.parameters:
+        load_evaluation_parameters(arguments.parameters)
+
+    positions, results = load_dataset(arguments.dataset)
+    features = build_feature_matrix(positions)
+    print(f"Loaded {len(positions)} positions")
+
+    parameters = current_parameters()
+    scaling = find_scaling_constant(features, results, parameters)
+    print(
+        f"Scaling constant {scaling:.6f}, initial loss {mean_squared_error(features, results, parameters, scaling):.6f}"
+    )
+
+    parameters = tune(
+        features,
+        results,
+        parameters,
+        scaling,
+        arguments.epochs,
+        arguments.learning_rate,
+        arguments.batch_size,
+    )
+
+    apply_parameters(parameters)
+    save_evaluation_parameters(arguments.output)
+    print(f"Saved tuned parameters to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+from functools import lru_cache
+
 import numpy as np
 
+from bitboard_operations import rotate_bitboard
+
 
 # Creates an exception for when an invalid FEN is detected
 class InvalidFEN(Exception):
@@ -8,185 +12,285 @@ class InvalidFEN(Exception):
         super().__init__(self.message)
 
 
-def fen_to_bitboards(fen):
+# Mapping of FEN piece abbreviations to piece types
+piece_mapping = {"p": 0, "n": 1, "b": 2, "r": 3, "q": 4, "k": 5}
+# Mapping of castle options to bitboard
+castling_mapping = {"K": 0b1000, "Q": 0b0100, "k": 0b0010, "q": 0b0001}
+
+# FEN letters of white's pieces, indexed by piece type
+fen_letters = "PNBRQK"
+
+# Symbols used to draw each FEN letter, and "." for an empty square
+display_symbols = {
+    "R": "♜",
+    "N": "♞",
+    "B": "♝",
+    "Q": "♛",
+    "K": "♚",
+    "P": "♟",
+    "r": "♖",
+    "n": "♘",
+    "b": "♗",
+    "q": "♕",
+    "k": "♔",
+    "p": "♙",
+    ".": "·",
+}
+
+# Each byte with its bits in reverse order, used to mirror a rank from the other side of the board
+reversed_bytes = [int(f"{byte:08b}"[::-1], 2) for byte in range(256)]
+
+
+# Parsed ranks are cached by their FEN text, as the same few ranks make up most positions, with a bound for long-running workers
+@lru_cache(maxsize=4096)
+def parse_rank(
+    rank_text,
+):  # Converts one rank of a FEN into 8 bit rows, one per piece type then white and black, plus their mirror images
+    rows = [0] * 8
+    file_index = 0
+
+    for char in rank_text:
+        if char.isdigit():
+            # Skip empty squares
+            file_index += int(char)
+        else:
+            bit = 1 << file_index
+            rows[piece_mapping[char.lower()]] |= bit
+            rows[6 if char.isupper() else 7] |= bit
+            file_index += 1
+
+    if file_index != 8:  # Every rank must describe exactly 8 squares
+        raise ValueError(rank_text)
+
+    return rows, [reversed_bytes[row] for row in rows]
+
+
+def fen_to_position(
+    fen,
+):  # Parses a FEN into ChessBoard's 13 bitboards, seen from the side to move, along with the side and move clocks
     try:
-        # Mapping of FEN piece abbreviations to piece types
-        piece_mapping = {"p": 0, "n": 1, "b": 2, "r": 3, "q": 4, "k": 5}
-        # Mapping of castle options to bitboard
-        castling_mapping = {"K": 0b1000, "Q": 0b0100, "k": 0b0010, "q": 0b0001}
-
-        # Initialize bitboards for each piece type, all white pieces, and all black pieces
-        bitboards = [np.uint64(0)] * 6
-        white_pieces = np.uint64(0)
-        black_pieces = np.uint64(0)
-        castling_rights = 0b0000  # 4-bit integer for castling rights
-        en_passant_square = np.uint(0)
+        fields = fen.split()
+        placement, active_color, castling_fen, en_passant_fen = fields[:4]
+        ranks = placement.split("/")
 
-        # Extract the piece placement part of the FEN
-        piece_placement = fen.split()[0]
+        if len(ranks) != 8 or active_color not in ("w", "b"):
+            raise ValueError(fen)
 
-        # Loop through each rank and file
-        for rank, fen_rank in enumerate(reversed(piece_placement.split("/"))):
-            file_index = 0
+        white_to_move = active_color == "w"
 
-            # Loop through each character in the FEN rank
-            for char in fen_rank:
-                if char.isdigit():
-                    # Skip empty squares
-                    file_index += int(char)
-                else:
-                    # Map the FEN piece abbreviation to the corresponding piece type
-                    piece_type = piece_mapping[char.lower()]
+        # EPD lines carry operations rather than clocks after the fourth field
+        halfmove_clock = (
+            int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        )
+        fullmove_number = (
+            int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        )
 
-                    # Set the corresponding bit in the bitboard
-                    bitboards[piece_type] |= np.uint64(1) << np.uint64(
-                        rank * 8 + file_index
-                    )
+        pawns = knights = bishops = rooks = queens = kings = white = black = 0
 
-                    # Set the bit in the all white or all black pieces bitboards
-                    if char.isupper():  # White piece
-                        white_pieces |= np.uint64(1) << np.uint64(rank * 8 + file_index)
-                    else:  # Black piece
-                        black_pieces |= np.uint64(1) << np.uint64(rank * 8 + file_index)
+        for index, rank_text in enumerate(ranks):  # FEN lists rank 8 first
+            parsed = parse_rank(rank_text)
 
-                    file_index += 1
+            # With black to move the board is turned round, so each rank is mirrored and moved to the other end
+            if white_to_move:
+                rows = parsed[0]
+                shift = 8 * (7 - index)
+            else:
+                rows = parsed[1]
+                shift = 8 * index
+
+            pawns |= rows[0] << shift
+            knights |= rows[1] << shift
+            bishops |= rows[2] << shift
+            rooks |= rows[3] << shift
+            queens |= rows[4] << shift
+            kings |= rows[5] << shift
+            white |= rows[6] << shift
+            black |= rows[7] << shift
 
         # Process castling rights
-        castling_fen = fen.split()[2]
-        for char in castling_fen:
-            castling_rights |= castling_mapping.get(char, 0)
+        castling_rights = 0b0000  # 4-bit integer for castling rights
+        if castling_fen != "-":
+            for char in castling_fen:
+                castling_rights |= castling_mapping[char]
 
-        # Process en passant target square
-        en_passant_fen = fen.split()[3]
+        # Process en passant target square, stored as a bitboard with just that square set
+        en_passant = 0
         if en_passant_fen != "-":
-            en_passant_file = ord(en_passant_fen[0]) - ord("a")
-            en_passant_rank = 8 - int(en_passant_fen[1])
-            en_passant_square = en_passant_rank * 8 + en_passant_file
-
-        # Add all white pieces, all black pieces, castling rights, and en passant target bitboards to the array
-        bitboards.extend(
-            [
-                white_pieces,
-                black_pieces,
-                np.uint64(castling_rights),
-                np.uint64(en_passant_square),
-            ]
-        )  # Appends the remaining bitboards to the array of all bitboards
-        return bitboards
-    except:
-        raise InvalidFEN(fen)
+            # Only the square just behind a pawn of the side not to move can be the target
+            if (
+                len(en_passant_fen) != 2
+                or en_passant_fen[0] not in "abcdefgh"
+                or en_passant_fen[1] != ("6" if white_to_move else "3")
+            ):
+                raise InvalidFEN(fen)
+
+            en_passant_square = "abcdefgh".index(en_passant_fen[0]) + 8 * (
+                int(en_passant_fen[1]) - 1
+            )
+            en_passant = 1 << en_passant_square
 
+        if white_to_move:
+            friendly, opponent = white, black
+        else:  # The side to move always occupies bitboard 6, as ChessBoard flips after every move
+            friendly, opponent = black, white
+            castling_rights = reversed_bytes[castling_rights] << 56
+            en_passant = (1 << (63 - en_passant_square)) if en_passant else 0
 
-def bitboards_to_fen(bitboards):
-    # Mapping of piece types to FEN abbreviations
-    piece_mapping = {0: "p", 1: "n", 2: "b", 3: "r", 4: "q", 5: "k"}
-
-    # Extract bitboards for each piece type, all white pieces, all black pieces, castling rights, and en passant target
-    (
-        pawn_board,
-        knight_board,
-        bishop_board,
-        rook_board,
-        queen_board,
-        king_board,
-        white_pieces_board,
-        black_pieces_board,
-        castling_rights,
-        en_passant_target,
-    ) = bitboards  # Assigns each bitboard to a variable with a more aptly suited name
-
-    # Convert bitboards to FEN piece placement
-    piece_placement = ""
-    for rank in range(7, -1, -1):  # Loop through ranks in reverse order
-        empty_count = 0  # Count consecutive empty squares
-        for file in range(8):
-            square = rank * 8 + file
-            piece = next(
-                (
-                    piece_mapping[piece_type]
-                    for piece_type, piece_board in enumerate(
-                        [
-                            pawn_board,
-                            knight_board,
-                            bishop_board,
-                            rook_board,
-                            queen_board,
-                            king_board,
-                        ]
-                    )
-                    if (
-                        piece_board & np.uint64(1) << np.uint64(square)
-                    )  # If there is a piece on the square in the bitboard that is being searched, assign that piece to piece
-                ),
-                None,
+    except (ValueError, IndexError, KeyError):
+        raise InvalidFEN(fen)
+
+    position = [
+        pawns,  # Pawns, 0
+        knights,  # Knights, 1
+        bishops,  # Bishops, 2
+        rooks,  # Rooks, 3
+        queens,  # Queens, 4
+        kings,  # Kings, 5
+        friendly,  # Side to move, 6
+        opponent,  # Opponent, 7
+        castling_rights,  # Castling, 8
+        en_passant,  # En passant, 9
+        friendly | opponent,  # Occupancy mask, 10
+        0,  # Attacked squares, 11
+        0,  # Pawn structure, 12
+    ]
+
+    return position, white_to_move, halfmove_clock, fullmove_number
+
+
+def fen_to_bitboards(
+    fen,
+):  # The first 10 bitboards of a FEN as seen from white's side, regardless of the side to move
+    position, white_to_move, _, _ = fen_to_position(fen)
+    bitboards = position[:10]
+
+    if not white_to_move:  # Turned back round, with white's pieces in bitboard 6
+        bitboards = [rotate_bitboard(bitboard) for bitboard in bitboards]
+        bitboards[6], bitboards[7] = bitboards[7], bitboards[6]
+
+    return [np.uint64(bitboard) for bitboard in bitboards]
+
+
+def read_positions(
+    path,
+):  # Streams positions from a file of FENs or EPD records, one per line, skipping blank lines
+    with open(path) as positions:
+        for line in positions:
+            if line.strip():
+                yield fen_to_position(line)
+
+
+def fill_position_array(
+    path, positions, skip_invalid=True
+):  # Parses a FEN or EPD file straight into a preallocated (N, 13) uint64 array, returning how many rows were filled
+    count = 0
+
+    with open(path) as lines:
+        for line in lines:
+            if count == len(positions):
+                break
+
+            if not line.strip():
+                continue
+
+            try:
+                positions[count] = fen_to_position(line)[0]
+            except InvalidFEN:
+                if not skip_invalid:
+                    raise
+                continue
+
+            count += 1
+
+    return count
+
+
+def position_to_mailbox(
+    position, white_to_move=True
+):  # Lists the FEN letter on every square from a1 to h8, or "." if empty, walking only the set bits of each bitboard
+    mailbox = ["."] * 64
+    friendly, opponent = int(position[6]), int(position[7])
+
+    # Bitboards are seen from the side to move, so with black to move the squares and colours are turned round
+    friendly_letters = fen_letters if white_to_move else fen_letters.lower()
+    opponent_letters = fen_letters.lower() if white_to_move else fen_letters
+
+    for piece_index in range(6):
+        bitboard = int(position[piece_index])
+
+        while bitboard:
+            lowest_bit = bitboard & -bitboard
+            square = lowest_bit.bit_length() - 1
+            bitboard ^= lowest_bit
+
+            letter = (
+                friendly_letters[piece_index]
+                if lowest_bit & friendly
+                else opponent_letters[piece_index]
             )
-            if piece is not None:
-                # Piece found, append empty count and piece to FEN
-                if empty_count > 0:
-                    piece_placement += str(empty_count)
-                    empty_count = 0
-
-                if white_pieces_board & np.uint64(1) << np.uint64(
-                    square
-                ):  # If the piece is a white piece, then add the uppercase version of the character
-                    piece_placement += piece.upper()
-                else:  # If not white, then it must be black so add the lowercase character
-                    piece_placement += piece
-            else:
-                # Empty square, increase empty count
-                empty_count += 1
-
-        if empty_count > 0:
-            # Append remaining empty count for the rank
-            piece_placement += str(empty_count)
-
-        if rank > 0:
-            # Separate ranks with '/'
-            piece_placement += "/"
-
-    # Determine active color
-    active_color = "w" if white_pieces_board != 0 else "b"
-
-    # Determine castling rights in FEN
-    castling_fen = ""
-    if castling_rights & np.uint64(0b1000):  # Determines if white can castle kingside
-        castling_fen += "K"
-    if castling_rights & np.uint64(0b0100):  # Determines if white can castle queenside
-        castling_fen += "Q"
-    if castling_rights & np.uint64(0b0010):  # Determines if black can castle kingside
-        castling_fen += "k"
-    if castling_rights & np.uint64(0b0001):  # Determines if black can castle queenside
-        castling_fen += "q"
-
-    # Determine en passant target square in FEN
-    en_passant_fen = (
-        "-"
-        if en_passant_target == 0
-        else f"{chr((int(en_passant_target) % 8) + ord('a'))}{8 - (en_passant_target // 8)}"
+            mailbox[square if white_to_move else 63 - square] = letter
+
+    return mailbox
+
+
+def position_to_fen(
+    position, white_to_move=True, halfmove_clock=0, fullmove_number=1
+):  # Inverse of fen_to_position, writing a FEN from ChessBoard's bitboards and the state kept alongside them
+    mailbox = position_to_mailbox(position, white_to_move)
+
+    ranks = []
+    for rank in range(7, -1, -1):  # FEN lists rank 8 first
+        rank_text = "".join(mailbox[8 * rank : 8 * rank + 8])
+
+        # Runs of empty squares are written as their length
+        for empty_count in range(8, 0, -1):
+            rank_text = rank_text.replace("." * empty_count, str(empty_count))
+
+        ranks.append(rank_text)
+
+    # Castling rights and the en passant square are stored from the side to move's view too
+    castling_rights = int(position[8])
+    en_passant = int(position[9])
+
+    if not white_to_move:
+        castling_rights = reversed_bytes[castling_rights >> 56]
+        en_passant = 1 << (64 - en_passant.bit_length()) if en_passant else 0
+
+    castling_fen = "".join(
+        char for char, bit in castling_mapping.items() if castling_rights & bit
     )
 
-    return f"{piece_placement} {active_color} {castling_fen} {en_passant_fen} 0 1"
+    en_passant_fen = "-"
+    if en_passant:
+        en_passant_square = en_passant.bit_length() - 1
+        en_passant_fen = (
+            f"{'abcdefgh'[en_passant_square % 8]}{en_passant_square // 8 + 1}"
+        )
 
+    return (
+        f"{'/'.join(ranks)} {'w' if white_to_move else 'b'} {castling_fen or '-'} "
+        f"{en_passant_fen} {halfmove_clock} {fullmove_number}"
+    )
+
+
+def bitboards_to_fen(
+    bitboards,
+):  # The FEN of bitboards seen from white's side, as read by fen_to_bitboards
+    return position_to_fen(bitboards)
 
-def display_chess_position(fen):
 
-    # Create a mapping for piece characters
-    piece_mapping = {
-        "R": "♜",
-        "N": "♞",
-        "B": "♝",
-        "Q": "♛",
-        "K": "♚",
-        "P": "♟",
-        "r": "♖",
-        "n": "♘",
-        "b": "♗",
-        "q": "♕",
-        "k": "♔",
-        "p": "♙",
-        ".": "·",
-    }
+def render_mailbox(
+    mailbox,
+):  # Draws a mailbox as rows of piece symbols, rank 8 at the top
+    return "".join(
+        " ".join(display_symbols[char] for char in mailbox[8 * rank : 8 * rank + 8])
+        + "\n"
+        for rank in range(7, -1, -1)
+    )
+
 
+def display_chess_position(fen):
     # Parse FEN string
     rows = fen.split()[0].split("/")
 
@@ -204,7 +308,7 @@ def display_chess_position(fen):
             else:  # If it is not an empty square
                 try:
                     display_row.append(
-                        piece_mapping[char]
+                        display_symbols[char]
                     )  # Add on the corresponding piece
                 except (
                     KeyError
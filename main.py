@@ -8,10 +8,7 @@ from notation_handling import (
     decompose_notation,
 )  # Importing InvalidNotation exception and decompose_notation function
 from fen_handling import InvalidFEN  # Importing InvalidFEN exception
-from search_algorithms import *  # Importing search algorithms
-from evaluation_functions import *  # Importing evaluation functions
-
-import numpy as np
+from search_algorithms import SearchContext  # Importing the search engine
 
 STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"  # Default starting chess position
 TEST_FEN = "k5q1/8/8/8/8/8/8/K4Q2 w - - 0 1"
@@ -44,6 +41,7 @@ def playGame(board: ChessBoard):
     Function to play the chess game.
     """
     depth = 4  # Chooses the depth that the program will run at
+    context = SearchContext()  # The computer's search tables, kept for the whole game
 
     board.display_board()  # Displaying the initial chess board
 
@@ -74,7 +72,7 @@ def playGame(board: ChessBoard):
             continue
 
         t.start()
-        move, score = negamax_alpha_beta_top(
+        move, score = context.negamax_alpha_beta_top(
             board, depth, -float("inf"), float("inf"), 1
         )  # Applying the negamax algorithm to get the best move for the computer
 
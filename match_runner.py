@@ -0,0 +1,675 @@
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+
+from board_representation import ChessBoard
+from notation_handling import InvalidNotation, InvalidSquare, uci_to_move
+from pgn_handling import game_from_moves, write_game
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+STARTUP_TIMEOUT = 30  # Seconds an engine has to answer uci and isready
+FIXED_LIMIT_TIMEOUT = 120  # Seconds allowed for a move under a fixed limit
+CLOCK_MARGIN = 1.0  # Seconds beyond the clock before a silent engine is treated as hung
+
+# Critical values of the standard normal distribution for two-sided confidence intervals
+Z_SCORES = {0.90: 1.6449, 0.95: 1.9600, 0.99: 2.5758}
+
+
+class EngineError(Exception):
+    def __init__(self, name, reason):
+        self.message = f"{name}: {reason}"
+        super().__init__(self.message)
+
+
+class EngineConfiguration:  # How to start one side of a match, which is any UCI engine command with its options
+    def __init__(self, name, command, options=None):
+        self.name = name
+        self.command = shlex.split(command) if isinstance(command, str) else command
+        self.options = options or {}
+
+    def key(self):
+        return (self.name, tuple(self.command), tuple(sorted(self.options.items())))
+
+
+class TimeControl:  # Per-move limits sent with every go command, or a clock of base seconds plus an increment
+    def __init__(self, depth=None, nodes=None, movetime=None, base=None, increment=0.0):
+        self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+        self.base = base
+        self.increment = increment
+
+
+def parse_clock(text):  # "10+0.1" is ten seconds plus a tenth of a second a move
+    base, _, increment = text.partition("+")
+    return float(base), float(increment or 0)
+
+
+class UCIProcess:  # A running engine, read on a background thread so that every reply can be waited for with a timeout
+    def __init__(self, configuration):
+        self.name = configuration.name
+        try:
+            self.process = subprocess.Popen(
+                configuration.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                bufsize=1,
+            )
+        except OSError as error:
+            raise EngineError(self.name, f"could not start: {error}")
+
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read_output, daemon=True).start()
+
+        try:
+            self.send("uci")
+            self.read_until("uciok", STARTUP_TIMEOUT)
+
+            for name, value in configuration.options.items():
+                self.send(f"setoption name {name} value {value}")
+
+            self.send("isready")
+            self.read_until("readyok", STARTUP_TIMEOUT)
+        except EngineError:  # Never stored anywhere, so nothing else would reap it
+            self.process.kill()
+            raise
+
+    def read_output(self):
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)  # The engine has exited
+
+    def send(self, command):
+        try:
+            self.process.stdin.write(command + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise EngineError(self.name, "engine exited")
+
+    def read_until(
+        self, prefix, timeout
+    ):  # Returns every line up to and including the first starting with prefix
+        deadline = time.perf_counter() + timeout
+        lines = []
+
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                raise EngineError(self.name, f"no {prefix} within {timeout:.1f}s")
+
+            if line is None:
+                raise EngineError(self.name, "engine exited")
+
+            lines.append(line)
+            if line.startswith(prefix):
+                return lines
+
+    def new_game(self):
+        self.send("ucinewgame")
+        self.send("isready")
+        self.read_until("readyok", STARTUP_TIMEOUT)
+
+    def best_move(
+        self, position_command, go_command, timeout
+    ):  # Searches a position, returning the move with the depth and nodes of the last report
+        self.send(position_command)
+        self.send(go_command)
+        lines = self.read_until("bestmove", timeout)
+
+        depth = nodes = 0
+        for line in lines:
+            fields = line.split()
+
+            # Reports from other engines may be blank, cut short or carry fields this does not expect
+            if fields[:1] == ["info"]:
+                depth = info_value(fields, "depth", depth)
+                nodes = info_value(fields, "nodes", nodes)
+
+        fields = lines[-1].split()
+        if len(fields) < 2:
+            raise EngineError(self.name, "bestmove without a move")
+
+        return fields[1], depth, nodes
+
+    def quit(self):
+        try:
+            self.send("quit")
+            self.process.wait(timeout=5)
+        except (EngineError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+def info_value(
+    fields, name, default
+):  # The integer following a name in an info line, or the default if it is missing or malformed
+    try:
+        return int(fields[fields.index(name) + 1])
+    except (ValueError, IndexError):
+        return default
+
+
+# Engines started by this worker process, reused by both games of the pair it is playing
+worker_engines = {}
+
+
+def get_engine(configuration) -> UCIProcess:
+    key = configuration.key()
+
+    if key not in worker_engines or worker_engines[key].process.poll() is not None:
+        worker_engines[key] = UCIProcess(configuration)
+
+    return worker_engines[key]
+
+
+def discard_engine(
+    configuration,
+):  # Stops an engine which failed, so the next game starts a fresh one rather than reading its stale output
+    engine = worker_engines.pop(configuration.key(), None)
+
+    if engine is not None:
+        engine.quit()
+
+
+def close_engines():
+    for engine in worker_engines.values():
+        engine.quit()
+    worker_engines.clear()
+
+
+def repetition_key(
+    board,
+):  # Positions repeat when their placement, side, castling and en passant all match
+    return " ".join(board.to_fen().split()[:4])
+
+
+def play_game(
+    white, black, opening_fen, time_control, max_plies
+):  # Referees one game, returning the result for white and each side's speed and depth
+    board = ChessBoard(opening_fen)
+    clocks = [time_control.base, time_control.base]
+    moves = []
+    uci_moves = []
+    repetitions = {repetition_key(board): 1}
+    statistics = [{"nodes": 0, "time": 0.0, "depths": []} for _ in range(2)]
+    result, termination = 0.5, "max plies"
+
+    # Indexed by whether black is to move, with a side whose engine cannot start forfeiting
+    engines = []
+    for side, configuration in enumerate((white, black)):
+        try:
+            engine = get_engine(configuration)
+            engine.new_game()
+        except EngineError:
+            discard_engine(configuration)
+            result, termination = (0.0 if side == 0 else 1.0), "crash"
+            break
+
+        engines.append(engine)
+
+    for ply in range(max_plies if len(engines) == 2 else 0):
+        side = 0 if board.white_to_move else 1
+        game_over, score = board.is_game_over()
+
+        if game_over:
+            if score == 0:
+                result, termination = 0.5, "stalemate"
+            else:  # A king has been captured, and score says whether the side to move won
+                result = 1.0 if (score > 0) == board.white_to_move else 0.0
+                termination = "king captured"
+            break
+
+        if board.halfmove_clock >= 100:
+            result, termination = 0.5, "fifty moves"
+            break
+
+        if repetitions[repetition_key(board)] >= 3:
+            result, termination = 0.5, "repetition"
+            break
+
+        if int(board.all_bitboards[10]) == int(board.all_bitboards[5]):
+            result, termination = 0.5, "insufficient material"
+            break
+
+        position_command = f"position fen {opening_fen}" + (
+            f" moves {' '.join(uci_moves)}" if uci_moves else ""
+        )
+
+        if time_control.base is not None:
+            increment = int(time_control.increment * 1000)
+            go_command = (
+                f"go wtime {int(clocks[0] * 1000)} btime {int(clocks[1] * 1000)} "
+                f"winc {increment} binc {increment}"
+            )
+            timeout = clocks[side] + CLOCK_MARGIN
+        else:
+            go_command = "go" + "".join(
+                f" {name} {value}"
+                for name, value in (
+                    ("depth", time_control.depth),
+                    ("nodes", time_control.nodes),
+                    ("movetime", time_control.movetime),
+                )
+                if value is not None
+            )
+            timeout = FIXED_LIMIT_TIMEOUT
+
+        started = time.perf_counter()
+        try:
+            uci_move, depth, nodes = engines[side].best_move(
+                position_command, go_command, timeout
+            )
+        except EngineError as error:
+            discard_engine((white, black)[side])
+            result = 0.0 if side == 0 else 1.0
+            termination = "time forfeit" if "within" in error.message else "crash"
+            break
+        elapsed = time.perf_counter() - started
+
+        statistics[side]["nodes"] += nodes
+        statistics[side]["time"] += elapsed
+        statistics[side]["depths"].append(depth)
+
+        if time_control.base is not None:
+            clocks[side] -= elapsed
+
+            if clocks[side] < 0:
+                result, termination = (0.0 if side == 0 else 1.0), "time forfeit"
+                break
+
+            clocks[side] += time_control.increment
+
+        try:
+            move = uci_to_move(uci_move, board.white_to_move)
+        except (InvalidNotation, InvalidSquare):
+            move = None
+
+        if move is None or move not in [str(legal) for legal in board.legal_moves]:
+            result, termination = (
+                0.0 if side == 0 else 1.0
+            ), f"illegal move {uci_move}"
+            break
+
+        board.make_move(move)
+        board.generate_legal_moves()
+        moves.append(move)
+        uci_moves.append(uci_move)
+
+        key = repetition_key(board)
+        repetitions[key] = repetitions.get(key, 0) + 1
+
+    return {
+        "white": white.name,
+        "black": black.name,
+        "opening": opening_fen,
+        "result": result,
+        "termination": termination,
+        "plies": len(moves),
+        "moves": moves,
+        "speed": {
+            configuration.name: {
+                "nps": (
+                    side_statistics["nodes"] / side_statistics["time"]
+                    if side_statistics["time"]
+                    else 0.0
+                ),
+                "mean_depth": (
+                    sum(side_statistics["depths"]) / len(side_statistics["depths"])
+                    if side_statistics["depths"]
+                    else 0.0
+                ),
+            }
+            for configuration, side_statistics in zip((white, black), statistics)
+        },
+    }
+
+
+def play_pair(
+    first, second, opening_fen, time_control, max_plies
+):  # Worker task, playing an opening once with each engine as white so the opening's bias cancels out
+    # Closed here, as atexit handlers never run in pool workers, and whatever happens to the pair
+    try:
+        return [
+            play_game(first, second, opening_fen, time_control, max_plies),
+            play_game(second, first, opening_fen, time_control, max_plies),
+        ]
+    finally:
+        close_engines()
+
+
+def read_openings(path):  # FENs or EPD records, one per line
+    with open(path) as openings:
+        return [
+            " ".join(line.split()[:4]) + " 0 1" for line in openings if line.strip()
+        ]
+
+
+def random_opening(
+    seed, plies=8
+):  # A position reached by random moves from the start, for when no opening book is given
+    generator = random.Random(seed)
+    board = ChessBoard(STARTING_FEN)
+
+    for _ in range(plies):
+        if board.is_game_over()[0]:
+            break
+        board.make_move(str(generator.choice(board.legal_moves)))
+        board.generate_legal_moves()
+
+    return board.to_fen()
+
+
+def first_engine_score(
+    game, first_name
+):  # Result of a game from the first engine's side
+    return game["result"] if game["white"] == first_name else 1.0 - game["result"]
+
+
+def pair_statistics(
+    pair_scores,
+):  # Mean and variance of the pair scores, each being the average of the first engine's two results
+    count = len(pair_scores)
+    mean = sum(pair_scores) / count
+    variance = sum((score - mean) ** 2 for score in pair_scores) / count
+
+    return mean, variance
+
+
+def elo_from_score(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def score_from_elo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo_interval(
+    pair_scores, confidence=0.95
+):  # Elo difference with its confidence interval, from the pentanomial spread of the paired games
+    mean, variance = pair_statistics(pair_scores)
+    margin = Z_SCORES[confidence] * math.sqrt(variance / len(pair_scores))
+
+    return (
+        elo_from_score(mean),
+        elo_from_score(mean - margin),
+        elo_from_score(mean + margin),
+    )
+
+
+def sprt_llr(
+    pair_scores, elo0, elo1
+):  # Generalised SPRT log-likelihood ratio of H1 (elo1) against H0 (elo0), using the normal approximation
+    mean, variance = pair_statistics(pair_scores)
+
+    if variance == 0:  # Every pair scored the same, so there is no information yet
+        return 0.0
+
+    score0, score1 = score_from_elo(elo0), score_from_elo(elo1)
+    return (
+        len(pair_scores)
+        * (score1 - score0)
+        * (2 * mean - score0 - score1)
+        / (2 * variance)
+    )
+
+
+def sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def summarise(games, pair_scores, first, second, sprt=None, confidence=0.95):
+    wins = sum(first_engine_score(game, first.name) == 1.0 for game in games)
+    losses = sum(first_engine_score(game, first.name) == 0.0 for game in games)
+    summary = {
+        "games": len(games),
+        "wins": wins,
+        "draws": len(games) - wins - losses,
+        "losses": losses,
+    }
+
+    if pair_scores:
+        elo, lower, upper = elo_interval(pair_scores, confidence)
+        summary.update({"elo": elo, "elo_lower": lower, "elo_upper": upper})
+
+    if sprt is not None and pair_scores:
+        summary["llr"] = sprt_llr(pair_scores, sprt["elo0"], sprt["elo1"])
+        summary["llr_bounds"] = sprt_bounds(sprt["alpha"], sprt["beta"])
+
+    # Speed is reported next to strength, so slowdowns show up even when the results look the same
+    for configuration in (first, second):
+        speeds = [game["speed"][configuration.name] for game in games]
+        summary[configuration.name] = {
+            "nps": sum(speed["nps"] for speed in speeds) / len(speeds) if speeds else 0,
+            "mean_depth": (
+                sum(speed["mean_depth"] for speed in speeds) / len(speeds)
+                if speeds
+                else 0
+            ),
+        }
+
+    return summary
+
+
+def should_stop(
+    summary, sprt, min_games
+):  # Early stopping by SPRT, or by the Elo interval excluding zero
+    if summary["games"] < min_games or "elo" not in summary:
+        return None
+
+    if sprt is not None:
+        lower_bound, upper_bound = summary["llr_bounds"]
+
+        if summary["llr"] >= upper_bound:
+            return "H1 accepted"
+        if summary["llr"] <= lower_bound:
+            return "H0 accepted"
+        return None
+
+    if summary["elo_lower"] > 0:
+        return "first engine stronger"
+    if summary["elo_upper"] < 0:
+        return "second engine stronger"
+    return None
+
+
+def run_match(
+    first,
+    second,
+    time_control,
+    games=1000,
+    openings=None,
+    workers=None,
+    max_plies=400,
+    sprt=None,
+    min_games=20,
+    confidence=0.95,
+    seed=0,
+    pgn_path=None,
+):  # Plays game pairs across a process pool until the game count is reached or a stopping rule is met
+    pairs = games // 2
+    openings = openings or [random_opening(seed + index) for index in range(pairs)]
+
+    results = []
+    pair_scores = []
+    stop_reason = None
+    next_pair = 0
+    workers = workers or os.cpu_count()
+
+    with (
+        open(pgn_path, "a") if pgn_path else nullcontext() as pgn,
+        ProcessPoolExecutor(max_workers=workers) as executor,
+    ):
+        # Pairs are submitted a few at a time, so stopping early does not leave thousands queued
+        in_flight = set()
+
+        def submit():
+            nonlocal next_pair
+            while next_pair < pairs and len(in_flight) < 2 * workers:
+                in_flight.add(
+                    executor.submit(
+                        play_pair,
+                        first,
+                        second,
+                        openings[next_pair % len(openings)],
+                        time_control,
+                        max_plies,
+                    )
+                )
+                next_pair += 1
+
+        submit()
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for task in done:
+                pair = task.result()
+                results.extend(pair)
+                pair_scores.append(
+                    sum(first_engine_score(game, first.name) for game in pair) / 2
+                )
+
+                if pgn is not None:
+                    for game in pair:
+                        write_game(pgn, game_record(game))
+
+            summary = summarise(results, pair_scores, first, second, sprt, confidence)
+            progress = f"Games {summary['games']}: +{summary['wins']} ={summary['draws']} -{summary['losses']}"
+            if "elo" in summary:
+                progress += f", Elo {summary['elo']:.1f} [{summary['elo_lower']:.1f}, {summary['elo_upper']:.1f}]"
+            if "llr" in summary:
+                progress += f", LLR {summary['llr']:.2f}"
+            print(progress)
+
+            stop_reason = should_stop(summary, sprt, min_games)
+            if stop_reason is not None:
+                for task in in_flight:
+                    task.cancel()
+                break
+
+            submit()
+
+    return {
+        "first": first.name,
+        "second": second.name,
+        "stop_reason": stop_reason or "game limit",
+        "summary": summarise(results, pair_scores, first, second, sprt, confidence),
+        "games": [
+            {key: value for key, value in game.items() if key != "moves"}
+            for game in results
+        ],
+    }
+
+
+def game_record(game):  # Converts a refereed game into a PGN game
+    result = {1.0: "1-0", 0.0: "0-1", 0.5: "1/2-1/2"}[game["result"]]
+    headers = {
+        "Event": "Engine match",
+        "White": game["white"],
+        "Black": game["black"],
+        "Termination": game["termination"],
+    }
+    return game_from_moves(game["moves"], headers, game["opening"], result)
+
+
+def parse_options(options):  # ["Hash=32", ...] into {"Hash": "32"}
+    return dict(option.split("=", 1) for option in options or [])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Play a match between two UCI engine configurations"
+    )
+    parser.add_argument(
+        "--engine1", required=True, help="command starting the first engine"
+    )
+    parser.add_argument(
+        "--engine2", required=True, help="command starting the second engine"
+    )
+    parser.add_argument("--name1", default="first")
+    parser.add_argument("--name2", default="second")
+    parser.add_argument("--option1", action="append", help="UCI option as name=value")
+    parser.add_argument("--option2", action="append", help="UCI option as name=value")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--openings", help="FEN or EPD file of starting positions")
+    parser.add_argument(
+        "--tc", help="clock as base+increment in seconds, such as 10+0.1"
+    )
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--nodes", type=int)
+    parser.add_argument("--movetime", type=int, help="milliseconds")
+    parser.add_argument("--max-plies", type=int, default=400)
+    parser.add_argument(
+        "--sprt",
+        nargs=4,
+        type=float,
+        metavar=("ELO0", "ELO1", "ALPHA", "BETA"),
+        help="stop once the SPRT accepts either hypothesis",
+    )
+    parser.add_argument("--min-games", type=int, default=20)
+    parser.add_argument("--confidence", type=float, default=0.95, choices=Z_SCORES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pgn", help="file to append the games to")
+    parser.add_argument("--output", help="file to write the JSON report to")
+    arguments = parser.parse_args()
+
+    if arguments.name1 == arguments.name2:
+        parser.error("the engines need different names")
+
+    first = EngineConfiguration(
+        arguments.name1, arguments.engine1, parse_options(arguments.option1)
+    )
+    second = EngineConfiguration(
+        arguments.name2, arguments.engine2, parse_options(arguments.option2)
+    )
+
+    if arguments.tc:
+        base, increment = parse_clock(arguments.tc)
+        time_control = TimeControl(base=base, increment=increment)
+    elif arguments.depth or arguments.nodes or arguments.movetime:
+        time_control = TimeControl(arguments.depth, arguments.nodes, arguments.movetime)
+    else:
+        time_control = TimeControl(depth=2)
+
+    sprt = (
+        dict(zip(("elo0", "elo1", "alpha", "beta"), arguments.sprt))
+        if arguments.sprt
+        else None
+    )
+
+    report = run_match(
+        first,
+        second,
+        time_control,
+        arguments.games,
+        read_openings(arguments.openings) if arguments.openings else None,
+        arguments.workers,
+        arguments.max_plies,
+        sprt,
+        arguments.min_games,
+        arguments.confidence,
+        arguments.seed,
+        arguments.pgn,
+    )
+    print(f"Finished: {report['stop_reason']}")
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
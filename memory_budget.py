@@ -0,0 +1,79 @@
+import math
+
+DEFAULT_MEMORY = 16 * 2**20  # Bytes given to a search context when no budget is set
+
+# Fraction of the budget each component may use. The MCTS tree and opening book get nothing until they exist,
+# and then take their share from the transposition table's
+DEFAULT_SHARES = {
+    "transposition_table": 0.60,
+    "evaluation_cache": 0.28,
+    "pawn_cache": 0.12,
+    "mcts_tree": 0.0,
+    "opening_book": 0.0,
+}
+
+# Approximate bytes per stored position, used to turn an allocation into a capacity before anything is stored
+TRANSPOSITION_ENTRY_BYTES = 320  # Key, entry dict, score and the table's own slot
+CACHE_ENTRY_BYTES = (
+    17  # Key, score and occupied flag of one evaluation or pawn cache slot
+)
+MINIMUM_INDEX_BITS = 10
+
+
+class InvalidMemoryBudget(Exception):
+    def __init__(self, reason):
+        self.message = f"Invalid memory budget: {reason}"
+        super().__init__(self.message)
+
+
+def cache_index_bits(
+    allocation, entry_bytes=CACHE_ENTRY_BYTES
+):  # The largest power of two number of slots fitting in an allocation, as direct-mapped caches need
+    slots = max(allocation // entry_bytes, 1)
+    return max(MINIMUM_INDEX_BITS, int(math.log2(slots)))
+
+
+class MemoryBudget:  # Splits a byte limit between an engine's caches, sizing them to fit and reporting what they use
+    def __init__(self, total_bytes=DEFAULT_MEMORY, shares=None):
+        shares = dict(DEFAULT_SHARES, **(shares or {}))
+
+        if total_bytes <= 0:
+            raise InvalidMemoryBudget(f"{total_bytes} bytes is not positive")
+
+        if any(share < 0 for share in shares.values()) or sum(shares.values()) > 1:
+            raise InvalidMemoryBudget("shares must be non-negative and total at most 1")
+
+        self.total_bytes = total_bytes
+        self.shares = shares
+
+    def allocation(self, component):  # Bytes a component may use
+        return int(self.total_bytes * self.shares.get(component, 0.0))
+
+    def transposition_capacity(self):  # Positions the transposition table may hold
+        return max(
+            self.allocation("transposition_table") // TRANSPOSITION_ENTRY_BYTES, 1
+        )
+
+    def evaluation_index_bits(self):
+        return cache_index_bits(self.allocation("evaluation_cache"))
+
+    def pawn_index_bits(self):
+        return cache_index_bits(self.allocation("pawn_cache"))
+
+    def report(
+        self, usage
+    ):  # Each component's allocation beside the bytes it actually uses, given a usage such as SearchContext.memory_usage()
+        return {
+            "budget": self.total_bytes,
+            "used": sum(usage.values()),
+            "components": {
+                component: {
+                    # Components outside the budget, such as a board's move history, have no allocation
+                    "allocated": (
+                        self.allocation(component) if component in self.shares else None
+                    ),
+                    "used": used,
+                }
+                for component, used in usage.items()
+            },
+        }
@@ -0,0 +1,226 @@
+import numpy as np
+
+from evaluation_functions import unpack_piece_bitboards
+from timer import profiler
+
+# Network input: one feature per [colour][piece][square], seen from one side of the board
+FEATURE_COUNT = 2 * 6 * 64
+
+# Quantisation constants, activations are clipped to [0, ACTIVATION_LIMIT] and hidden weights are scaled by WEIGHT_SCALE
+ACTIVATION_LIMIT = 127
+WEIGHT_SCALE = 64
+OUTPUT_SCALE = 16  # Divides the final integer output down to centipawns
+
+
+class InvalidWeights(Exception):
+    def __init__(self, path, reason):
+        self.message = f'"{path}" is not a valid NNUE weights file: {reason}'
+        super().__init__(self.message)
+
+
+class NNUEWeights:  # The quantised parameters of a small feature transformer network
+    def __init__(
+        self,
+        feature_weights,
+        feature_bias,
+        hidden_weights,
+        hidden_bias,
+        output_weights,
+        output_bias,
+    ):
+        self.feature_weights = np.asarray(
+            feature_weights, dtype=np.int16
+        )  # (FEATURE_COUNT, accumulator size)
+        self.feature_bias = np.asarray(feature_bias, dtype=np.int16)
+        self.hidden_weights = np.asarray(
+            hidden_weights, dtype=np.int8
+        )  # (2 * accumulator size, hidden size)
+        self.hidden_bias = np.asarray(hidden_bias, dtype=np.int32)
+        self.output_weights = np.asarray(output_weights, dtype=np.int8)
+        self.output_bias = np.asarray(output_bias, dtype=np.int32)
+
+        self.accumulator_size = self.feature_bias.shape[0]
+
+        # Widened once here so that the hidden layers do not need converting on every evaluation
+        self.hidden_weights_wide = self.hidden_weights.astype(np.int32)
+        self.output_weights_wide = self.output_weights.astype(np.int32)
+
+
+def load_nnue_weights(
+    path,
+) -> NNUEWeights:  # Reads a local .npz file of quantised weights
+    with np.load(path) as data:
+        try:
+            weights = NNUEWeights(
+                data["feature_weights"],
+                data["feature_bias"],
+                data["hidden_weights"],
+                data["hidden_bias"],
+                data["output_weights"],
+                data["output_bias"],
+            )
+        except KeyError as error:
+            raise InvalidWeights(path, f"missing array {error}")
+
+    accumulator_size = weights.accumulator_size
+    hidden_size = weights.hidden_bias.shape[0]
+
+    # Checks that the layers fit together before the network is ever used
+    if (
+        weights.feature_weights.shape != (FEATURE_COUNT, accumulator_size)
+        or weights.hidden_weights.shape != (2 * accumulator_size, hidden_size)
+        or weights.output_weights.shape != (hidden_size,)
+        or weights.output_bias.shape not in ((), (1,))
+    ):
+        raise InvalidWeights(path, "layer shapes do not match")
+
+    return weights
+
+
+def save_nnue_weights(
+    path, weights
+):  # Writes weights in the format read by load_nnue_weights
+    np.savez(
+        path,
+        feature_weights=weights.feature_weights,
+        feature_bias=weights.feature_bias,
+        hidden_weights=weights.hidden_weights,
+        hidden_bias=weights.hidden_bias,
+        output_weights=weights.output_weights,
+        output_bias=weights.output_bias,
+    )
+
+
+def random_nnue_weights(
+    accumulator_size=128, hidden_size=32, seed=0
+) -> (
+    NNUEWeights
+):  # Small random weights, for exercising the evaluator before a trained network exists
+    generator = np.random.default_rng(seed)
+
+    return NNUEWeights(
+        generator.integers(-64, 64, size=(FEATURE_COUNT, accumulator_size)),
+        generator.integers(-64, 64, size=accumulator_size),
+        generator.integers(-64, 64, size=(2 * accumulator_size, hidden_size)),
+        generator.integers(-1024, 1024, size=hidden_size),
+        generator.integers(-64, 64, size=hidden_size),
+        np.int32(0),
+    )
+
+
+class NNUEAccumulator:  # First layer outputs for both sides, updated from piece deltas as moves are made and undone
+    def __init__(self, weights: NNUEWeights):
+        self.weights = weights
+
+        # Row 0 is seen from the side to move and row 1 from the opponent, with one entry per ply searched
+        self.stack = [np.zeros((2, weights.accumulator_size), dtype=np.int16)]
+
+    def refresh(
+        self, bitboards
+    ):  # Rebuilds the accumulators from scratch, used when a board is first attached
+        occupancy = unpack_piece_bitboards(bitboards)  # [colour][piece][square]
+
+        perspectives = [
+            occupancy.reshape(FEATURE_COUNT),
+            occupancy[::-1, :, ::-1].reshape(
+                FEATURE_COUNT
+            ),  # The opponent sees its own pieces first, from its side of the board
+        ]
+
+        for row, features in enumerate(perspectives):
+            self.stack[-1][row] = (
+                self.weights.feature_bias
+                + self.weights.feature_weights[np.flatnonzero(features)].sum(
+                    axis=0, dtype=np.int16
+                )
+            )
+
+    def push(self):  # Copies the current accumulators so that a move can be undone
+        self.stack.append(self.stack[-1].copy())
+
+    def pop(self):  # Returns to the accumulators before the last move
+        self.stack.pop()
+
+    def swap(self):  # Swaps perspectives when the board is flipped to the other side
+        self.stack[-1] = self.stack[-1][::-1].copy()
+
+    def update_piece(
+        self, piece_index, square, own, sign
+    ):  # Adds (sign 1) or removes (sign -1) a piece of the side to move (own) or the opponent
+        colour = 0 if own else 1
+        accumulators = self.stack[-1]
+        feature_weights = self.weights.feature_weights
+
+        if sign > 0:
+            accumulators[0] += feature_weights[colour * 384 + piece_index * 64 + square]
+            accumulators[1] += feature_weights[
+                (1 - colour) * 384 + piece_index * 64 + 63 - square
+            ]
+        else:
+            accumulators[0] -= feature_weights[colour * 384 + piece_index * 64 + square]
+            accumulators[1] -= feature_weights[
+                (1 - colour) * 384 + piece_index * 64 + 63 - square
+            ]
+
+
+def check_incremental_updates(
+    board, depth=2, line=()
+):  # Makes and undoes every move to a depth, returning the first line after which the board's accumulators differ from a refresh, or None
+    def matches():
+        fresh = NNUEAccumulator(board.accumulator.weights)
+        fresh.refresh(board.all_bitboards)
+        return np.array_equal(board.accumulator.stack[-1], fresh.stack[-1])
+
+    if not matches():
+        return list(line)
+
+    if depth == 0:
+        return None
+
+    stack_size = len(board.accumulator.stack)
+
+    for move in board.generate_legal_moves():
+        board.make_move(move)
+        mismatch = check_incremental_updates(board, depth - 1, line + (move,))
+        board.undo_move()
+
+        if mismatch is not None:
+            return mismatch
+
+        if len(board.accumulator.stack) != stack_size or not matches():
+            return list(line + (move,))
+
+    return None
+
+
+class NNUEEvaluator:  # Drop-in alternative to EvaluationFunction, scoring positions with a quantised network
+    def __init__(self, weights: NNUEWeights):
+        self.weights = weights
+
+    @profiler.profile("evaluate")
+    def evaluate(
+        self, board
+    ) -> (
+        float
+    ):  # Evaluates from the side to move's perspective, attaching accumulators to the board if needed
+        if board.accumulator is None or board.accumulator.weights is not self.weights:
+            board.attach_accumulator(NNUEAccumulator(self.weights))
+
+        return self.propagate(board.accumulator.stack[-1])
+
+    def propagate(
+        self, accumulators
+    ) -> (
+        float
+    ):  # Runs the layers after the feature transformer, all in integer arithmetic
+        weights = self.weights
+
+        # Clipped ReLU on both perspectives, with the side to move first
+        inputs = np.clip(accumulators, 0, ACTIVATION_LIMIT).reshape(-1).astype(np.int32)
+
+        hidden = inputs @ weights.hidden_weights_wide + weights.hidden_bias
+        hidden = np.clip(hidden // WEIGHT_SCALE, 0, ACTIVATION_LIMIT)
+
+        output = int(hidden @ weights.output_weights_wide) + int(weights.output_bias)
+
+        return output / (WEIGHT_SCALE * OUTPUT_SCALE)
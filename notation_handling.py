@@ -83,3 +83,35 @@ def isOnBoard(
     bool
 ):  # Boolean expression to check if an inputted numerical square is on a standard chess board
     return 0 <= square < 64
+
+
+def orient_square(
+    square: int, white_to_move: bool
+) -> (
+    int
+):  # Converts between squares seen from the side to move and real squares, being its own inverse
+    return square if white_to_move else 63 - square
+
+
+def move_to_uci(
+    move: str, white_to_move: bool
+) -> (
+    str
+):  # Converts a move seen from the side to move into UCI's real squares and lowercase promotion piece
+    start_square, end_square, promotion_piece = decompose_notation(str(move))
+    return (
+        encode_square(orient_square(start_square, white_to_move))
+        + encode_square(orient_square(end_square, white_to_move))
+        + (promotion_piece.lower() if promotion_piece else "")
+    )
+
+
+def uci_to_move(
+    uci_move: str, white_to_move: bool
+) -> str:  # Inverse of move_to_uci, giving the notation which make_move takes
+    start_square, end_square, promotion_piece = decompose_notation(uci_move)
+    return (
+        encode_square(orient_square(start_square, white_to_move))
+        + encode_square(orient_square(end_square, white_to_move))
+        + (promotion_piece.upper() if promotion_piece else "")
+    )
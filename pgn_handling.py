@@ -0,0 +1,334 @@
+import re
+
+from board_representation import ChessBoard
+from notation_handling import decompose_notation, encode_square, orient_square
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# The seven tag roster, written first and in this order by every PGN writer
+SEVEN_TAG_ROSTER = ["Event", "Site", "Date", "Round", "White", "Black", "Result"]
+
+tag_pattern = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+
+# Everything in movetext which is not a move is either skipped here or recognised as a result
+movetext_pattern = re.compile(
+    r"\{[^}]*\}"  # Brace comments
+    r"|;[^\n]*"  # Rest of line comments
+    r"|\$\d+"  # Numeric annotation glyphs
+    r"|\d+\.(?:\.\.)?"  # Move numbers
+    r"|1-0|0-1|1/2-1/2|\*"  # Results
+    r"|\(|\)"  # Variations
+    r"|[^\s{};()$]+"  # Moves
+)
+san_pattern = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class InvalidPGN(Exception):
+    def __init__(self, text, reason):
+        self.message = f'"{text}" is invalid PGN: {reason}'
+        super().__init__(self.message)
+
+
+class PGNGame:  # The tags and mainline moves of one game, as read from or written to a PGN file
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []  # Standard algebraic notation
+        self.result = result
+
+    def starting_fen(self):
+        return self.headers.get("FEN", STARTING_FEN)
+
+
+def parse_movetext(
+    movetext,
+):  # Splits movetext into its mainline moves and result, skipping comments, annotations and variations
+    moves = []
+    result = "*"
+    variation_depth = 0
+
+    for token in movetext_pattern.findall(movetext):
+        if token == "(":
+            variation_depth += 1
+        elif token == ")":
+            variation_depth -= 1
+        elif (
+            variation_depth > 0
+            or token[0] in "{;$"
+            or (token[0].isdigit() and "." in token)
+        ):  # Moves inside variations, comments, annotations and move numbers
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+
+    return moves, result
+
+
+def read_games(
+    stream,
+):  # Yields every game of a PGN file one at a time, only holding the current game's text in memory
+    headers = {}
+    movetext = []
+    open_comment = False  # Brace comments may contain blank lines and brackets, so they must be tracked
+
+    for line in stream:
+        stripped = line.strip()
+
+        if open_comment:
+            movetext.append(line)
+        elif stripped.startswith("["):
+            if movetext:  # A tag after movetext starts the next game
+                yield build_game(headers, movetext)
+                headers, movetext = {}, []
+
+            match = tag_pattern.match(stripped)
+            if match is None:
+                raise InvalidPGN(stripped, "malformed tag")
+
+            headers[match.group(1)] = match.group(2).replace('\\"', '"')
+            continue
+        elif stripped.startswith("%"):  # Escaped lines are ignored
+            continue
+        elif stripped:
+            movetext.append(line)
+        elif movetext:  # A blank line after movetext ends the game
+            yield build_game(headers, movetext)
+            headers, movetext = {}, []
+            continue
+
+        # Whichever brace comes last on the line decides whether a comment is still open
+        opening, closing = line.rfind("{"), line.rfind("}")
+        if opening >= 0 or closing >= 0:
+            open_comment = opening > closing
+
+    if headers or movetext:
+        yield build_game(headers, movetext)
+
+
+def build_game(headers, movetext) -> PGNGame:
+    moves, result = parse_movetext("".join(movetext))
+    return PGNGame(
+        headers, moves, headers.get("Result", result) if result == "*" else result
+    )
+
+
+def legal_moves(
+    board,
+):  # The generated moves which do not leave the mover's own king attacked
+    moves = []
+
+    for move in board.generate_legal_moves():
+        move = str(move)
+        board.make_move(move)
+
+        if not board.is_in_check(1):  # The mover is now the opponent
+            moves.append(move)
+
+        board.undo_move()
+
+    board.generate_legal_moves()
+    return moves
+
+
+def castling_move(
+    board, san
+):  # Converts O-O or O-O-O into the king's two square move, seen from the side to move
+    king_start = orient_square(4 if board.white_to_move else 60, board.white_to_move)
+    kingside = san.replace("0", "O") == "O-O"
+    king_end = orient_square(
+        (6 if kingside else 2) + (0 if board.white_to_move else 56), board.white_to_move
+    )
+
+    if board.determine_piece_on_square(king_start) != "K":
+        raise InvalidPGN(san, "no king to castle with")
+
+    return f"{encode_square(king_start)}{encode_square(king_end)}"
+
+
+def san_to_move(
+    board, san
+):  # Resolves standard algebraic notation into the long algebraic notation which make_move takes
+    san = san.rstrip("+#!?")
+
+    if san.replace("0", "O") in ("O-O", "O-O-O"):
+        return castling_move(board, san)
+
+    match = san_pattern.match(san)
+    if match is None:
+        raise InvalidPGN(san, "unrecognised move")
+
+    piece, from_file, from_rank, target, promotion = match.groups()
+    piece = piece or "P"
+
+    candidates = []
+    for move in board.generate_legal_moves():
+        move = str(move)
+        start_square, end_square, promotion_piece = decompose_notation(move)
+        real_start = encode_square(orient_square(start_square, board.white_to_move))
+
+        if (
+            encode_square(orient_square(end_square, board.white_to_move)) == target
+            and board.determine_piece_on_square(start_square) == piece
+            and (from_file is None or real_start[0] == from_file)
+            and (from_rank is None or real_start[1] == from_rank)
+            and (promotion_piece or None) == promotion
+        ):
+            candidates.append(move)
+
+    if (
+        len(candidates) > 1
+    ):  # Only check legality when a pinned piece could make the move ambiguous
+        legal = legal_moves(board)
+        candidates = [move for move in candidates if move in legal]
+
+    if len(candidates) != 1:
+        raise InvalidPGN(san, "illegal move" if not candidates else "ambiguous move")
+
+    return candidates[0]
+
+
+def move_to_san(
+    board, move
+):  # Writes a move in standard algebraic notation, for the position before it is made
+    move = str(move)
+    start_square, end_square, promotion_piece = decompose_notation(move)
+    piece = board.determine_piece_on_square(start_square)
+    real_start = encode_square(orient_square(start_square, board.white_to_move))
+    real_end = encode_square(orient_square(end_square, board.white_to_move))
+
+    if piece == "K" and abs(end_square - start_square) == 2:
+        san = "O-O" if real_end[0] == "g" else "O-O-O"
+    else:
+        capture = board.determine_piece_on_square(end_square) is not None or (
+            piece == "P" and start_square % 8 != end_square % 8
+        )
+
+        if piece == "P":
+            san = f"{real_start[0]}x" if capture else ""
+        else:
+            # Other pieces of the same type which could also reach the target square
+            rivals = [
+                encode_square(
+                    orient_square(decompose_notation(other)[0], board.white_to_move)
+                )
+                for other in legal_moves(board)
+                if other != move
+                and decompose_notation(other)[1] == end_square
+                and board.determine_piece_on_square(decompose_notation(other)[0])
+                == piece
+            ]
+
+            disambiguation = ""
+            if rivals:
+                if all(rival[0] != real_start[0] for rival in rivals):
+                    disambiguation = real_start[0]
+                elif all(rival[1] != real_start[1] for rival in rivals):
+                    disambiguation = real_start[1]
+                else:
+                    disambiguation = real_start
+
+            san = f"{piece}{disambiguation}{'x' if capture else ''}"
+
+        san += real_end
+
+        if promotion_piece is not None:
+            san += f"={promotion_piece.upper()}"
+
+    # Check and checkmate are marked from the position after the move
+    board.make_move(move)
+    if board.is_in_check():
+        san += "+" if legal_moves(board) else "#"
+    board.undo_move()
+    board.generate_legal_moves()
+
+    return san
+
+
+def replay_game(
+    game,
+):  # Plays a game's moves onto a board, yielding the same board after each one alongside the move made
+    board = ChessBoard(game.starting_fen())
+
+    for san in game.moves:
+        move = san_to_move(board, san)
+        board.make_move(move)
+        board.generate_legal_moves()
+        yield board, move
+
+
+def game_from_moves(
+    moves, headers=None, starting_fen=STARTING_FEN, result="*"
+) -> (
+    PGNGame
+):  # Builds a game from moves in make_move's notation, such as an engine game
+    board = ChessBoard(starting_fen)
+    headers = dict(headers or {})
+    headers["Result"] = result
+
+    if starting_fen != STARTING_FEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = starting_fen
+
+    san_moves = []
+    for move in moves:
+        san_moves.append(move_to_san(board, move))
+        board.make_move(str(move))
+        board.generate_legal_moves()
+
+    return PGNGame(headers, san_moves, result)
+
+
+def format_game(
+    game, line_length=80
+) -> (
+    str
+):  # Writes a game as PGN text, tags first and then movetext wrapped to the line length
+    headers = {tag: "?" for tag in SEVEN_TAG_ROSTER}
+    headers.update(game.headers)
+    headers["Result"] = game.result
+
+    ordered_tags = SEVEN_TAG_ROSTER + [
+        tag for tag in headers if tag not in SEVEN_TAG_ROSTER
+    ]
+    lines = []
+    for tag in ordered_tags:
+        value = str(headers[tag]).replace('"', '\\"')
+        lines.append(f'[{tag} "{value}"]')
+    lines.append("")
+
+    # Move numbers follow the starting position, with black's first move numbered like "12..."
+    fields = game.starting_fen().split()
+    white_to_move = len(fields) < 2 or fields[1] == "w"
+    move_number = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+
+    tokens = []
+    for san in game.moves:
+        if white_to_move:
+            tokens.append(f"{move_number}.")
+        elif not tokens:
+            tokens.append(f"{move_number}...")
+
+        tokens.append(san)
+
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+
+    tokens.append(game.result)
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > line_length:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+
+    return "\n".join(lines) + "\n\n"
+
+
+def write_game(stream, game):  # Appends a game to an open PGN file
+    stream.write(format_game(game))
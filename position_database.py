@@ -0,0 +1,275 @@
+import argparse
+import os
+
+import numpy as np
+
+from bitboard_operations import rotate_bitboard
+from board_representation import ChessBoard
+from evaluation_functions import unpack_piece_bitboards
+from fen_handling import InvalidFEN, fen_to_position
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# A position packed into 32 bytes, seen from the side to move exactly as ChessBoard holds it
+position_record_dtype = np.dtype(
+    [
+        ("occupancy", "<u8"),  # Every occupied square
+        (
+            "pieces",
+            "u1",
+            (16,),
+        ),  # One 4-bit code per occupied square, in square order, low nibble first
+        ("flags", "u1"),  # Side to move in bit 0, castling rights (KQkq) in bits 1-4
+        ("en_passant", "u1"),  # Target square, or NO_EN_PASSANT
+        ("halfmove_clock", "<u2"),
+        ("fullmove_number", "<u2"),
+        ("reserved", "u1", (2,)),  # Keeps records aligned to 32 bytes
+    ]
+)
+
+# Piece codes are the piece type, plus OPPONENT_CODE for pieces of the side not to move
+PIECE_CODES = 6
+OPPONENT_CODE = 8
+NO_EN_PASSANT = 255
+MAXIMUM_PIECES = 32
+
+# Databases start with one record's worth of header, so that the records which follow stay aligned
+DATABASE_MAGIC = b"MEHPOS"
+DATABASE_VERSION = 1
+HEADER_SIZE = position_record_dtype.itemsize
+
+
+class InvalidPositionDatabase(Exception):
+    def __init__(self, path, reason):
+        self.message = f'"{path}" is not a valid position database: {reason}'
+        super().__init__(self.message)
+
+
+def unpack_square_bits(
+    bitboards,
+) -> np.ndarray:  # Expands an array of bitboards into one boolean per square
+    squares = np.ascontiguousarray(bitboards, dtype="<u8").view(np.uint8)
+    return np.unpackbits(squares.reshape(-1, 8), axis=1, bitorder="little").astype(bool)
+
+
+def pack_square_bits(
+    squares,
+) -> (
+    np.ndarray
+):  # Inverse of unpack_square_bits, collapsing (N, 64) booleans back into bitboards
+    packed = np.packbits(squares, axis=1, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8").reshape(-1).astype(np.uint64)
+
+
+def encode_positions(
+    positions, white_to_move, halfmove_clocks=0, fullmove_numbers=1
+) -> (
+    np.ndarray
+):  # Packs an (N, 13) array of positions, and the state alongside them, into records
+    positions = np.asarray(positions, dtype=np.uint64).reshape(-1, 13)
+    white_to_move = np.broadcast_to(
+        np.asarray(white_to_move, dtype=bool), len(positions)
+    )
+    records = np.zeros(len(positions), dtype=position_record_dtype)
+
+    occupied = unpack_square_bits(positions[:, 10])
+    counts = occupied.sum(axis=1)
+
+    if counts.max(initial=0) > MAXIMUM_PIECES:
+        raise ValueError(f"positions may hold at most {MAXIMUM_PIECES} pieces")
+
+    # Code of whatever stands on every square, then just the occupied squares moved to the front in square order
+    occupancy = unpack_piece_bitboards(positions)  # [position][colour][piece][square]
+    piece_codes = np.arange(PIECE_CODES, dtype=np.uint8)[:, None]
+    codes = (occupancy[:, 0] * piece_codes).sum(axis=1) + (
+        occupancy[:, 1] * (piece_codes + OPPONENT_CODE)
+    ).sum(axis=1)
+
+    order = np.argsort(~occupied, axis=1, kind="stable")[:, :MAXIMUM_PIECES]
+    codes = np.take_along_axis(codes, order, axis=1).astype(np.uint8)
+    codes[np.arange(MAXIMUM_PIECES) >= counts[:, None]] = 0
+
+    records["occupancy"] = positions[:, 10]
+    records["pieces"] = codes[:, 0::2] | (codes[:, 1::2] << 4)
+
+    # Castling rights are stored the way white sees them, so they read the same whichever side is to move
+    castling = np.where(
+        white_to_move, positions[:, 8], rotate_bitboard(positions[:, 8])
+    ) & np.uint64(0b1111)
+    records["flags"] = white_to_move | (castling.astype(np.uint8) << 1)
+
+    en_passant = positions[:, 9] != 0
+    records["en_passant"] = np.where(
+        en_passant, unpack_square_bits(positions[:, 9]).argmax(axis=1), NO_EN_PASSANT
+    )
+
+    records["halfmove_clock"] = np.clip(halfmove_clocks, 0, 65535)
+    records["fullmove_number"] = np.clip(fullmove_numbers, 0, 65535)
+
+    return records
+
+
+def decode_positions(
+    records,
+):  # Unpacks records into an (N, 13) position array, with the side to move and move clocks
+    records = np.asarray(records, dtype=position_record_dtype).reshape(-1)
+    positions = np.zeros((len(records), 13), dtype=np.uint64)
+
+    occupied = unpack_square_bits(records["occupancy"])
+    nibbles = np.empty((len(records), MAXIMUM_PIECES), dtype=np.uint8)
+    nibbles[:, 0::2] = records["pieces"] & 0xF
+    nibbles[:, 1::2] = records["pieces"] >> 4
+
+    # The nth occupied square holds the nth code
+    piece_numbers = np.clip(np.cumsum(occupied, axis=1) - 1, 0, MAXIMUM_PIECES - 1)
+    codes = np.take_along_axis(nibbles, piece_numbers, axis=1)
+
+    for piece in range(PIECE_CODES):
+        positions[:, piece] = pack_square_bits(occupied & (codes & 0b0111 == piece))
+
+    positions[:, 6] = pack_square_bits(occupied & (codes < OPPONENT_CODE))
+    positions[:, 7] = pack_square_bits(occupied & (codes >= OPPONENT_CODE))
+    positions[:, 10] = records["occupancy"]
+
+    white_to_move = (records["flags"] & 1).astype(bool)
+    castling = ((records["flags"] >> 1) & 0b1111).astype(np.uint64)
+    positions[:, 8] = np.where(white_to_move, castling, rotate_bitboard(castling))
+
+    en_passant = records["en_passant"] != NO_EN_PASSANT
+    positions[en_passant, 9] = np.uint64(1) << records["en_passant"][en_passant].astype(
+        np.uint64
+    )
+
+    return (
+        positions,
+        white_to_move,
+        records["halfmove_clock"].astype(np.int64),
+        records["fullmove_number"].astype(np.int64),
+    )
+
+
+def encode_board(board):  # Packs a ChessBoard's current position into a single record
+    return encode_positions(
+        board.all_bitboards,
+        board.white_to_move,
+        board.halfmove_clock,
+        board.fullmove_number,
+    )[0]
+
+
+def decode_board(
+    record, board=None
+) -> (
+    ChessBoard
+):  # Loads a record into a board, reusing the one given rather than building another
+    positions, white_to_move, halfmove_clocks, fullmove_numbers = decode_positions(
+        record
+    )
+
+    if board is None:
+        board = ChessBoard(STARTING_FEN)
+
+    board.set_position(
+        positions[0],
+        bool(white_to_move[0]),
+        int(halfmove_clocks[0]),
+        int(fullmove_numbers[0]),
+    )
+    return board
+
+
+def database_header() -> bytes:
+    return (DATABASE_MAGIC + bytes([DATABASE_VERSION])).ljust(HEADER_SIZE, b"\0")
+
+
+def append_positions(
+    path, records
+):  # Adds records to the end of a database, creating it if it does not exist yet
+    new_database = not os.path.exists(path) or os.path.getsize(path) == 0
+
+    with open(path, "ab") as database:
+        if new_database:
+            database.write(database_header())
+
+        np.asarray(records, dtype=position_record_dtype).tofile(database)
+
+
+def open_position_database(
+    path, mode="r"
+) -> (
+    np.memmap
+):  # Maps a database's records into memory, so that slices are read from disk only when used
+    with open(path, "rb") as database:
+        header = database.read(HEADER_SIZE)
+
+    if len(header) < HEADER_SIZE or not header.startswith(DATABASE_MAGIC):
+        raise InvalidPositionDatabase(path, "missing header")
+
+    if header[len(DATABASE_MAGIC)] != DATABASE_VERSION:
+        raise InvalidPositionDatabase(
+            path, f"unsupported version {header[len(DATABASE_MAGIC)]}"
+        )
+
+    if (os.path.getsize(path) - HEADER_SIZE) % position_record_dtype.itemsize:
+        raise InvalidPositionDatabase(path, "truncated record")
+
+    if os.path.getsize(path) == HEADER_SIZE:  # NumPy cannot map an empty region
+        return np.zeros(0, dtype=position_record_dtype)
+
+    return np.memmap(path, dtype=position_record_dtype, mode=mode, offset=HEADER_SIZE)
+
+
+def build_position_database(
+    input_path, output_path, batch_size=65536
+):  # Converts a FEN or EPD file into a database, skipping malformed lines, and returns the number of positions
+    total = 0
+    batch = []
+
+    def flush():
+        positions, white_to_move, halfmove_clocks, fullmove_numbers = zip(*batch)
+        append_positions(
+            output_path,
+            encode_positions(
+                positions, white_to_move, halfmove_clocks, fullmove_numbers
+            ),
+        )
+        batch.clear()
+
+    with open(input_path) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+
+            try:
+                batch.append(fen_to_position(line))
+            except InvalidFEN:
+                continue
+
+            if len(batch) == batch_size:
+                total += len(batch)
+                flush()
+
+    if batch:
+        total += len(batch)
+        flush()
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a FEN or EPD file into a binary position database"
+    )
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--batch-size", type=int, default=65536)
+    arguments = parser.parse_args()
+
+    total = build_position_database(
+        arguments.input, arguments.output, arguments.batch_size
+    )
+    print(f"Wrote {total} positions to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import zipfile
+
+import numpy as np
+
+from bitboard_operations import ALL_DIRECTIONS, KNIGHT_JUMPS, shift_direction
+
+# Bumped whenever a table is added or built differently, so stale cache files are rebuilt rather than trusted
+TABLE_VERSION = 1
+TABLE_SEED = 0x4D65686E67696E65  # "Mehngine" in ASCII
+
+# The cache sits beside the code unless MEHNGINE_TABLES points elsewhere, such as a writable directory
+TABLE_PATH = os.environ.get(
+    "MEHNGINE_TABLES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "precomputed_tables.npz"),
+)
+
+loaded_tables = {}  # Filled on first use, so importing this module costs nothing
+
+
+def splitmix64(
+    seed, count
+):  # Deterministic 64-bit keys which only depend on the seed, unlike NumPy's generators across versions
+    keys = []
+    state = seed
+
+    for _ in range(count):
+        state = (state + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        key = state
+        key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        keys.append(key ^ (key >> 31))
+
+    return np.array(keys, dtype=np.uint64)
+
+
+def leaper_attacks(
+    steps,
+):  # Squares reached from each square by one of a set of single steps, such as a knight's jumps
+    attacks = np.zeros(64, dtype=np.uint64)
+
+    for square in range(64):
+        targets = 0
+        for step in steps:
+            targets |= shift_direction(1 << square, step)
+        attacks[square] = targets
+
+    return attacks
+
+
+def build_tables(
+    seed=TABLE_SEED,
+):  # Every precomputed table, built from nothing but the seed so that each run and each process agrees
+    keys = splitmix64(seed, 13 + 64)
+
+    return {
+        "position_keys": keys[:13],  # One per bitboard, for the search's position hash
+        "pawn_keys": keys[13:],  # One per square, for the pawn structure hash
+        "knight_attacks": leaper_attacks(KNIGHT_JUMPS),
+        "king_attacks": leaper_attacks(ALL_DIRECTIONS),
+    }
+
+
+def save_tables(
+    tables, path=TABLE_PATH, seed=TABLE_SEED
+):  # Writes the tables alongside their version and seed, replacing the file atomically as several processes may race
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        with open(temporary_path, "wb") as stream:
+            np.savez(stream, version=TABLE_VERSION, seed=np.uint64(seed), **tables)
+
+        os.replace(temporary_path, path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def read_tables(
+    path=TABLE_PATH, seed=TABLE_SEED
+):  # The cached tables, or None if the file is missing, unreadable or from another version or seed
+    try:
+        with np.load(path) as cache:
+            if int(cache["version"]) != TABLE_VERSION or int(cache["seed"]) != seed:
+                return None
+
+            return {
+                name: cache[name]
+                for name in cache.files
+                if name not in ("version", "seed")
+            }
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):  # Truncated or corrupt
+        return None
+
+
+def get_table(
+    name,
+):  # Loads every table on the first call, building and caching them if no valid cache exists
+    if not loaded_tables:
+        tables = read_tables()
+
+        if tables is None or name not in tables:
+            tables = build_tables()
+
+            # A read-only install still works, it just builds the tables every time
+            try:
+                save_tables(tables)
+            except OSError:
+                pass
+
+        loaded_tables.update(tables)
+
+    return loaded_tables[name]
+
+
+def main():  # Rebuilds the cache file, for example after changing the seed or the table builders
+    tables = build_tables()
+    save_tables(tables)
+    print(f"Wrote {len(tables)} tables to {TABLE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,248 +1,493 @@
-from evaluation_functions import EvaluationFunction
+from board_representation import ChessBoard
+from evaluation_functions import EvaluationCache, EvaluationFunction, PawnHashTable
+from memory_budget import MemoryBudget
+from precomputed_tables import get_table
+from static_exchange import order_moves
+from timer import profiler
+from itertools import islice
 import numpy as np
+import sys
+import time
+
+WARM_UP_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# Remaining depth at or below which captures losing material are pruned
+SEE_PRUNING_DEPTH = 1
 
 
 class TranspositionTable:  # Class for storing previously evaluated positions to save on computations at higher depths
-    def __init__(self):
+    def __init__(self, capacity=None):
         self.table = (
             {}
         )  # Initialises a dictionary to store the hashed key and depth and evaluation
+        self.capacity = capacity  # Most positions held at once, or None for no limit
 
+    @profiler.profile("tt_probe")
     def lookup(
         self, key
     ):  # Method to fetch the data related to the unique hash of the position
         return self.table.get(key)
 
+    @profiler.profile("tt_store")
     def store(
         self, key, score, depth
-    ):  # Stores an evaluated position in the dictionary with relevant information
+    ):  # Stores an evaluated position in the dictionary with relevant information, moving it to the newest end
+        self.table.pop(
+            key, None
+        )  # Re-inserted, so eviction drops the least recently stored
+
+        if self.capacity is not None and len(self.table) >= self.capacity:
+            self.shrink()
+
         self.table[key] = {"score": score, "depth": depth}
 
+    def shrink(
+        self, capacity=None
+    ):  # Drops the least recently stored positions, which the dictionary keeps first, down to half the capacity or the given size
+        target = capacity if capacity is not None else (self.capacity or 0) // 2
+        excess = len(self.table) - target
+
+        if excess > 0:
+            for key in list(islice(self.table, excess)):
+                del self.table[key]
+
+    def memory_usage(
+        self,
+    ):  # Estimated bytes held, sizing one entry as they are all built alike
+        if not self.table:
+            return sys.getsizeof(self.table)
+
+        key, entry = next(iter(self.table.items()))
+        entry_bytes = (
+            sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry["score"])
+        )
+
+        return sys.getsizeof(self.table) + len(self.table) * entry_bytes
+
 
 class ZobristHash:  # Hashing algorithm to uniquely hash a ChessBoard objects's array of 13 bitboards
-    def __init__(self, shape=(13,)):
-        self.keys = np.random.randint(
-            2**64, size=shape, dtype=np.uint64
-        )  # Assigns each bitboard a random integer
+    def __init__(self, keys=None):
+        # Assigns each bitboard a seeded random integer, the same in every run and process
+        self.keys = keys if keys is not None else get_table("position_keys")
 
+    @profiler.profile("hash")
     def generate_key(self, position):  # Hashes the array of bitboards to a unique key
         return np.bitwise_xor.reduce(position * self.keys)
 
 
-# Initialises an object of each class for future use
-transposition_table = TranspositionTable()
-eval = EvaluationFunction()
-hash = ZobristHash()
+class SearchAborted(
+    Exception
+):  # Raised from deep within a search once one of its limits has been reached
+    pass
 
 
-def minimax(board, depth, maximizing_player):
-    if depth == 0 or board.is_game_over():
-        return None, eval.evaluate(board)
+class SearchLimits:  # Node and time budgets for a search, checked as nodes are visited
+    def __init__(self, nodes=None, movetime=None, stop_event=None):
+        self.nodes = nodes
+        self.deadline = (
+            None if movetime is None else time.perf_counter() + movetime / 1000
+        )  # Move time is given in milliseconds
+        self.stop_event = stop_event  # Lets another thread end the search at any node
 
-    if maximizing_player:
-        best_move = None
-        max_eval = -float("inf")
+    def exceeded(self, nodes_searched):
+        if self.nodes is not None and nodes_searched >= self.nodes:
+            return True
 
-        for move in board.generate_legal_moves():
-            board.make_move(move)
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
 
-            _, eval = minimax(board, depth - 1, False)
-            eval = -eval
+        # Reading the clock is comparatively slow, so it is only checked every 64 nodes
+        return (
+            self.deadline is not None
+            and nodes_searched % 64 == 0
+            and time.perf_counter() >= self.deadline
+        )
 
-            board.undo_move()
 
-            if eval > max_eval:
-                max_eval = eval
-                best_move = move
+class SearchStatistics:  # Counters describing the most recent search
+    def __init__(self):
+        self.nodes = 0
+        self.depth = 0
+
+
+class SearchContext:  # Owns everything one search engine needs, so independent engines can share a process without sharing tables
+    def __init__(self, evaluator=None, memory_budget=None):
+        self.hash = ZobristHash()
+        self.transposition_table = TranspositionTable()
+        self.evaluator = evaluator if evaluator is not None else EvaluationFunction()
+        self.set_memory_budget(memory_budget or MemoryBudget())
+        self.statistics = SearchStatistics()
+        self.limits = None  # Limits of the search in progress, if it has any
+        self.profile = None  # Time spent per section in the last search, if profiled
+        self.tracer = None  # A SearchTracer recording every node visited, if set
+
+    def set_memory_budget(
+        self, memory_budget
+    ):  # Resizes every cache to its share of the budget, emptying the fixed-size ones
+        self.memory_budget = memory_budget
+        self.transposition_table.capacity = memory_budget.transposition_capacity()
+        self.transposition_table.shrink(self.transposition_table.capacity)
+        self.evaluation_cache = EvaluationCache(memory_budget.evaluation_index_bits())
+
+        if hasattr(self.evaluator, "pawn_hash_table"):  # NNUEEvaluator has none
+            self.evaluator.pawn_hash_table = PawnHashTable(
+                memory_budget.pawn_index_bits()
+            )
+
+    def memory_usage(
+        self, board=None
+    ):  # Bytes actually used by each budgeted component, and by a board's move history if given
+        usage = {
+            "transposition_table": self.transposition_table.memory_usage(),
+            "evaluation_cache": self.evaluation_cache.memory_usage(),
+        }
+
+        if hasattr(self.evaluator, "pawn_hash_table"):
+            usage["pawn_cache"] = self.evaluator.pawn_hash_table.memory_usage()
+
+        # Not budgeted, as undo_move needs every position of the game, but reported so that long games show up
+        if board is not None:
+            usage["position_history"] = sys.getsizeof(board.previous_positions) + sum(
+                sys.getsizeof(position) for position in board.previous_positions
+            )
+
+        return usage
+
+    def new_game(self):  # Forgets every stored position, as between unrelated games
+        self.transposition_table.table.clear()
+        self.evaluation_cache.clear()
+
+    def warm_up(
+        self, fen=WARM_UP_FEN, depth=2
+    ):  # Runs a shallow search so that one-off setup costs are paid before the first real search
+        self.search_position(ChessBoard(fen), depth)
+        self.new_game()
+
+    def count_node(
+        self,
+    ):  # Counts a visited node, aborting the search if it has run out of budget
+        self.statistics.nodes += 1
+
+        if self.limits is not None and self.limits.exceeded(self.statistics.nodes):
+            raise SearchAborted()
+
+    def set_evaluation_function(
+        self, evaluator
+    ):  # Swaps in another evaluator, such as NNUEEvaluator, for every later search
+        self.evaluator = evaluator
+        self.evaluation_cache.clear()  # Scores from the previous evaluator are no longer valid
+
+        if hasattr(evaluator, "pawn_hash_table"):
+            evaluator.pawn_hash_table = PawnHashTable(
+                self.memory_budget.pawn_index_bits()
+            )
+
+    def cached_evaluate(
+        self, board, key
+    ):  # Consults the evaluation cache before falling back to a full evaluation
+        score = self.evaluation_cache.probe(key)
+
+        if score is None:  # Only evaluate positions which have not been seen before
+            score = self.evaluator.evaluate(board)
+            self.evaluation_cache.store(key, score)
+
+        return score
+
+    def minimax(
+        self, board, depth, maximizing_player
+    ):  # Scores are from the point of view of the side to move at the root
+        if depth == 0 or board.is_game_over()[0]:
+            score = self.evaluator.evaluate(board)  # From the side to move's view
+            return None, score if maximizing_player else -score
 
-        return best_move, max_eval
-    else:
         best_move = None
-        min_eval = float("inf")
+        best_score = -float("inf") if maximizing_player else float("inf")
 
         for move in board.generate_legal_moves():
             board.make_move(move)
-
-            _, eval = minimax(board, depth - 1, True)
-            eval = -eval
-
+            _, score = self.minimax(board, depth - 1, not maximizing_player)
             board.undo_move()
 
-            if eval < min_eval:
-                min_eval = eval
+            if (score > best_score) if maximizing_player else (score < best_score):
+                best_score = score
                 best_move = move
 
-        return best_move, min_eval
-
+        return best_move, best_score
 
-def minimax_alpha_beta(board, depth, alpha, beta, maximizing_player):
-    if depth == 0 or board.is_game_over():
-        return None, eval.evaluate(board)
+    def minimax_alpha_beta(self, board, depth, alpha, beta, maximizing_player):
+        if depth == 0 or board.is_game_over()[0]:
+            score = self.evaluator.evaluate(board)
+            return None, score if maximizing_player else -score
 
-    if maximizing_player:
         best_move = None
-        max_eval = -float("inf")
+        best_score = -float("inf") if maximizing_player else float("inf")
 
         for move in board.generate_legal_moves():
             board.make_move(move)
-
-            _, eval = minimax_alpha_beta(board, depth - 1, alpha, beta, False)
-            eval = -eval
-
+            _, score = self.minimax_alpha_beta(
+                board, depth - 1, alpha, beta, not maximizing_player
+            )
             board.undo_move()
 
-            if eval > max_eval:
-                max_eval = eval
-                best_move = move
+            if maximizing_player:
+                if score > best_score:
+                    best_score, best_move = score, move
+                alpha = max(alpha, score)
+            else:
+                if score < best_score:
+                    best_score, best_move = score, move
+                beta = min(beta, score)
 
-            alpha = max(alpha, eval)
             if beta <= alpha:
                 break
 
-        return best_move, max_eval
-    else:
+        return best_move, best_score
+
+    def negamax(self, board, depth, color):
+        if depth == 0 or board.is_game_over()[0]:
+            # The board is always seen from the side to move, so color stays the same at every ply
+            return None, color * self.evaluator.evaluate(board)
+
         best_move = None
-        min_eval = float("inf")
+        max_score = -float("inf")
 
         for move in board.generate_legal_moves():
             board.make_move(move)
 
-            _, eval = minimax_alpha_beta(board, depth - 1, alpha, beta, True)
-            eval = -eval
-
+            _, score = self.negamax(board, depth - 1, color)
+            score = -score
             board.undo_move()
 
-            if eval < min_eval:
-                min_eval = eval
+            if score > max_score:
+                max_score = score
                 best_move = move
 
-            beta = min(beta, eval)
-            if beta <= alpha:
-                break
-
-        return best_move, min_eval
-
-
-def negamax(board, depth, color):
-    if depth == 0 or board.is_game_over():
-        return None, color * eval.evaluate(board)
-
-    best_move = None
-    max_score = -float("inf")
-
-    for move in board.generate_legal_moves():
-        board.make_move(move)
-
-        _, score = negamax(board, depth - 1, -color)
-        score = -score
-        board.undo_move()
-
-        if score > max_score:
-            max_score = score
-            best_move = move
+        return best_move, max_score
+
+    def negamax_alpha_beta_top(
+        self, board, depth, alpha, beta, color
+    ):  # Negamax split into two functions to save memory by not storing the best move at every recursion call, but only at the top level
+        self.count_node()
+        key = self.hash.generate_key(
+            board.all_bitboards
+        )  # Generate a unique key for the current position
+        tracer = self.tracer
+        original_alpha = alpha
+
+        if tracer is not None:
+            tracer.start_iteration(board)
+
+        # If the game is over before the final depth is reached
+        if board.is_game_over()[0]:
+            print(
+                "White won"
+                if (board.is_game_over()[1] > 0) == board.white_to_move
+                else "Black won"
+            )  # Check the second argument which indicates whether the side to move won
+            depth = 0  # Resets the depth to trigger the next selection statement
+
+        if depth == 0:  # If the final depth has been reached
+            return None, color * self.cached_evaluate(
+                board, key
+            )  # No static best move function so just returns evaluation
+
+        # Initialise variables to starting values
+        best_move = None
+        best_score = -float("inf")
+
+        # Loop through all the legal moves in the current position, generated afresh as the list left on the board may be stale
+        board.generate_legal_moves()
+        moves, losing_captures = order_moves(board)
+
+        for move in moves + losing_captures:
+            board.make_move(move)  # Make the current iterated move
+            if tracer is not None:
+                tracer.enter(board, move)
+
+            score = -self.negamax_alpha_beta(
+                board, depth - 1, -beta, -alpha, color
+            )  # Call the function from the other colour's perspective, with negative values to represent this
+            board.undo_move()  # Undo the move, to prepare the board for the next move in the loop to be made
+
+            if (
+                score > best_score
+            ):  # If it has found a move which produces a better evaluation
+                best_score = score  # Replace the best score with this newly found score
+                best_move = move  #  Replace the best move with this newly found move
+
+            # Alpha-beta pruning
+            alpha = max(
+                alpha, score
+            )  # Makes alpha the biggest value out of alpha and score
+
+            if alpha >= beta:  # If the beta cut-off is reached
+                break  # Stop searching this branch
+
+        self.transposition_table.store(
+            key, best_score, depth
+        )  # Store the evaluated position in the transposition table
+
+        if tracer is not None:
+            tracer.record(
+                board,
+                key,
+                depth,
+                original_alpha,
+                beta,
+                best_score,
+                tracer.CUTOFF if best_score >= beta else 0,
+            )
+
+        return (
+            best_move,
+            best_score,
+        )  # Return the best move to be played and the associated evaluation of the position
+
+    def negamax_alpha_beta(
+        self, board, depth, alpha, beta, color
+    ):  # For recursion calls of negamax
+        self.count_node()
+        key = self.hash.generate_key(
+            board.all_bitboards
+        )  # Generate a unique key for the current position
+        tracer = self.tracer
+        original_alpha = alpha
+
+        entry = self.transposition_table.lookup(key)
+        if (
+            entry is not None and entry["depth"] >= depth
+        ):  # Checks if the current position has already been searched at an equal or greater depth
+            if tracer is not None:
+                tracer.record(
+                    board, key, depth, alpha, beta, entry["score"], tracer.TT_HIT
+                )
+            return entry[
+                "score"
+            ]  # Return the previously computed evaluation for the position
+
+        if board.is_game_over()[0]:
+            if tracer is not None:
+                tracer.record(
+                    board,
+                    key,
+                    depth,
+                    alpha,
+                    beta,
+                    board.is_game_over()[1],
+                    tracer.TERMINAL,
+                )
+            return board.is_game_over()[1]
+
+        if depth == 0:  # If no more searching for this branch is needed
+            score = color * self.cached_evaluate(board, key)
+            if tracer is not None:
+                tracer.record(board, key, depth, alpha, beta, score, tracer.LEAF)
+            return score
+
+        # Initialise the starting score for this search branch
+        best_score = -float("inf")
+
+        # Search through each legal move in the position, captures which lose material last
+        board.generate_legal_moves()
+        moves, losing_captures = order_moves(board)
+
+        # Just above the leaves they are skipped, as the static evaluation after them would miss the recapture, unless nothing else can be played or they may be the only way out of check
+        if losing_captures and (
+            depth > SEE_PRUNING_DEPTH or not moves or board.is_in_check()
+        ):
+            moves += losing_captures
+
+        for move in moves:
+            board.make_move(move)  # Make the move to be searched through
+            if tracer is not None:
+                tracer.enter(board, move)
+
+            score = -self.negamax_alpha_beta(
+                board, depth - 1, -beta, -alpha, color
+            )  # Call the function with a decremented depth and from the other colour's perspective
+            board.undo_move()  # Undo the move
+
+            best_score = max(best_score, score)  # Update the max score
+
+            # Alpha-beta pruning
+            alpha = max(alpha, score)  # Update the alpha value
+
+            if alpha >= beta:  # Trigger the beta cut-off
+                break  # Stop searching
+
+        self.transposition_table.store(
+            key, best_score, depth
+        )  # Store the searched position in the transposition table with relevant data
+
+        if tracer is not None:
+            tracer.record(
+                board,
+                key,
+                depth,
+                original_alpha,
+                beta,
+                best_score,
+                tracer.CUTOFF if best_score >= beta else 0,
+            )
+
+        return best_score  # Return the best score for this branch of the position
+
+    def search_position(
+        self,
+        board,
+        depth=None,
+        nodes=None,
+        movetime=None,
+        on_iteration=None,
+        limits=None,
+    ):  # Iterative deepening over negamax_alpha_beta_top until a limit is reached, passing each finished depth to on_iteration
+        # Prepared limits take the place of the node and time budgets, and may be changed by another thread mid-search
+        self.limits = limits if limits is not None else SearchLimits(nodes, movetime)
+        self.statistics.nodes = 0
+        self.statistics.depth = 0
+
+        root_history = len(board.previous_positions)
+        best_move = None
+        best_score = 0
 
-    return best_move, max_score
+        # Sections timed during this search alone are kept as its profile
+        snapshot = profiler.snapshot() if profiler.enabled else None
 
+        with profiler.section("search"):
+            try:
+                for current_depth in range(1, (depth or 64) + 1):
+                    move, score = self.negamax_alpha_beta_top(
+                        board, current_depth, -float("inf"), float("inf"), 1
+                    )
 
-def negamax_alpha_beta_top(
-    board, depth, alpha, beta, color
-):  # Negamax split into two functions to save memory by not storing the best move at every recursion call, but only at the top level
-    key = hash.generate_key(
-        board.all_bitboards
-    )  # Generate a unique key for the current position
+                    if (
+                        move is None
+                    ):  # The game is already over, so deeper searches are pointless
+                        break
 
-    if board.is_game_over()[0]:  # If the game is over before the final depth is reached
-        print(
-            "White won" if board.is_game_over()[1] > 0 else "Black won"
-        )  # Check the second argument which indicates who won
-        depth = 0  # Resets the depth to trigger the next selection statement
+                    # Only results from completed iterations are trusted
+                    best_move, best_score = move, score
+                    self.statistics.depth = current_depth
 
-    if depth == 0:  # If the final depth has been reached
-        return None, color * eval.evaluate(
-            board
-        )  # No static best move function so just returns evaluation
+                    if on_iteration is not None:
+                        on_iteration(current_depth, best_move, best_score)
+            except SearchAborted:
+                while (
+                    len(board.previous_positions) > root_history
+                ):  # Takes back the moves of the abandoned iteration
+                    board.undo_move()
+            finally:
+                self.limits = None
 
-    # Initialise variables to starting values
-    best_move = None
-    best_score = -float("inf")
+        self.profile = profiler.report(snapshot) if snapshot is not None else None
 
-    # Loop through all the legal moves in the current position
-    for move in board.legal_moves:
-        board.make_move(move)  # Make the current iterated move
-        score = -negamax_alpha_beta(
-            board, depth - 1, -beta, -alpha, color
-        )  # Call the function from the other colour's perspective, with negative values to represent this
-        board.undo_move()  # Undo the move, to prepare the board for the next move in the loop to be made
+        board.generate_legal_moves()
 
         if (
-            score > best_score
-        ):  # If it has found a move which produces a better evaluation
-            best_score = score  # Replace the best score with this newly found score
-            best_move = move  #  Replace the best move with this newly found move
-
-        # Alpha-beta pruning
-        alpha = max(
-            alpha, score
-        )  # Makes alpha the biggest value out of alpha and score
-
-        if alpha >= beta:  # If the beta cut-off is reached
-            break  # Stop searching this branch
-
-    transposition_table.store(
-        key, best_score, depth
-    )  # Store the evaluated position in the transposition table
-    return (
-        best_move,
-        best_score,
-    )  # Return the best move to be played and the associated evaluation of the position
-
-
-def negamax_alpha_beta(
-    board, depth, alpha, beta, color
-):  # For recursion calls of negamax
-    key = hash.generate_key(
-        board.all_bitboards
-    )  # Generate a unique key for the current position
-    if (
-        key in transposition_table.table
-        and transposition_table.table[key]["depth"]
-        >= depth  # Checks if the current position has already been searched at an equal or greater depth
-    ):
-        return transposition_table.table[key][
-            "score"
-        ]  # Return the previously computed evaluation for the position
-        
-    if board.is_game_over()[0]:
-        return board.is_game_over()[1]
-
-    if depth == 0:  # If no more searching for this branch is needed
-        return color * eval.evaluate(board)
-    
-    
-
-    best_score = -float("inf")  # Initialise the starting score for this search branch
-
-    # Search through each legal move in the position
-    board.generate_legal_moves()
-    for move in board.legal_moves:
-        board.make_move(move)  # Make the move to be searched through
-        score = -negamax_alpha_beta(
-            board, depth - 1, -beta, -alpha, color
-        )  # Call the function with a decremented depth and from the other colour's perspective
-        board.undo_move()  # Undo the move
-
-        best_score = max(best_score, score)  # Update the max score
-
-        # Alpha-beta pruning
-        alpha = max(alpha, score)  # Update the alpha value
-
-        if alpha >= beta:  # Trigger the beta cut-off
-            break  # Stop searching
-
-    transposition_table.store(
-        key, best_score, depth
-    )  # Store the searched position in the transposition table with relevant data
-    return best_score  # Return the best score for this branch of the position
+            best_move is None and len(board.legal_moves) > 0
+        ):  # Ran out of budget before even the first iteration finished
+            best_move = board.legal_moves[0]
+
+        return best_move, best_score
 
 
 class Node:
@@ -0,0 +1,357 @@
+import argparse
+import os
+
+import numpy as np
+
+from board_representation import ChessBoard
+from fen_handling import InvalidFEN
+from notation_handling import decompose_notation, encode_square, move_to_uci
+from search_algorithms import SearchContext
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# One searched node in 32 bytes, written as the search leaves it, so children always come before their parent
+trace_record_dtype = np.dtype(
+    [
+        ("key", "<u8"),  # Position hash
+        ("alpha", "<f4"),  # Window the node was searched with
+        ("beta", "<f4"),
+        ("score", "<f4"),  # Score returned, from the side to move's view
+        ("move", "<u2"),  # Move leading to the node, as packed by encode_trace_move
+        ("ply", "u1"),  # Distance from the root
+        ("depth", "u1"),  # Remaining depth
+        ("flags", "u1"),
+        ("children", "u1"),  # Moves searched from the node before it returned
+        ("reserved", "u1", (6,)),  # Keeps records aligned to 32 bytes
+    ]
+)
+
+# Flags describing how a node was resolved
+CUTOFF = 1  # Failed high, so its remaining moves were skipped
+TT_HIT = 2  # Answered by the transposition table
+LEAF = 4  # Evaluated at the end of the search depth
+TERMINAL = 8  # The game was over
+ROOT = 16
+
+NO_MOVE = 0xFFFF
+RESERVED = (0,) * 6
+PROMOTION_CODES = {None: 0, "N": 1, "B": 2, "R": 3, "Q": 4}
+PROMOTION_PIECES = [None, "N", "B", "R", "Q"]
+
+# Traces start with one record's worth of header, so that the records which follow stay aligned
+TRACE_MAGIC = b"MEHTRC"
+TRACE_VERSION = 2  # Version 1 did not record the side to move at the root
+HEADER_SIZE = trace_record_dtype.itemsize
+# Byte after the version holding whether white was to move at the root, as moves are stored from the side to move's view
+SIDE_OFFSET = len(TRACE_MAGIC) + 2
+DEFAULT_BUFFER_RECORDS = 65536  # Records held in memory between writes, 2 MB
+
+
+class InvalidTrace(Exception):
+    def __init__(self, path, reason):
+        self.message = f'"{path}" is not a valid search trace: {reason}'
+        super().__init__(self.message)
+
+
+def encode_trace_move(
+    move,
+):  # Packs a move into 16 bits, start square in the low 6, end square in the next 6 and promotion above them
+    start_square, end_square, promotion_piece = decompose_notation(str(move))
+    promotion = PROMOTION_CODES[promotion_piece.upper() if promotion_piece else None]
+
+    return start_square | end_square << 6 | promotion << 12
+
+
+def decode_trace_move(code):  # The move, in make_move's notation, or None for the root
+    if code == NO_MOVE:
+        return None
+
+    promotion = PROMOTION_PIECES[code >> 12]
+    return f"{encode_square(code & 63)}{encode_square(code >> 6 & 63)}{promotion or ''}"
+
+
+class SearchTracer:  # Streams every node a search visits to a binary file through a fixed-size buffer
+    CUTOFF, TT_HIT, LEAF, TERMINAL, ROOT = CUTOFF, TT_HIT, LEAF, TERMINAL, ROOT
+
+    def __init__(self, path, buffer_records=DEFAULT_BUFFER_RECORDS):
+        self.path = path
+        self.buffer_records = buffer_records
+        self.stream = open(path, "wb")
+        self.stream.write(
+            TRACE_MAGIC
+            + TRACE_VERSION.to_bytes(2, "little")
+            + bytes(HEADER_SIZE - len(TRACE_MAGIC) - 2)
+        )
+
+        self.records = np.zeros(buffer_records, dtype=trace_record_dtype)
+        self.count = 0  # Records buffered since the last write
+        self.written = 0
+        self.side_recorded = False
+        self.root_length = 0  # History length of the root, from which plies are counted
+        self.moves = {}  # Move leading to the node at each history length
+        self.children = {}  # Moves searched so far from the node at each history length
+        self.move_codes = {}  # Packed moves, as the same moves recur throughout a tree
+
+    def start_iteration(self, board):  # Marks the board's position as the root
+        self.root_length = len(board.previous_positions)
+        self.children[self.root_length] = 0
+
+        if (
+            not self.side_recorded
+        ):  # Filled into the header, which was written before the root was known
+            self.stream.seek(SIDE_OFFSET)
+            self.stream.write(bytes([board.white_to_move]))
+            self.stream.seek(0, os.SEEK_END)
+            self.side_recorded = True
+
+    def enter(
+        self, board, move
+    ):  # Called just after a move is made, before the node it leads to is searched
+        length = len(board.previous_positions)
+        self.moves[length] = move
+        self.children[length] = 0
+        self.children[length - 1] += 1
+
+    def record(
+        self, board, key, depth, alpha, beta, score, flags
+    ):  # Buffers a node as the search leaves it, writing the buffer out once it is full
+        length = len(board.previous_positions)
+        ply = length - self.root_length
+
+        if ply == 0:
+            move_code = NO_MOVE
+            flags |= ROOT
+        else:
+            move = self.moves[length]
+            move_code = self.move_codes.get(move)
+
+            if move_code is None:
+                move_code = self.move_codes[move] = encode_trace_move(move)
+
+        self.records[self.count] = (
+            int(key),
+            alpha,
+            beta,
+            score,
+            move_code,
+            min(ply, 255),
+            min(depth, 255),
+            flags,
+            min(self.children[length], 255),
+            RESERVED,
+        )
+        self.count += 1
+
+        if self.count == self.buffer_records:
+            self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+
+        self.stream.write(self.records[: self.count].tobytes())
+        self.written += self.count
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+        return False
+
+
+def read_trace_header(
+    path,
+):  # Whether white was to move at the root, checking the header is one this reader understands
+    with open(path, "rb") as stream:
+        header = stream.read(HEADER_SIZE)
+
+    if len(header) < HEADER_SIZE or not header.startswith(TRACE_MAGIC):
+        raise InvalidTrace(path, "missing header")
+
+    version = int.from_bytes(header[len(TRACE_MAGIC) : SIDE_OFFSET], "little")
+    if version not in (1, TRACE_VERSION):
+        raise InvalidTrace(path, f"unsupported version {version}")
+
+    # Version 1 traces did not record the side, and were mostly of white to move
+    return version == 1 or header[SIDE_OFFSET] != 0
+
+
+def open_trace(
+    path,
+):  # Maps a trace's records into memory without reading them, however large the file
+    read_trace_header(path)
+
+    record_bytes = os.path.getsize(path) - HEADER_SIZE
+    if record_bytes % trace_record_dtype.itemsize:
+        raise InvalidTrace(path, "truncated record")
+
+    if record_bytes == 0:
+        return np.zeros(0, dtype=trace_record_dtype)
+
+    return np.memmap(path, dtype=trace_record_dtype, mode="r", offset=HEADER_SIZE)
+
+
+def summarise_trace(
+    records,
+):  # Node counts, cut-offs and table hits per ply, with the effective branching factor and move ordering quality
+    flags = records["flags"]
+    interior = (flags & (TT_HIT | LEAF | TERMINAL)) == 0
+    cutoffs = (flags & CUTOFF) != 0
+
+    plies = []
+    counts = np.bincount(records["ply"], minlength=1)
+
+    for ply in range(len(counts)):
+        at_ply = records["ply"] == ply
+        plies.append(
+            {
+                "ply": ply,
+                "nodes": int(counts[ply]),
+                "cutoffs": int(np.count_nonzero(cutoffs & at_ply)),
+                "tt_hits": int(np.count_nonzero(((flags & TT_HIT) != 0) & at_ply)),
+                "leaves": int(np.count_nonzero(((flags & LEAF) != 0) & at_ply)),
+            }
+        )
+
+    searched_children = records["children"][interior].astype(np.int64)
+
+    return {
+        "nodes": len(records),
+        "iterations": int(np.count_nonzero(flags & ROOT)),
+        "interior": int(np.count_nonzero(interior)),
+        "leaves": int(np.count_nonzero(flags & LEAF)),
+        "terminal": int(np.count_nonzero(flags & TERMINAL)),
+        "tt_hits": int(np.count_nonzero(flags & TT_HIT)),
+        "cutoffs": int(np.count_nonzero(cutoffs)),
+        # Children searched per interior node, lower meaning more pruning
+        "branching_factor": (
+            float(searched_children.mean()) if len(searched_children) else 0.0
+        ),
+        # The share of cut-offs caused by the first move tried, which good move ordering keeps high
+        "first_move_cutoffs": (
+            float(np.count_nonzero(records["children"][cutoffs] == 1) / cutoffs.sum())
+            if cutoffs.any()
+            else 0.0
+        ),
+        "plies": plies,
+    }
+
+
+def format_record(
+    record, root_white_to_move=True
+):  # One line describing a node, with its move in UCI's real squares
+    flags = record["flags"]
+    ply = int(record["ply"])
+    move = decode_trace_move(int(record["move"]))
+
+    # The move into a node at an odd ply was made by the side to move at the root
+    if move is not None:
+        move = move_to_uci(move, root_white_to_move == (ply % 2 == 1))
+
+    names = [
+        name
+        for name, flag in (
+            ("root", ROOT),
+            ("cutoff", CUTOFF),
+            ("tt", TT_HIT),
+            ("leaf", LEAF),
+            ("terminal", TERMINAL),
+        )
+        if flags & flag
+    ]
+
+    return (
+        f"{'  ' * ply}{move or 'root'} "
+        f"depth {record['depth']} window [{record['alpha']:g}, {record['beta']:g}] "
+        f"score {record['score']:g} children {record['children']} key {record['key']:016x} "
+        f"{' '.join(names)}"
+    ).rstrip()
+
+
+def record_search(
+    fen, depth, path, buffer_records=DEFAULT_BUFFER_RECORDS
+):  # Searches a position with tracing on, returning the best move in UCI notation, score and nodes written
+    board = ChessBoard(fen)
+    context = SearchContext()
+
+    with SearchTracer(path, buffer_records) as tracer:
+        context.tracer = tracer
+        move, score = context.search_position(board, depth)
+
+    if move is not None:
+        move = move_to_uci(move, board.white_to_move)
+
+    return move, score, tracer.written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Record, summarise and print binary traces of the nodes a search visits"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="trace a search of one position")
+    record_parser.add_argument("trace")
+    record_parser.add_argument("--fen", default=STARTING_FEN)
+    record_parser.add_argument("--depth", type=int, default=3)
+
+    summary_parser = commands.add_parser("summary", help="totals and per-ply counts")
+    summary_parser.add_argument("trace")
+
+    dump_parser = commands.add_parser("dump", help="print records as text")
+    dump_parser.add_argument("trace")
+    dump_parser.add_argument(
+        "--max-ply", type=int, default=None, help="skip nodes deeper than this"
+    )
+    dump_parser.add_argument("--limit", type=int, default=100)
+
+    arguments = parser.parse_args()
+
+    try:
+        if arguments.command == "record":
+            move, score, written = record_search(
+                arguments.fen, arguments.depth, arguments.trace
+            )
+            print(f"Best move {move} scoring {score}, traced {written} nodes")
+            return
+
+        root_white_to_move = read_trace_header(arguments.trace)
+        records = open_trace(arguments.trace)
+    except (InvalidFEN, InvalidTrace) as error:
+        parser.exit(1, f"{error.message}\n")
+
+    if arguments.command == "summary":
+        summary = summarise_trace(records)
+
+        for name, value in summary.items():
+            if name != "plies":
+                print(
+                    f"{name}: {value:.3f}"
+                    if isinstance(value, float)
+                    else f"{name}: {value}"
+                )
+
+        print(
+            f"{'ply':>4} {'nodes':>10} {'cutoffs':>10} {'tt hits':>10} {'leaves':>10}"
+        )
+        for ply in summary["plies"]:
+            print(
+                f"{ply['ply']:>4} {ply['nodes']:>10} {ply['cutoffs']:>10} "
+                f"{ply['tt_hits']:>10} {ply['leaves']:>10}"
+            )
+    else:
+        if arguments.max_ply is not None:
+            records = records[records["ply"] <= arguments.max_ply]
+
+        for record in records[: arguments.limit]:
+            print(format_record(record, root_white_to_move))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from board_representation import ChessBoard
+from search_algorithms import SearchContext
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# One record per searched position, seen from the side to move, with the result of the game from that side
+training_record_dtype = np.dtype(
+    [
+        ("bitboards", "<u8", (8,)),  # Piece and colour bitboards, side to move in 6
+        ("score", "<i2"),  # Search score in centipawns, clamped to fit
+        ("result", "i1"),  # 1 win, 0 draw, -1 loss for the side to move
+        ("white_to_move", "u1"),
+    ]
+)
+
+# Adjudication thresholds in centipawns, and how many consecutive plies they must hold for
+RESIGN_SCORE = 1000
+RESIGN_PLIES = 6
+DRAW_SCORE = 10
+DRAW_PLIES = 20
+DRAW_MINIMUM_PLY = 60
+
+
+def play_game(
+    seed, depth=None, nodes=None, random_plies=8, max_plies=300
+):  # Plays one engine game from a randomised opening, returning its positions, scores and the white result
+    generator = random.Random(seed)
+    board = ChessBoard(STARTING_FEN)
+    context = SearchContext()  # A fresh table per game keeps memory bounded
+
+    records = []
+    resign_count = 0
+    draw_count = 0
+    white_result = 0.5  # Games which reach the ply limit are drawn
+
+    for ply in range(max_plies):
+        game_over, score = board.is_game_over()
+
+        if game_over:
+            if (
+                score != 0
+            ):  # A king has been captured, score says whether the side to move won
+                white_result = 1.0 if (score > 0) == board.white_to_move else 0.0
+            break
+
+        if ply < random_plies:  # Random openings give every game a different start
+            board.make_move(str(generator.choice(board.legal_moves)))
+            board.generate_legal_moves()
+            continue
+
+        move, score = context.search_position(board, depth=depth, nodes=nodes)
+
+        if move is None:
+            break
+
+        records.append(
+            (
+                board.all_bitboards[:8].copy(),
+                int(np.clip(score, -32767, 32767)),
+                board.white_to_move,
+            )
+        )
+
+        # Adjudicate games which are clearly decided, or clearly drawn, rather than playing them out
+        resign_count = resign_count + 1 if abs(score) >= RESIGN_SCORE else 0
+        draw_count = draw_count + 1 if abs(score) <= DRAW_SCORE else 0
+
+        if resign_count >= RESIGN_PLIES:
+            white_result = 1.0 if (score > 0) == board.white_to_move else 0.0
+            break
+
+        if draw_count >= DRAW_PLIES and ply >= DRAW_MINIMUM_PLY:
+            break
+
+        board.make_move(str(move))
+        board.generate_legal_moves()
+
+    return records, white_result
+
+
+def encode_records(
+    records, white_result
+):  # Packs a finished game's positions into training records
+    encoded = np.zeros(len(records), dtype=training_record_dtype)
+
+    for index, (bitboards, score, white_to_move) in enumerate(records):
+        result = white_result if white_to_move else 1.0 - white_result
+
+        encoded[index]["bitboards"] = bitboards
+        encoded[index]["score"] = score
+        encoded[index]["result"] = round(2 * result) - 1
+        encoded[index]["white_to_move"] = white_to_move
+
+    return encoded
+
+
+def generate_shard(
+    path, seeds, depth, nodes, random_plies, max_plies
+):  # Worker task, writing each game to its own shard as soon as it finishes, replacing any shard left by an earlier run with the same seeds
+    positions = 0
+
+    with open(path, "wb") as shard:
+        for seed in seeds:
+            records, white_result = play_game(
+                seed, depth, nodes, random_plies, max_plies
+            )
+            encode_records(records, white_result).tofile(shard)
+            shard.flush()
+            positions += len(records)
+
+    return path, len(seeds), positions
+
+
+def read_training_shard(
+    path,
+):  # Maps a shard into memory as an array of training records without reading it all
+    return np.memmap(path, dtype=training_record_dtype, mode="r")
+
+
+def generate_training_data(
+    output_directory,
+    games,
+    workers=None,
+    depth=None,
+    nodes=None,
+    random_plies=8,
+    max_plies=300,
+    games_per_shard=16,
+    seed=0,
+):  # Plays games across a process pool, every task writing to its own shard so no locking is needed
+    os.makedirs(output_directory, exist_ok=True)
+
+    if depth is None and nodes is None:
+        depth = 2
+
+    seeds = [seed + game for game in range(games)]
+    total_positions = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = [
+            executor.submit(
+                generate_shard,
+                os.path.join(output_directory, f"shard-{seed}-{start:07d}.bin"),
+                seeds[start : start + games_per_shard],
+                depth,
+                nodes,
+                random_plies,
+                max_plies,
+            )
+            for start in range(0, games, games_per_shard)
+        ]
+
+        for task in as_completed(tasks):
+            path, shard_games, positions = task.result()
+            total_positions += positions
+            print(f"{path}: {shard_games} games, {positions} positions")
+
+    return total_positions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate labelled training positions from self-play games"
+    )
+    parser.add_argument("output_directory")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--random-plies", type=int, default=8)
+    parser.add_argument("--max-plies", type=int, default=300)
+    parser.add_argument("--games-per-shard", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    total_positions = generate_training_data(
+        arguments.output_directory,
+        arguments.games,
+        arguments.workers,
+        arguments.depth,
+        arguments.nodes,
+        arguments.random_plies,
+        arguments.max_plies,
+        arguments.games_per_shard,
+        arguments.seed,
+    )
+    print(f"Generated {total_positions} positions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+from bitboard_operations import (
+    DIAGONAL_DIRECTIONS,
+    FULL_BOARD,
+    NORTH,
+    ORTHOGONAL_DIRECTIONS,
+    SOUTH,
+    pawn_attacks,
+    sliding_attacks,
+    to_integers,
+)
+from precomputed_tables import get_table
+from timer import profiler
+
+# Material won or lost in an exchange, in the order of the piece bitboards, matching EvaluationFunction.piece_values
+EXCHANGE_VALUES = [100, 350, 350, 550, 900, 99999]
+PROMOTION_INDICES = {"N": 1, "B": 2, "R": 3, "Q": 4}
+PAWN, KING = 0, 5
+
+knight_attacks = [int(attacks) for attacks in get_table("knight_attacks")]
+king_attacks = [int(attacks) for attacks in get_table("king_attacks")]
+
+
+def attackers_to(
+    bitboards, square, occupied
+):  # Pieces of either side attacking a square, with sliders seeing through any piece removed from the occupancy
+    pawns, knights, bishops, rooks, queens, kings, friendly, opponent = bitboards[:8]
+    target = 1 << square
+    empty = FULL_BOARD ^ occupied
+
+    diagonal = 0
+    for direction in DIAGONAL_DIRECTIONS:
+        diagonal |= sliding_attacks(target, empty, direction)
+
+    orthogonal = 0
+    for direction in ORTHOGONAL_DIRECTIONS:
+        orthogonal |= sliding_attacks(target, empty, direction)
+
+    # A pawn attacks the square if a pawn of the other side standing there would attack the pawn
+    attackers = (
+        pawn_attacks(target, SOUTH) & pawns & friendly
+        | pawn_attacks(target, NORTH) & pawns & opponent
+        | knight_attacks[square] & knights
+        | king_attacks[square] & kings
+        | diagonal & (bishops | queens)
+        | orthogonal & (rooks | queens)
+    )
+
+    return attackers & occupied
+
+
+def piece_index(
+    bitboards, bit
+):  # Which piece bitboard a square's bit is set in, if any
+    for index in range(6):
+        if bitboards[index] & bit:
+            return index
+    return None
+
+
+def move_squares(
+    move,
+):  # Start square, end square and promotion piece of a move in make_move's notation
+    move = str(move)
+    start_square = ord(move[0]) - 97 + 8 * (ord(move[1]) - 49)
+    end_square = ord(move[2]) - 97 + 8 * (ord(move[3]) - 49)
+
+    return start_square, end_square, move[4].upper() if len(move) > 4 else None
+
+
+def is_tactical(
+    bitboards, move
+):  # Whether a move captures or promotes, the only moves whose exchange is worth evaluating
+    start_square, end_square, promotion = move_squares(move)
+    end = 1 << end_square
+
+    return bool(
+        promotion
+        or end & bitboards[7]
+        or end & bitboards[9]
+        and bitboards[0] & 1 << start_square
+    )
+
+
+def static_exchange_evaluation(
+    bitboards, move
+):  # Material the side to move expects from a move once every capture on its end square has been played out, least valuable attacker first
+    start_square, end_square, promotion = move_squares(move)
+    start, end = 1 << start_square, 1 << end_square
+    occupied = bitboards[6] | bitboards[7]
+
+    moving = piece_index(bitboards, start)
+    captured = piece_index(bitboards, end & bitboards[7])
+
+    if captured is None and moving == PAWN and end & bitboards[9]:
+        captured = PAWN
+        occupied ^= end >> 8  # The pawn taken en passant stands behind the end square
+
+    gains = [EXCHANGE_VALUES[captured] if captured is not None else 0]
+
+    if promotion:
+        moving = PROMOTION_INDICES[promotion]
+        gains[0] += EXCHANGE_VALUES[moving] - EXCHANGE_VALUES[PAWN]
+
+    occupied ^= start
+    attackers = attackers_to(bitboards, end_square, occupied)
+    sides = (bitboards[6], bitboards[7])
+    side = 1  # The opponent recaptures first
+
+    while True:
+        side_attackers = attackers & sides[side]
+        if not side_attackers:
+            break
+
+        # The least valuable attacker recaptures, since anything more valuable would only risk more
+        for index in range(6):
+            pieces = side_attackers & bitboards[index]
+            if pieces:
+                break
+
+        gains.append(EXCHANGE_VALUES[moving] - gains[-1])
+
+        # Removing the attacker reveals any slider lined up behind it
+        occupied ^= pieces & -pieces
+        attackers = attackers_to(bitboards, end_square, occupied)
+
+        # A king may only recapture if nothing can take it back
+        if index == KING and attackers & sides[1 - side]:
+            gains.pop()
+            break
+
+        moving = index
+        side = 1 - side
+
+    # Either side may stop capturing whenever carrying on would lose it material
+    while len(gains) > 1:
+        gains[-2] = -max(-gains[-2], gains[-1])
+        gains.pop()
+
+    return gains[0]
+
+
+@profiler.profile("move_ordering")
+def order_moves(
+    board,
+):  # Splits the board's moves into those worth searching first, winning and even captures best first then quiet moves as generated, and captures losing material, worst last
+    moves = board.legal_moves
+    targets = int(board.all_bitboards[7]) | int(board.all_bitboards[9])
+    end_squares = 0
+    promotions = False
+
+    for move in moves:
+        end_squares |= 1 << ord(move[2]) - 97 + 8 * (ord(move[3]) - 49)
+        promotions = promotions or len(move) > 4
+
+    # Quiet positions skip the exchanges entirely, keeping the generated order
+    if not end_squares & targets and not promotions:
+        return list(moves), []
+
+    bitboards = to_integers(board.all_bitboards)
+    captures, quiet_moves, losing_captures = [], [], []
+
+    for move in moves:
+        if not is_tactical(bitboards, move):
+            quiet_moves.append(move)
+            continue
+
+        exchange = static_exchange_evaluation(bitboards, move)
+        (captures if exchange >= 0 else losing_captures).append((exchange, move))
+
+    captures.sort(key=lambda capture: -capture[0])
+    losing_captures.sort(key=lambda capture: -capture[0])
+
+    return (
+        [move for _, move in captures] + quiet_moves,
+        [move for _, move in losing_captures],
+    )
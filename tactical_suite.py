@@ -0,0 +1,249 @@
+import argparse
+import json
+import shlex
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board_representation import ChessBoard
+from fen_handling import InvalidFEN
+from notation_handling import InvalidNotation, InvalidSquare
+from pgn_handling import InvalidPGN, move_to_san, san_to_move
+from search_algorithms import SearchContext
+
+
+class InvalidEPD(Exception):
+    def __init__(self, line, reason):
+        self.message = f'"{line}" is an invalid EPD record: {reason}'
+        super().__init__(self.message)
+
+
+def parse_epd(
+    line,
+):  # Splits an EPD record into its FEN and operations, such as {"bm": ["Qg6"], "id": ["WAC.001"]}
+    fields = line.split(maxsplit=4)
+    fen = " ".join(fields[:4])
+    operations = {}
+
+    if len(fields) > 4:
+        # Only double quotes group words, and only unquoted semicolons end an operation, so "Kasparov; Topalov" and O'Kelly both survive
+        lexer = shlex.shlex(fields[4], posix=True, punctuation_chars=";")
+        lexer.whitespace_split = True
+        lexer.quotes = '"'
+        words = []
+
+        try:
+            for token in lexer:
+                if token.strip(";"):
+                    words.append(token)
+                    continue
+
+                if words:
+                    operations[words[0]] = words[1:]
+                words = []
+        except ValueError as error:  # An unclosed quotation
+            raise InvalidEPD(line, error)
+
+        if words:  # The final operation may leave out its semicolon
+            operations[words[0]] = words[1:]
+
+    return fen, operations
+
+
+def solve_position(
+    line, depth=None, nodes=None, movetime=None
+):  # Worker task, searching one EPD position and recording when the search settled on a solution
+    result = {"id": line, "fen": None}
+
+    # Any fault in one record is reported against that position rather than stopping the suite
+    try:
+        fen, operations = parse_epd(line)
+        result = {"id": " ".join(operations.get("id", [])) or fen, "fen": fen}
+
+        board = ChessBoard(fen)
+        best_moves = {san_to_move(board, san) for san in operations.get("bm", [])}
+        avoid_moves = {san_to_move(board, san) for san in operations.get("am", [])}
+    except (
+        InvalidEPD,
+        InvalidFEN,
+        InvalidPGN,
+        InvalidNotation,
+        InvalidSquare,
+    ) as error:
+        result["error"] = error.message
+        return result
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+
+    context = SearchContext()  # Positions are scored independently of each other
+    iterations = []
+    start = time.perf_counter()
+
+    def record_iteration(iteration_depth, move, score):
+        iterations.append(
+            (
+                str(move),
+                iteration_depth,
+                time.perf_counter() - start,
+                context.statistics.nodes,
+            )
+        )
+
+    move, score = context.search_position(
+        board, depth, nodes, movetime, record_iteration
+    )
+    elapsed = time.perf_counter() - start
+    move = str(move)
+
+    def is_solution(candidate):
+        return (
+            not best_moves or candidate in best_moves
+        ) and candidate not in avoid_moves
+
+    result.update(
+        {
+            "move": move_to_san(board, move) if move != "None" else None,
+            "score": float(score),
+            "depth": context.statistics.depth,
+            "nodes": context.statistics.nodes,
+            "time": elapsed,
+            "solved": move != "None" and is_solution(move),
+            "time_to_solution": None,
+            "nodes_to_solution": None,
+        }
+    )
+
+    # The solution is only counted from the iteration after which the search never changed its mind
+    if result["solved"]:
+        settled = len(iterations)
+        while settled > 0 and is_solution(iterations[settled - 1][0]):
+            settled -= 1
+
+        if settled < len(iterations):
+            result["time_to_solution"] = iterations[settled][2]
+            result["nodes_to_solution"] = iterations[settled][3]
+        else:  # Ran out of budget before the first iteration, so the fallback move happened to solve it
+            result["time_to_solution"] = elapsed
+            result["nodes_to_solution"] = context.statistics.nodes
+
+    return result
+
+
+def summarise(positions):  # Totals over every position of a run
+    searched = [position for position in positions if "error" not in position]
+    solved = [position for position in searched if position["solved"]]
+    total_time = sum(position["time"] for position in searched)
+    total_nodes = sum(position["nodes"] for position in searched)
+
+    return {
+        "positions": len(positions),
+        "errors": len(positions) - len(searched),
+        "solved": len(solved),
+        "solve_rate": len(solved) / len(searched) if searched else 0.0,
+        "total_time": total_time,
+        "total_nodes": total_nodes,
+        "nodes_per_second": total_nodes / total_time if total_time else 0.0,
+        "mean_time_to_solution": (
+            sum(position["time_to_solution"] for position in solved) / len(solved)
+            if solved
+            else None
+        ),
+    }
+
+
+def run_suite(
+    path, depth=None, nodes=None, movetime=None, workers=None
+):  # Searches every position of an EPD suite across a process pool, returning the report
+    with open(path) as suite:
+        lines = [line.strip() for line in suite if line.strip()]
+
+    if depth is None and nodes is None and movetime is None:
+        depth = 3
+
+    started = time.perf_counter()
+    positions = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = executor.map(
+            solve_position,
+            lines,
+            [depth] * len(lines),
+            [nodes] * len(lines),
+            [movetime] * len(lines),
+        )
+
+        # Results arrive in suite order, so progress is printed as each is collected
+        for position in tasks:
+            positions.append(position)
+            status = (
+                "error"
+                if "error" in position
+                else ("solved" if position["solved"] else "failed")
+            )
+            print(f"{len(positions)}/{len(lines)} {position['id']}: {status}")
+
+    return {
+        "suite": path,
+        "limits": {"depth": depth, "nodes": nodes, "movetime": movetime},
+        "wall_time": time.perf_counter() - started,
+        "summary": summarise(positions),
+        "positions": positions,
+    }
+
+
+def compare_reports(
+    baseline, report
+):  # Positions solved in only one of two runs of the same suite
+    solved_before = {
+        position["id"] for position in baseline["positions"] if position.get("solved")
+    }
+    solved_after = {
+        position["id"] for position in report["positions"] if position.get("solved")
+    }
+
+    return {
+        "gained": sorted(solved_after - solved_before),
+        "lost": sorted(solved_before - solved_after),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run an EPD test suite of bm/am positions and report the solve rate"
+    )
+    parser.add_argument("suite")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--movetime", type=int, default=None, help="milliseconds")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="file to write the JSON report to")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    arguments = parser.parse_args()
+
+    report = run_suite(
+        arguments.suite,
+        arguments.depth,
+        arguments.nodes,
+        arguments.movetime,
+        arguments.workers,
+    )
+    summary = report["summary"]
+    print(
+        f"Solved {summary['solved']}/{summary['positions'] - summary['errors']} "
+        f"({summary['solve_rate']:.1%}), {summary['nodes_per_second']:.0f} nodes/s"
+    )
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            differences = compare_reports(json.load(baseline), report)
+
+        print(f"Gained: {', '.join(differences['gained']) or 'none'}")
+        print(f"Lost: {', '.join(differences['lost']) or 'none'}")
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
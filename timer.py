@@ -1,3 +1,7 @@
+import contextlib
+import functools
+import os
+import threading
 import time
 
 
@@ -32,3 +36,138 @@ class Timer:
         self._start_time = None
 
         print(f"Elapsed time: {elapsed_time:0.4f} seconds")
+
+        return elapsed_time
+
+
+class ProfileSection:  # One entry into a named section, its time charged to the section rather than to the section enclosing it
+    __slots__ = ("profiler", "name", "start", "child_time")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        state = self.profiler.state()
+        state.stack.append(self)
+        state.active[self.name] = state.active.get(self.name, 0) + 1
+        self.child_time = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        elapsed = time.perf_counter() - self.start
+        state = self.profiler.state()
+        state.stack.pop()
+        state.active[self.name] -= 1
+
+        totals = self.profiler.sections.get(self.name)
+        if totals is None:
+            totals = self.profiler.sections[self.name] = [0, 0.0, 0.0]
+
+        totals[0] += 1
+        totals[2] += elapsed - self.child_time
+
+        # A recursive section's time is only counted once, by its outermost entry
+        if state.active[self.name] == 0:
+            totals[1] += elapsed
+
+        if state.stack:
+            state.stack[-1].child_time += elapsed
+
+        return False
+
+
+class Profiler:  # Aggregates call counts, cumulative and self time of named sections, which may nest, doing nothing while disabled
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.sections = {}  # Name to [calls, cumulative seconds, self seconds]
+        self.local = threading.local()  # Each thread nests its own sections
+
+    def state(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+            self.local.active = (
+                {}
+            )  # Entries of each section currently open, to spot recursion
+
+        return self.local
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.sections = {}
+
+    def section(
+        self, name
+    ):  # Context manager timing a block, shared and empty when disabled so it costs next to nothing
+        if not self.enabled:
+            return disabled_section
+
+        return ProfileSection(self, name)
+
+    def profile(
+        self, name=None
+    ):  # Decorator timing every call of a function as a section, named after the function by default
+        def decorator(function):
+            section_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                with ProfileSection(self, section_name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(
+        self,
+    ):  # A copy of the totals so far, for reporting on what happens after it
+        return {name: list(totals) for name, totals in self.sections.items()}
+
+    def report(
+        self, since=None
+    ):  # Totals per section, or only what was added since a snapshot
+        since = since or {}
+        report = {}
+
+        for name, (calls, cumulative, self_time) in self.sections.items():
+            before = since.get(name, [0, 0.0, 0.0])
+
+            if calls > before[0]:
+                report[name] = {
+                    "calls": calls - before[0],
+                    "cumulative": cumulative - before[1],
+                    "self": self_time - before[2],
+                }
+
+        return report
+
+
+def format_profile(
+    report,
+):  # A table of sections, those taking the most time themselves first
+    lines = [f"{'section':<24} {'calls':>10} {'cumulative':>12} {'self':>12}"]
+
+    for name, totals in sorted(
+        report.items(), key=lambda item: item[1]["self"], reverse=True
+    ):
+        lines.append(
+            f"{name:<24} {totals['calls']:>10} {totals['cumulative']:>11.4f}s {totals['self']:>11.4f}s"
+        )
+
+    return "\n".join(lines)
+
+
+disabled_section = contextlib.nullcontext()
+
+# Shared by the engine's hooks, and switched on by setting MEHNGINE_PROFILE or calling profiler.enable()
+profiler = Profiler(enabled=bool(os.environ.get("MEHNGINE_PROFILE")))
@@ -0,0 +1,295 @@
+import sys
+import threading
+import time
+
+from board_representation import ChessBoard
+from fen_handling import InvalidFEN
+from memory_budget import MemoryBudget
+from notation_handling import InvalidNotation, InvalidSquare, move_to_uci, uci_to_move
+from search_algorithms import SearchContext, SearchLimits
+from timer import format_profile, profiler
+
+ENGINE_NAME = "Mehngine"
+ENGINE_AUTHOR = "Mehchu"
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+DEFAULT_HASH = 16  # Megabytes shared between the search's tables
+MINIMUM_HASH = 1
+MAXIMUM_HASH = 1024
+
+MOVE_OVERHEAD = 50  # Milliseconds kept back from every move for communication delays
+# Moves the remaining time is shared between when the GUI does not say
+DEFAULT_MOVES_TO_GO = 30
+INFO_INTERVAL = 1.0  # Seconds between progress reports during a long iteration
+
+GO_PARAMETERS = [
+    "depth",
+    "nodes",
+    "movetime",
+    "wtime",
+    "btime",
+    "winc",
+    "binc",
+    "movestogo",
+]
+
+
+class UCIEngine:  # Reads UCI commands and runs each search on a worker thread, so that stop is acted on mid-search
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        # Search and command threads both write to the GUI
+        self.output_lock = threading.Lock()
+
+        self.board = ChessBoard(STARTING_FEN)
+        self.search_thread = None
+        self.limits = None
+        self.stop_event = threading.Event()  # Ends the search at its next node
+        # Lets an infinite or ponder search send its best move
+        self.release_event = threading.Event()
+        self.search_done = threading.Event()
+        # Time to use once a ponder search becomes a normal one
+        self.ponder_movetime = None
+
+        self.context = SearchContext()
+        self.set_hash_size(DEFAULT_HASH)
+
+    def send(self, message):
+        with self.output_lock:
+            self.output.write(message + "\n")
+            self.output.flush()
+
+    def handle(
+        self, line
+    ):  # Acts on one line from the GUI, returning False once the engine should quit
+        tokens = line.split()
+
+        if not tokens:
+            return True
+
+        command, arguments = tokens[0], tokens[1:]
+
+        match command:
+            case "uci":
+                self.send(f"id name {ENGINE_NAME}")
+                self.send(f"id author {ENGINE_AUTHOR}")
+                self.send(
+                    f"option name Hash type spin default {DEFAULT_HASH} min {MINIMUM_HASH} max {MAXIMUM_HASH}"
+                )
+                self.send("option name Threads type spin default 1 min 1 max 1")
+                self.send(
+                    f"option name Profile type check default {str(profiler.enabled).lower()}"
+                )
+                self.send("uciok")
+            case "isready":
+                self.send("readyok")
+            case "setoption":
+                self.set_option(arguments)
+            case "ucinewgame":
+                self.stop_search()
+                self.context.new_game()
+            case "position":
+                self.stop_search()
+                self.set_position(arguments)
+            case "go":
+                self.stop_search()
+                self.go(arguments)
+            case "stop":
+                self.stop_search()
+            case "ponderhit":
+                self.ponderhit()
+            case "quit":
+                self.stop_search()
+                return False
+            case _:
+                self.send(f"info string unknown command {command}")
+
+        return True
+
+    def set_option(self, arguments):  # setoption name <name> [value <value>]
+        if "value" in arguments:
+            split = arguments.index("value")
+            name, value = " ".join(arguments[1:split]), " ".join(arguments[split + 1 :])
+        else:
+            name, value = " ".join(arguments[1:]), ""
+
+        try:
+            match name.lower():
+                case "hash":
+                    self.set_hash_size(int(value))
+                case "threads":
+                    # Accepted for GUIs which always send it, though the search is single threaded
+                    int(value)
+                case (
+                    "profile"
+                ):  # Times each part of every search, reported after its best move
+                    if value.lower() not in ("true", "false"):
+                        raise ValueError(value)
+                    profiler.enabled = value.lower() == "true"
+                case _:
+                    self.send(f"info string unknown option {name}")
+        except ValueError:
+            self.send(f"info string invalid value {value} for {name}")
+
+    def set_hash_size(
+        self, megabytes
+    ):  # Splits the given size between the transposition table and evaluation caches
+        megabytes = max(MINIMUM_HASH, min(MAXIMUM_HASH, megabytes))
+        self.context.set_memory_budget(MemoryBudget(megabytes * 2**20))
+
+    def set_position(
+        self, arguments
+    ):  # position [startpos | fen <fen>] [moves <move> ...]
+        moves = []
+        if "moves" in arguments:
+            split = arguments.index("moves")
+            arguments, moves = arguments[:split], arguments[split + 1 :]
+
+        try:
+            if arguments and arguments[0] == "fen":
+                board = ChessBoard(" ".join(arguments[1:]))
+            else:
+                board = ChessBoard(STARTING_FEN)
+
+            for move in moves:
+                board.make_move(uci_to_move(move, board.white_to_move))
+                board.generate_legal_moves()
+        except (InvalidFEN, InvalidNotation, InvalidSquare) as error:
+            self.send(f"info string {error.message}")
+            return
+
+        self.board = board
+
+    def allocate_time(
+        self, parameters
+    ):  # Milliseconds to spend on this move under a clock, or None if there is no clock
+        time_left = (
+            parameters["wtime"] if self.board.white_to_move else parameters["btime"]
+        )
+        increment = (
+            parameters["winc"] if self.board.white_to_move else parameters["binc"]
+        ) or 0
+
+        if time_left is None:
+            return None
+
+        moves_to_go = parameters["movestogo"] or DEFAULT_MOVES_TO_GO
+        movetime = time_left / moves_to_go + increment * 3 / 4 - MOVE_OVERHEAD
+
+        return max(1, min(movetime, time_left - MOVE_OVERHEAD))
+
+    def go(self, arguments):
+        parameters = dict.fromkeys(GO_PARAMETERS)
+
+        for index, token in enumerate(arguments[:-1]):
+            if token in parameters:
+                try:
+                    parameters[token] = int(arguments[index + 1])
+                except ValueError:
+                    self.send(f"info string invalid value for {token}")
+
+        infinite = "infinite" in arguments
+        ponder = "ponder" in arguments
+        movetime = parameters["movetime"] or self.allocate_time(parameters)
+
+        if ponder:  # The clock only starts once the opponent plays the expected move
+            self.ponder_movetime, movetime = movetime, None
+
+        self.stop_event.clear()
+        self.release_event.clear()
+        self.search_done.clear()
+        self.limits = SearchLimits(
+            parameters["nodes"], None if infinite else movetime, self.stop_event
+        )
+
+        self.search_thread = threading.Thread(
+            target=self.search,
+            args=(parameters["depth"], self.limits, infinite or ponder),
+            daemon=True,
+        )
+        self.search_thread.start()
+
+        threading.Thread(target=self.report_progress, daemon=True).start()
+
+    def search(
+        self, depth, limits, wait_for_release
+    ):  # Worker thread body, searching and then sending the best move found
+        start = time.perf_counter()
+        white_to_move = self.board.white_to_move
+        statistics = self.context.statistics
+
+        def report_iteration(iteration_depth, move, score):
+            elapsed = time.perf_counter() - start
+            self.send(
+                f"info depth {iteration_depth} score cp {int(score)} nodes {statistics.nodes} "
+                f"nps {int(statistics.nodes / max(elapsed, 1e-3))} time {int(elapsed * 1000)} "
+                f"pv {move_to_uci(move, white_to_move)}"
+            )
+
+        move, score = self.context.search_position(
+            self.board, depth, on_iteration=report_iteration, limits=limits
+        )
+        self.search_done.set()
+
+        if self.context.profile is not None:
+            for line in format_profile(self.context.profile).splitlines():
+                self.send(f"info string {line}")
+
+        if (
+            wait_for_release
+        ):  # Infinite and ponder searches only answer after stop or ponderhit
+            self.release_event.wait()
+
+        self.send(
+            f"bestmove {move_to_uci(move, white_to_move) if move is not None else '0000'}"
+        )
+
+    def report_progress(self):  # Sends node counts while an iteration takes a long time
+        start = time.perf_counter()
+        statistics = self.context.statistics
+
+        while not self.search_done.wait(INFO_INTERVAL):
+            elapsed = time.perf_counter() - start
+            self.send(
+                f"info nodes {statistics.nodes} nps {int(statistics.nodes / elapsed)} "
+                f"time {int(elapsed * 1000)}"
+            )
+
+    def stop_search(
+        self,
+    ):  # Ends any search in progress, waiting for it to send its best move
+        if self.search_thread is None:
+            return
+
+        self.stop_event.set()
+        self.release_event.set()
+        self.search_thread.join()
+        self.search_thread = None
+
+    def ponderhit(
+        self,
+    ):  # The expected move was played, so the ponder search carries on against the clock
+        if self.search_thread is None:
+            return
+
+        if self.ponder_movetime is not None:
+            self.limits.deadline = time.perf_counter() + self.ponder_movetime / 1000
+
+        self.ponder_movetime = None
+        self.release_event.set()
+
+
+def main():
+    engine = UCIEngine(sys.stdout)
+
+    # Anything else printed, such as debugging output from the search, goes to stderr to keep the protocol clean
+    sys.stdout = sys.stderr
+
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+
+    engine.stop_search()
+
+
+if __name__ == "__main__":
+    main()